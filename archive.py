@@ -0,0 +1,225 @@
+import logging
+import mmap
+import os
+import time
+from bisect import bisect_left
+import numpy as np
+from globals import ARCHIVE_KLINES, ARCHIVE_DIR
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'KLINEARC'
+ARCHIVE_VERSION = 1
+RECORD = np.dtype([('timestamp', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                   ('close', '<f8'), ('volume', '<f8')])
+# magic, версия, размер записи
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+# Сколько записей читать за раз при проверке и уплотнении файла
+SCAN_CHUNK = 1_000_000
+
+def _header():
+    header = np.zeros(1, dtype=HEADER)
+    header[0] = (MAGIC, ARCHIVE_VERSION, RECORD.itemsize)
+    return header.tobytes()
+
+class ArchiveFile:
+    """Файл свечей одного (symbol, timeframe): заголовок и записи RECORD по возрастанию времени.
+
+    Запись - дозапись в конец файла, чтение - через mmap: диапазоны
+    возвращаются как представления NumPy без копирования.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.count = 0
+        self.last_timestamp = None
+        self.mapped = None
+        self.records = np.empty(0, dtype=RECORD)
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.check()
+        self.file = open(self.path, 'ab', buffering=0)
+        if self.file.tell() == 0:
+            self.file.write(_header())
+        self.count = (os.path.getsize(self.path) - HEADER.itemsize) // RECORD.itemsize
+        self._remap()
+        self.last_timestamp = int(self.records['timestamp'][-1]) if self.count else None
+
+    def check(self):
+        """Проверка при запуске: заголовок, оборванная последняя запись, порядок времени.
+
+        Файл с чужим заголовком откладывается в .corrupt, недописанная
+        запись обрезается, нарушенный порядок исправляется уплотнением.
+        """
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return
+        with open(self.path, 'rb') as f:
+            raw = f.read(HEADER.itemsize)
+        header = np.frombuffer(raw, dtype=HEADER) if len(raw) == HEADER.itemsize else None
+        if header is None or header['magic'][0] != MAGIC or header['version'][0] != ARCHIVE_VERSION or \
+                header['record_size'][0] != RECORD.itemsize:
+            logger.error("Archive %s has an unknown header, moving it aside", self.path)
+            os.replace(self.path, self.path + '.corrupt')
+            return
+        tail = (size - HEADER.itemsize) % RECORD.itemsize
+        if tail:
+            logger.warning("Archive %s: truncating %d bytes of a partial record", self.path, tail)
+            with open(self.path, 'r+b') as f:
+                f.truncate(size - tail)
+        count = (size - tail - HEADER.itemsize) // RECORD.itemsize
+        if count and not self._ordered(count):
+            self.compact(count)
+
+    def _ordered(self, count):
+        records = np.memmap(self.path, dtype=RECORD, mode='r', offset=HEADER.itemsize, shape=(count,))
+        for start in range(0, count, SCAN_CHUNK):
+            # Перекрытие на одну запись, чтобы проверить границу порций
+            timestamps = np.asarray(records['timestamp'][max(0, start - 1):start + SCAN_CHUNK])
+            if np.any(np.diff(timestamps) <= 0):
+                return False
+        return True
+
+    def compact(self, count):
+        """Перезапись файла: записи по возрастанию времени, повторы отброшены (остается первая)"""
+        started = time.perf_counter()
+        records = np.memmap(self.path, dtype=RECORD, mode='r', offset=HEADER.itemsize, shape=(count,))
+        timestamps = np.array(records['timestamp'])
+        _, first = np.unique(timestamps, return_index=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_header())
+            for start in range(0, len(first), SCAN_CHUNK):
+                records[first[start:start + SCAN_CHUNK]].tofile(f)
+        del records
+        os.replace(tmp_path, self.path)
+        logger.warning("Archive %s compacted: %d -> %d records in %.2fs",
+                       self.path, count, len(first), time.perf_counter() - started)
+
+    def _remap(self):
+        if self.count == 0:
+            self.records = np.empty(0, dtype=RECORD)
+            return
+        # Старое отображение закроется, когда на него не останется представлений
+        with open(self.path, 'rb') as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.records = np.frombuffer(self.mapped, dtype=RECORD, count=self.count, offset=HEADER.itemsize)
+
+    def append(self, rows):
+        """rows - массив RECORD; записи не новее последней пропускаются"""
+        if self.last_timestamp is not None:
+            rows = rows[rows['timestamp'] > self.last_timestamp]
+        if not len(rows):
+            return 0
+        self.file.write(rows.tobytes())
+        self.count += len(rows)
+        self.last_timestamp = int(rows['timestamp'][-1])
+        return len(rows)
+
+    def view(self):
+        if len(self.records) != self.count:
+            self._remap()
+        return self.records
+
+    def range(self, start=None, end=None):
+        """Записи с start <= timestamp < end - представление без копирования"""
+        records = self.view()
+        # bisect по полю mmap читает O(log n) записей; np.searchsorted скопировал бы колонку
+        timestamps = records['timestamp']
+        lo = 0 if start is None else bisect_left(timestamps, start)
+        hi = len(records) if end is None else bisect_left(timestamps, end, lo)
+        return records[lo:hi]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class CandleArchive:
+    """Архив закрытых свечей на диске: файл на (symbol, timeframe) в directory/symbol/timeframe.bin"""
+
+    def __init__(self, directory=ARCHIVE_DIR, enabled=ARCHIVE_KLINES):
+        self.directory = directory
+        self.enabled = enabled
+        self.files = {}
+
+    def path(self, symbol, timeframe):
+        return os.path.join(self.directory, symbol, f"{timeframe}.bin")
+
+    def file(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        archive_file = self.files.get(key)
+        if archive_file is None:
+            archive_file = ArchiveFile(self.path(symbol, timeframe))
+            archive_file.open()
+            self.files[key] = archive_file
+        return archive_file
+
+    def open(self, pairs=None):
+        """Проверка и открытие существующих файлов (pairs - только эти пары)"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return 0
+        started = time.perf_counter()
+        records = 0
+        for symbol in sorted(os.listdir(self.directory)):
+            if pairs is not None and symbol not in pairs:
+                continue
+            directory = os.path.join(self.directory, symbol)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                timeframe, extension = os.path.splitext(name)
+                if extension != '.bin':
+                    continue
+                try:
+                    records += self.file(symbol, timeframe).count
+                except (OSError, ValueError) as e:
+                    logger.error("Can't open archive %s/%s: %s", symbol, timeframe, str(e))
+        logger.info("Candle archive: %d files, %d candles checked in %.2fs",
+                    len(self.files), records, time.perf_counter() - started)
+        return records
+
+    def append(self, symbol, timeframe, timestamp, open_, high, low, close, volume):
+        if not self.enabled:
+            return 0
+        row = np.array([(timestamp, open_, high, low, close, volume)], dtype=RECORD)
+        try:
+            return self.file(symbol, timeframe).append(row)
+        except OSError as e:
+            logger.error("Archive write error for %s %s: %s", symbol, timeframe, str(e))
+            return 0
+
+    def extend(self, symbol, timeframe, timestamps, open_, high, low, close, volume):
+        if not self.enabled or not len(timestamps):
+            return 0
+        rows = np.empty(len(timestamps), dtype=RECORD)
+        for name, values in zip(RECORD.names, (timestamps, open_, high, low, close, volume)):
+            rows[name] = values
+        try:
+            return self.file(symbol, timeframe).append(rows)
+        except OSError as e:
+            logger.error("Archive write error for %s %s: %s", symbol, timeframe, str(e))
+            return 0
+
+    def range(self, symbol, timeframe, start=None, end=None):
+        if not self.enabled or not os.path.exists(self.path(symbol, timeframe)):
+            return np.empty(0, dtype=RECORD)
+        return self.file(symbol, timeframe).range(start, end)
+
+    def close_at(self, symbol, timeframe, timestamp):
+        """Цена закрытия свечи, открывшейся в timestamp, или None"""
+        records = self.range(symbol, timeframe, timestamp, timestamp + 1)
+        return float(records['close'][0]) if len(records) else None
+
+    def close(self):
+        for archive_file in self.files.values():
+            archive_file.close()
+        self.files = {}
+
+candle_archive = CandleArchive()
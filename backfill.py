@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+import aiohttp
+import numpy as np
+from globals import (TRADING_PAIRS, TIMEFRAMES, TIMEFRAME_MS, market_data, BINANCE_REST_URL, BACKFILL_CANDLES,
+                     BACKFILL_CONCURRENCY, BACKFILL_WEIGHT_LIMIT)
+from candle_store import CandleStore
+from indicator_cache import indicator_cache
+from archive import candle_archive
+
+logger = logging.getLogger(__name__)
+
+# Binance отдает не больше 1000 свечей за запрос
+KLINES_PAGE_LIMIT = 1000
+MAX_RETRIES = 3
+
+def request_weight(limit):
+    """Вес запроса /api/v3/klines в зависимости от limit"""
+    if limit <= 100:
+        return 1
+    if limit <= 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+class KlineBackfill:
+    """Загрузка истории свечей через REST перед запуском потоков.
+
+    Одна сессия aiohttp на все запросы, не больше concurrency запросов
+    одновременно. Использованный вес берется из заголовка
+    X-MBX-USED-WEIGHT-1M: при приближении к weight_limit запросы ждут
+    начала следующей минуты.
+    """
+
+    def __init__(self, base_url=BINANCE_REST_URL, candles=BACKFILL_CANDLES,
+                 concurrency=BACKFILL_CONCURRENCY, weight_limit=BACKFILL_WEIGHT_LIMIT):
+        self.base_url = base_url.rstrip('/')
+        self.candles = candles
+        self.concurrency = max(1, concurrency)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.weight_limit = weight_limit
+        self.window = 0.0
+        self.used_weight = 0
+        self.blocked_until = 0.0
+        self.session = None
+        self.requests = 0
+
+    async def _wait_for_weight(self, weight):
+        while True:
+            now = time.time()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            # Окно веса у Binance - календарная минута
+            minute = now - now % 60
+            if minute != self.window:
+                self.window, self.used_weight = minute, 0
+            if self.used_weight + weight <= self.weight_limit:
+                self.used_weight += weight
+                return
+            self.blocked_until = minute + 60
+
+    async def _get(self, params):
+        weight = request_weight(params['limit'])
+        for attempt in range(MAX_RETRIES):
+            async with self.semaphore:
+                await self._wait_for_weight(weight)
+                self.requests += 1
+                try:
+                    async with self.session.get(f"{self.base_url}/api/v3/klines", params=params) as response:
+                        used = response.headers.get('X-MBX-USED-WEIGHT-1M')
+                        if used is not None and used.isdigit():
+                            self.used_weight = max(self.used_weight, int(used))
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status in (418, 429):
+                            retry_after = int(response.headers.get('Retry-After', 60))
+                            logger.warning("REST rate limited, pausing for %s seconds", retry_after)
+                            self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+                            continue
+                        error_text = await response.text()
+                        logger.error("Klines request failed for %s %s: %s %s", params['symbol'],
+                                     params['interval'], response.status, error_text[:200])
+                        if 400 <= response.status < 500:
+                            return None
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("Klines request error (attempt %s/%s): %s", attempt + 1, MAX_RETRIES, str(e))
+            await asyncio.sleep(2 ** attempt)
+        return None
+
+    async def fetch(self, symbol, timeframe, start_time, now_ms):
+        """Закрытые свечи с open_time >= start_time, постранично"""
+        frame_ms = TIMEFRAME_MS[timeframe]
+        rows = []
+        while start_time + frame_ms <= now_ms:
+            limit = min(KLINES_PAGE_LIMIT, (now_ms - start_time) // frame_ms + 1)
+            page = await self._get({'symbol': symbol, 'interval': timeframe,
+                                    'startTime': start_time, 'limit': limit})
+            if not page:
+                break
+            rows.extend(page)
+            start_time = int(page[-1][0]) + frame_ms
+            if len(page) < limit:
+                break
+        # Текущую свечу обновляет живой поток, в историю идут только закрытые
+        return [row for row in rows if int(row[6]) < now_ms]
+
+    def start_time(self, symbol, timeframe, now_ms, since=None):
+        frame_ms = TIMEFRAME_MS[timeframe]
+        start = now_ms - now_ms % frame_ms - self.candles * frame_ms
+        store = market_data.get(symbol, {}).get(timeframe)
+        if store is not None:
+            closed = store.closed_tail()['timestamp']
+            # История уже в памяти (из снимка): догружается только недостающий хвост
+            if len(closed) >= min(self.candles, store.capacity):
+                start = max(start, int(closed[-1]) + frame_ms)
+        return start if since is None else min(start, since - since % frame_ms)
+
+    async def load(self, symbol, timeframe, now_ms, since=None):
+        rows = await self.fetch(symbol, timeframe, self.start_time(symbol, timeframe, now_ms, since), now_ms)
+        if rows:
+            merge_klines(symbol, timeframe, rows)
+        return rows
+
+    async def run(self, pairs=TRADING_PAIRS, timeframes=TIMEFRAMES, aggregator=None):
+        """История для всех (symbol, timeframe); базовые свечи прогоняются через агрегатор.
+
+        Для агрегатора базовый поток грузится с начала текущего бара самого
+        старшего таймфрейма, чтобы незакрытые старшие бары были полными.
+        Закрытые бары собираемых агрегатором таймфреймов из потока не
+        построить, поэтому они тоже грузятся, но только если их нет в памяти.
+        """
+        if self.candles <= 0:
+            return 0
+        started = time.perf_counter()
+        now_ms = int(time.time() * 1000)
+        since = None
+        if aggregator is not None and aggregator.targets:
+            longest = max(TIMEFRAME_MS[tf] for tf in aggregator.targets)
+            since = now_ms - now_ms % longest
+        jobs = []
+        for symbol in pairs:
+            for timeframe in timeframes:
+                base = aggregator is not None and timeframe == aggregator.base
+                jobs.append((symbol, timeframe, since if base else None))
+
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout,
+                                         connector=aiohttp.TCPConnector(limit=self.concurrency)) as session:
+            self.session = session
+            results = await asyncio.gather(*[self.load(symbol, timeframe, now_ms, job_since)
+                                             for symbol, timeframe, job_since in jobs], return_exceptions=True)
+        self.session = None
+
+        loaded = 0
+        for (symbol, timeframe, job_since), rows in zip(jobs, results):
+            if isinstance(rows, Exception):
+                logger.error("Backfill error for %s %s: %s", symbol, timeframe, str(rows))
+                continue
+            loaded += len(rows)
+            if job_since is not None and rows:
+                prime_aggregator(aggregator, symbol, rows, job_since)
+        logger.info("Backfilled %d candles for %d streams in %.2fs (%d requests)",
+                    loaded, len(jobs), time.perf_counter() - started, self.requests)
+        return loaded
+
+def merge_klines(symbol, timeframe, rows):
+    """Строки REST [open_time, open, high, low, close, volume, ...] в CandleStore"""
+    data = np.array([row[:6] for row in rows], dtype=np.float64)
+    timestamps = np.array([int(row[0]) for row in rows], dtype=np.int64)
+    store = market_data.setdefault(symbol, {}).setdefault(timeframe, CandleStore())
+    store.merge(timestamps, data[:, 1], data[:, 2], data[:, 3], data[:, 4], data[:, 5])
+    # В архив попадают только свечи новее уже записанных
+    candle_archive.extend(symbol, timeframe, timestamps, data[:, 1], data[:, 2], data[:, 3], data[:, 4], data[:, 5])
+    indicator_cache.invalidate(symbol, timeframe)
+
+def prime_aggregator(aggregator, symbol, rows, since):
+    """Накопление незакрытых старших баров из закрытых базовых свечей"""
+    for row in rows:
+        if int(row[0]) < since:
+            continue
+        # Закрытые старшие бары уже загружены из REST, результат не нужен
+        aggregator.update(symbol, {'t': int(row[0]), 'o': row[1], 'h': row[2], 'l': row[3],
+                                   'c': row[4], 'v': row[5], 'x': True})
+
+async def backfill_history(aggregator=None):
+    return await KlineBackfill().run(aggregator=aggregator)
@@ -0,0 +1,238 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from globals import (TRADING_PAIRS, TIMEFRAMES, TIMEFRAME_HIERARCHY, TIMEFRAME_MS, SIGNAL_THRESHOLD,
+                     MIN_INDICATORS, CONFIRMATION_THRESHOLD, indicator_weights)
+from indicators import TechnicalIndicators
+from outcome_scheduler import horizon_ms, PROFIT_THRESHOLD
+from scoring import signal_matrix, signal_strength
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = 'data/history'
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+# Выгрузки спота Binance с 2025 года пишут время в микросекундах; в миллисекундах
+# такие значения соответствовали бы времени после 5000 года
+MICROSECONDS_FROM = 10 ** 14
+
+def history_path(data_dir, symbol, timeframe):
+    for extension in ('.csv', '.csv.gz'):
+        path = os.path.join(data_dir, f"{symbol}-{timeframe}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_history(data_dir, symbol, timeframe):
+    """OHLCV из файла {SYMBOL}-{tf}.csv[.gz] в формате выгрузок Binance (open_time первой колонкой).
+
+    Время приводится к миллисекундам построчно, поэтому склеенные старые
+    (мс) и новые (мкс) выгрузки тоже читаются.
+    """
+    path = history_path(data_dir, symbol, timeframe)
+    if path is None:
+        return None
+    df = pd.read_csv(path, header=None, usecols=range(6), names=OHLCV_COLUMNS)
+    if not str(df['timestamp'].iloc[0]).isdigit():
+        df = df.iloc[1:]  # строка заголовка
+    df = df.astype({'timestamp': 'int64', 'open': 'float64', 'high': 'float64',
+                    'low': 'float64', 'close': 'float64', 'volume': 'float64'})
+    timestamps = df['timestamp'].to_numpy()
+    df['timestamp'] = np.where(timestamps >= MICROSECONDS_FROM, timestamps // 1000, timestamps)
+    return df.drop_duplicates('timestamp').sort_values('timestamp').reset_index(drop=True)
+
+def resample(df, timeframe):
+    """Старший таймфрейм из младшего с выравниванием по эпохе, только полные бары"""
+    frame_ms = TIMEFRAME_MS[timeframe]
+    base_ms = int(np.median(np.diff(df['timestamp'].to_numpy()[:1000]))) if len(df) > 1 else frame_ms
+    bucket = df['timestamp'] - df['timestamp'] % frame_ms
+    grouped = df.groupby(bucket, sort=True)
+    bars = pd.DataFrame({
+        'timestamp': grouped['timestamp'].first().index.to_numpy(),
+        'open': grouped['open'].first().to_numpy(),
+        'high': grouped['high'].max().to_numpy(),
+        'low': grouped['low'].min().to_numpy(),
+        'close': grouped['close'].last().to_numpy(),
+        'volume': grouped['volume'].sum().to_numpy()
+    })
+    complete = grouped.size().to_numpy() == frame_ms // base_ms
+    return bars[complete].reset_index(drop=True)
+
+def confirmation_vectors(ind):
+    """Подтверждение BUY/SELL на каждом баре старшего таймфрейма (как is_signal_confirmed)"""
+    trend_up = ((ind['EMA_12'] > ind['EMA_26']) | (ind['MACD'] > ind['MACD_signal']) |
+                (ind['close'] > ind['BB_middle'])).to_numpy()
+    trend_down = ((ind['EMA_12'] < ind['EMA_26']) | (ind['MACD'] < ind['MACD_signal']) |
+                  (ind['close'] < ind['BB_middle'])).to_numpy()
+    strong = (ind['ADX'] > 20).to_numpy()
+    obv = ind['OBV_trend'].to_numpy()
+    return trend_up & strong & (obv > 0), trend_down & strong & (obv < 0)
+
+def align(source_close_times, target_times):
+    """Индекс последнего бара source, закрытого к каждому моменту target (-1, если нет)"""
+    return np.searchsorted(source_close_times, target_times, side='right') - 1
+
+class Backtester:
+    """Прогон истории через правила SignalAnalyzer целиком на массивах"""
+
+    def __init__(self, data_dir=HISTORY_DIR, weights=None):
+        self.data_dir = data_dir
+        self.weights = dict(weights or indicator_weights)
+        self.history = {}
+        self.indicators = {}
+
+    def candles(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.history:
+            df = load_history(self.data_dir, symbol, timeframe)
+            if df is None:
+                # Нет файла - строим из самого мелкого доступного таймфрейма
+                for source in sorted(TIMEFRAME_MS, key=TIMEFRAME_MS.get):
+                    if TIMEFRAME_MS[source] >= TIMEFRAME_MS[timeframe] or TIMEFRAME_MS[timeframe] % TIMEFRAME_MS[source]:
+                        continue
+                    base = load_history(self.data_dir, symbol, source)
+                    if base is not None:
+                        df = resample(base, timeframe)
+                        break
+            self.history[key] = df
+        return self.history[key]
+
+    def finest_candles(self, symbol, timeframe):
+        """Самый мелкий доступный ряд не крупнее timeframe: (df, timeframe)"""
+        for source in sorted(TIMEFRAMES, key=TIMEFRAME_MS.get):
+            if TIMEFRAME_MS[source] > TIMEFRAME_MS[timeframe]:
+                break
+            df = self.candles(symbol, source)
+            if df is not None:
+                return df, source
+        return self.candles(symbol, timeframe), timeframe
+
+    def indicator_frame(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.indicators:
+            df = self.candles(symbol, timeframe)
+            ind = None if df is None else TechnicalIndicators.calculate_all_indicators(df.copy())
+            # При ошибке расчета calculate_all_indicators возвращает исходные свечи
+            self.indicators[key] = ind if ind is not None and 'OBV_trend' in ind.columns else None
+        return self.indicators[key]
+
+    def prepare(self, symbol, timeframe):
+        """Все, что не зависит от порогов: сила, активные индикаторы, подтверждение, PnL"""
+        ind = self.indicator_frame(symbol, timeframe)
+        if ind is None or ind.empty:
+            return None
+        names, matrix = signal_matrix(ind)
+        strength, active = signal_strength(names, matrix, self.weights)
+        active_count = active.sum(axis=1)
+        close_times = ind['timestamp'].to_numpy() + TIMEFRAME_MS[timeframe]
+
+        # Подтверждение старшими таймфреймами: последний закрытый бар на момент сигнала
+        higher = TIMEFRAME_HIERARCHY.get(timeframe, [])
+        buy_votes = np.zeros(len(ind))
+        sell_votes = np.zeros(len(ind))
+        for htf in higher:
+            htf_ind = self.indicator_frame(symbol, htf)
+            if htf_ind is None or htf_ind.empty:
+                continue
+            confirm_buy, confirm_sell = confirmation_vectors(htf_ind)
+            index = align(htf_ind['timestamp'].to_numpy() + TIMEFRAME_MS[htf], close_times)
+            valid = index >= 0
+            buy_votes[valid] += confirm_buy[index[valid]]
+            sell_votes[valid] += confirm_sell[index[valid]]
+        if higher:
+            buy_confirmed = buy_votes / len(higher) >= CONFIRMATION_THRESHOLD
+            sell_confirmed = sell_votes / len(higher) >= CONFIRMATION_THRESHOLD
+        else:
+            buy_confirmed = sell_confirmed = np.ones(len(ind), dtype=bool)
+        confirmed = np.where(strength > 0, buy_confirmed, sell_confirmed)
+
+        # Результат: цена через horizon_ms по самому мелкому доступному ряду
+        exit_source, exit_timeframe = self.finest_candles(symbol, timeframe)
+        exit_close_times = exit_source['timestamp'].to_numpy() + TIMEFRAME_MS[exit_timeframe]
+        exit_times = close_times + horizon_ms(timeframe)
+        exit_index = align(exit_close_times, exit_times)
+        has_exit = (exit_index >= 0) & (exit_times <= exit_close_times[-1])
+        entry = ind['close'].to_numpy()
+        exit_price = exit_source['close'].to_numpy()[np.clip(exit_index, 0, None)]
+        change = (exit_price - entry) / entry
+        pnl = np.where(strength > 0, change, -change)
+
+        return {
+            'strength': np.abs(strength),
+            'active': active_count,
+            'confirmed': confirmed,
+            'has_exit': has_exit,
+            'pnl': pnl
+        }
+
+    def run(self, symbols, timeframes, thresholds=(SIGNAL_THRESHOLD,), min_indicators=(MIN_INDICATORS,)):
+        prepared = {}
+        for symbol in symbols:
+            for timeframe in timeframes:
+                started = time.perf_counter()
+                data = self.prepare(symbol, timeframe)
+                if data is not None:
+                    prepared[(symbol, timeframe)] = data
+                    logger.info("Prepared %s %s in %.2fs", symbol, timeframe, time.perf_counter() - started)
+
+        report = []
+        for threshold, minimum in itertools.product(thresholds, min_indicators):
+            signals = hits = 0
+            pnl_sum = 0.0
+            per_stream = {}
+            for (symbol, timeframe), data in prepared.items():
+                mask = (data['strength'] >= threshold) & (data['active'] >= minimum) & \
+                       data['confirmed'] & data['has_exit']
+                count = int(mask.sum())
+                if not count:
+                    continue
+                pnl = data['pnl'][mask]
+                stream_hits = int((pnl > PROFIT_THRESHOLD).sum())
+                signals += count
+                hits += stream_hits
+                pnl_sum += float(pnl.sum())
+                per_stream[f"{symbol}/{timeframe}"] = {
+                    'signals': count,
+                    'hit_rate': stream_hits / count,
+                    'avg_pnl': float(pnl.mean())
+                }
+            report.append({
+                'threshold': threshold,
+                'min_indicators': minimum,
+                'signals': signals,
+                'hit_rate': hits / signals if signals else 0.0,
+                'avg_pnl': pnl_sum / signals if signals else 0.0,
+                'total_pnl': pnl_sum,
+                'streams': per_stream
+            })
+        return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest signal settings on historical candles")
+    parser.add_argument('--data', default=HISTORY_DIR, help="Directory with {SYMBOL}-{tf}.csv files")
+    parser.add_argument('--symbols', nargs='+', default=TRADING_PAIRS)
+    parser.add_argument('--timeframes', nargs='+', default=TIMEFRAMES)
+    parser.add_argument('--thresholds', nargs='+', type=float, default=[SIGNAL_THRESHOLD])
+    parser.add_argument('--min-indicators', nargs='+', type=int, default=[MIN_INDICATORS])
+    parser.add_argument('--output', help="Write JSON report to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = Backtester(args.data).run(args.symbols, args.timeframes, args.thresholds, args.min_indicators)
+    for row in report:
+        logger.info("threshold=%.2f min_indicators=%d signals=%d hit_rate=%.2f%% avg_pnl=%.4f%%",
+                    row['threshold'], row['min_indicators'], row['signals'],
+                    row['hit_rate'] * 100, row['avg_pnl'] * 100)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+if __name__ == "__main__":
+    main()
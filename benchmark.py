@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from globals import TIMEFRAMES, TIMEFRAME_MS, CANDLE_HISTORY, market_data
+from candle_store import CandleStore
+from events import kline_events
+from indicator_cache import indicator_cache
+from cooldown import signal_cooldown
+from archive import candle_archive
+from recorder import read_segments
+from streaming_indicators import StreamingIndicators
+import database
+import websocket
+import signal_analyzer
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SIZES = [100, 250, 500, 1000]
+PAIR_COUNTS = [10, 50, 100]
+# Метрики, где больше - лучше; для остальных регрессия - рост значения
+HIGHER_IS_BETTER = ('messages_per_sec',)
+
+def synthetic_klines(symbols, timeframe='1m', candles=100, updates=3, seed=0, start=1_700_000_000_000):
+    """Случайное блуждание цены: updates незакрытых обновлений и закрытие на каждую свечу"""
+    rng = np.random.default_rng(seed)
+    frame_ms = TIMEFRAME_MS[timeframe]
+    start -= start % frame_ms
+    prices = {symbol: 100.0 * (1 + i) for i, symbol in enumerate(symbols)}
+    for n in range(candles):
+        opened = start + n * frame_ms
+        for symbol in symbols:
+            open_ = high = low = close = prices[symbol]
+            volume = 0.0
+            for step in range(updates + 1):
+                close *= 1 + rng.normal(0, 0.002)
+                high, low = max(high, close), min(low, close)
+                volume += float(rng.uniform(1, 10))
+                yield symbol, timeframe, {'t': opened, 'T': opened + frame_ms - 1, 's': symbol, 'i': timeframe,
+                                          'o': open_, 'h': high, 'l': low, 'c': close, 'v': volume,
+                                          'x': step == updates}
+            prices[symbol] = close
+
+def recorded_klines(paths):
+    for _, message in read_segments(paths):
+        kline = json.loads(message).get('data', {}).get('k')
+        if kline:
+            yield kline['s'], kline['i'], kline
+
+def candle_frame(rows, seed=0):
+    klines = [k for _, _, k in synthetic_klines(['BENCH'], candles=rows, updates=0, seed=seed)]
+    return pd.DataFrame({
+        'timestamp': [k['t'] for k in klines],
+        'open': [k['o'] for k in klines],
+        'high': [k['h'] for k in klines],
+        'low': [k['l'] for k in klines],
+        'close': [k['c'] for k in klines],
+        'volume': [k['v'] for k in klines]
+    })
+
+def fill_store(frame, capacity=CANDLE_HISTORY):
+    store = CandleStore(capacity)
+    for row in frame.itertuples(index=False):
+        store.update(row.timestamp, row.open, row.high, row.low, row.close, row.volume, True)
+    return store
+
+def summarize(samples):
+    """Статистика задержек в миллисекундах"""
+    values = np.asarray(samples) * 1000
+    if not len(values):
+        return {'count': 0}
+    return {
+        'count': int(len(values)),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'max_ms': float(values.max())
+    }
+
+def reset_state():
+    market_data.clear()
+    kline_events.clear()
+    indicator_cache.clear()
+    signal_cooldown.clear()
+
+async def bench_ingest(klines):
+    """Пропускная способность process_kline_data"""
+    reset_state()
+    messages = list(klines)
+    started = time.perf_counter()
+    for symbol, timeframe, kline in messages:
+        await websocket.process_kline_data(symbol, timeframe, kline)
+    elapsed = time.perf_counter() - started
+    reset_state()
+    return {
+        'messages': len(messages),
+        'elapsed_s': elapsed,
+        'messages_per_sec': len(messages) / elapsed if elapsed > 0 else 0.0
+    }
+
+def bench_indicators(sizes=WINDOW_SIZES, repeat=5):
+    """Задержка calculate_all_indicators и инкрементального обновления по размеру окна"""
+    from indicators import TechnicalIndicators
+    results = {}
+    for size in sizes:
+        frame = candle_frame(size)
+        batch = []
+        for _ in range(repeat):
+            df = frame.copy()
+            started = time.perf_counter()
+            TechnicalIndicators.calculate_all_indicators(df)
+            batch.append(time.perf_counter() - started)
+        indicators = StreamingIndicators()
+        rows = list(frame.itertuples(index=False))
+        for row in rows[:-1]:
+            indicators.commit(row.timestamp, row.open, row.high, row.low, row.close, row.volume)
+        last = rows[-1]
+        streaming = []
+        for _ in range(repeat * 20):
+            started = time.perf_counter()
+            indicators.peek(last.timestamp, last.open, last.high, last.low, last.close, last.volume)
+            streaming.append(time.perf_counter() - started)
+        results[str(size)] = {'batch': summarize(batch), 'streaming_update': summarize(streaming)}
+    return results
+
+async def bench_sweep(pair_counts=PAIR_COUNTS, timeframes=TIMEFRAMES, rows=200, rounds=5):
+    """Время analyze_batch по всем потокам в зависимости от числа пар"""
+    results = {}
+    for pairs in pair_counts:
+        reset_state()
+        analyzer = signal_analyzer.SignalAnalyzer()
+        frame = candle_frame(rows + rounds)
+        keys = []
+        for i in range(pairs):
+            symbol = f"PAIR{i}USDT"
+            market_data[symbol] = {}
+            for timeframe in timeframes:
+                market_data[symbol][timeframe] = fill_store(frame.iloc[:rows])
+                keys.append((symbol, timeframe))
+        started = time.perf_counter()
+        await analyzer.analyze_batch(keys)
+        cold = time.perf_counter() - started
+        warm = []
+        for n in range(rounds):
+            row = frame.iloc[rows + n]
+            for symbol, timeframe in keys:
+                market_data[symbol][timeframe].update(int(row.timestamp), row.open, row.high, row.low,
+                                                      row.close, row.volume, False)
+                indicator_cache.invalidate(symbol, timeframe)
+            started = time.perf_counter()
+            await analyzer.analyze_batch(keys)
+            warm.append(time.perf_counter() - started)
+        results[str(pairs)] = {'streams': len(keys), 'cold_s': cold, 'sweep': summarize(warm)}
+    reset_state()
+    return results
+
+async def bench_end_to_end(pairs=10, candles=120):
+    """Задержка от kline до send_signal с заглушкой вместо Telegram.
+
+    Пороги обнулены, чтобы сигнал давал каждый пакет; 30-секундная выдержка
+    ожидающего сигнала пропускается - измеряется только обработка.
+    """
+    reset_state()
+    analyzer = signal_analyzer.SignalAnalyzer()
+    sent = []
+
+    async def stub_send_signal(*args):
+        sent.append(time.perf_counter())
+        return True
+
+    patched = {
+        'send_signal': stub_send_signal,
+        'store_signal': lambda *args: None,
+        'update_signal_strength': lambda *args: None,
+        'SIGNAL_THRESHOLD': 0.0,
+        'MIN_INDICATORS': 0,
+        'CONFIRMATION_THRESHOLD': 0.0
+    }
+    original = {name: getattr(signal_analyzer, name) for name in patched}
+    schedule = signal_analyzer.outcome_scheduler.schedule
+    latencies = []
+    try:
+        for name, value in patched.items():
+            setattr(signal_analyzer, name, value)
+        signal_analyzer.outcome_scheduler.schedule = lambda *args: None
+        symbols = [f"PAIR{i}USDT" for i in range(pairs)]
+        for symbol, timeframe, kline in synthetic_klines(symbols, candles=candles, updates=0):
+            started = time.perf_counter()
+            await websocket.process_kline_data(symbol, timeframe, kline)
+            keys = [key for key, event in kline_events.drain() if len(market_data[key[0]][key[1]]) > 50]
+            if not keys:
+                continue
+            await analyzer.analyze_batch(keys)
+            for signal_data in analyzer.pending_signals.values():
+                signal_data['timestamp'] -= 31
+            count = len(sent)
+            await analyzer.check_pending_signals()
+            if len(sent) > count:
+                latencies.append(sent[-1] - started)
+    finally:
+        for name, value in original.items():
+            setattr(signal_analyzer, name, value)
+        signal_analyzer.outcome_scheduler.schedule = schedule
+        reset_state()
+    return {'signals': len(sent), 'latency': summarize(latencies)}
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, timeout=5).stdout.strip()
+    except Exception:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform()
+    }
+
+async def run_benchmarks(names, recorded=None, pairs=10, candles=200):
+    results = {}
+    # Синтетические свечи и сигналы пишутся во временные архив и базу: затраты на запись
+    # учитываются, рабочие данные (история сигналов, signal_stats, переобучение) не трогаем
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    archive_directory = candle_archive.directory
+    candle_archive.directory = os.path.join(scratch, 'archive')
+    db_path = database.use_database(os.path.join(scratch, 'bench.db'))
+    database.init_database()
+    try:
+        await _run_benchmarks(names, results, recorded, pairs, candles)
+    finally:
+        candle_archive.close()
+        candle_archive.directory = archive_directory
+        database.use_database(db_path)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+async def _run_benchmarks(names, results, recorded, pairs, candles):
+    if 'ingest' in names:
+        symbols = [f"PAIR{i}USDT" for i in range(pairs)]
+        results['ingest'] = await bench_ingest(synthetic_klines(symbols, candles=candles))
+        if recorded:
+            results['ingest_recorded'] = await bench_ingest(recorded_klines(recorded))
+    if 'indicators' in names:
+        results['indicators'] = bench_indicators()
+    if 'sweep' in names:
+        results['sweep'] = await bench_sweep()
+    if 'e2e' in names:
+        results['e2e'] = await bench_end_to_end(pairs)
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+def compare(baseline, current, tolerance):
+    """Метрики, ухудшившиеся больше чем на tolerance относительно прошлого прогона"""
+    regressions = []
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    for name, value in new.items():
+        reference = old.get(name)
+        if not reference or name.endswith(('count', 'messages', 'streams', 'signals')):
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            change = (reference - value) / reference
+        else:
+            change = (value - reference) / reference
+        if change > tolerance:
+            regressions.append({'metric': name, 'baseline': reference, 'current': value, 'change': change})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingest, indicators, analysis and notification")
+    parser.add_argument('--only', nargs='+', default=['ingest', 'indicators', 'sweep', 'e2e'],
+                        choices=['ingest', 'indicators', 'sweep', 'e2e'])
+    parser.add_argument('--recorded', nargs='+', help="Kline segments from the recorder for the ingest benchmark")
+    parser.add_argument('--pairs', type=int, default=10)
+    parser.add_argument('--candles', type=int, default=200)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    parser.add_argument('--compare', help="Previous JSON results to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = {'meta': metadata(),
+              'results': asyncio.run(run_benchmarks(args.only, args.recorded, args.pairs, args.candles))}
+    if args.compare:
+        with open(args.compare) as f:
+            report['regressions'] = compare(json.load(f), report, args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if report.get('regressions'):
+        for row in report['regressions']:
+            logger.warning("Regression in %s: %.4g -> %.4g (%+.0f%%)", row['metric'], row['baseline'],
+                           row['current'], row['change'] * 100)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
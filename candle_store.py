@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from globals import CANDLE_HISTORY
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+class CandleStore:
+    """Кольцевой буфер свечей фиксированной емкости, по одному массиву на колонку.
+
+    Каждая строка пишется дважды: в позицию i и в зеркальную i + capacity.
+    Поэтому последние N строк всегда лежат в памяти подряд и отдаются
+    срезом без копирования. Последняя строка может быть незакрытой свечой.
+    """
+
+    def __init__(self, capacity=CANDLE_HISTORY):
+        self.capacity = capacity
+        self.timestamp = np.zeros(2 * capacity, dtype=np.int64)
+        self.open = np.zeros(2 * capacity, dtype=np.float64)
+        self.high = np.zeros(2 * capacity, dtype=np.float64)
+        self.low = np.zeros(2 * capacity, dtype=np.float64)
+        self.close = np.zeros(2 * capacity, dtype=np.float64)
+        self.volume = np.zeros(2 * capacity, dtype=np.float64)
+        self.size = 0
+        self.head = -1
+        self.last_closed = True
+
+    def __len__(self):
+        return self.size
+
+    def _write(self, index, timestamp, open_, high, low, close, volume):
+        for i in (index, index + self.capacity):
+            self.timestamp[i] = timestamp
+            self.open[i] = open_
+            self.high[i] = high
+            self.low[i] = low
+            self.close[i] = close
+            self.volume[i] = volume
+
+    def update(self, timestamp, open_, high, low, close, volume, is_closed):
+        """Обновляет текущую свечу на месте или добавляет новую за O(1)"""
+        if self.size:
+            last_timestamp = self.timestamp[self.head]
+            if timestamp < last_timestamp:
+                return False
+            if timestamp == last_timestamp:
+                self._write(self.head, timestamp, open_, high, low, close, volume)
+                self.last_closed = is_closed
+                return True
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self._write(self.head, timestamp, open_, high, low, close, volume)
+        self.last_closed = is_closed
+        return True
+
+    def load(self, timestamp, open_, high, low, close, volume, last_closed=True):
+        """Заменяет содержимое буфера массивами (по возрастанию времени), лишнее отбрасывается с начала"""
+        n = min(len(timestamp), self.capacity)
+        for name, values in zip(COLUMNS, (timestamp, open_, high, low, close, volume)):
+            column = getattr(self, name)
+            column[:n] = values[len(values) - n:]
+            column[self.capacity:self.capacity + n] = column[:n]
+        self.size = n
+        self.head = n - 1
+        self.last_closed = last_closed if n else True
+
+    def merge(self, timestamp, open_, high, low, close, volume):
+        """Добавляет закрытые свечи из истории (REST); строки, уже лежащие в буфере, не меняются"""
+        current = self.tail()
+        incoming = (timestamp, open_, high, low, close, volume)
+        timestamps = np.concatenate([current['timestamp'], np.asarray(timestamp, dtype=np.int64)])
+        # Стабильная сортировка: при совпадении времени первой идет строка из буфера
+        order = np.argsort(timestamps, kind='stable')
+        ordered = timestamps[order]
+        unique = order[np.r_[True, ordered[1:] != ordered[:-1]]]
+        columns = [np.concatenate([current[name], np.asarray(values, dtype=current[name].dtype)])[unique]
+                   for name, values in zip(COLUMNS, incoming)]
+        # Незакрытая свеча живого потока остается последней строкой
+        last_closed = self.last_closed if self.size and columns[0][-1] == self.timestamp[self.head] else True
+        self.load(*columns, last_closed=last_closed)
+
+    def _slice(self, n):
+        n = self.size if n is None else max(0, min(n, self.size))
+        end = self.head + self.capacity + 1
+        return slice(end - n, end)
+
+    def column(self, name, n=None):
+        """Представление (view) последних n значений колонки без копирования"""
+        return getattr(self, name)[self._slice(n)]
+
+    def tail(self, n=None):
+        """Представления последних n строк по всем колонкам.
+
+        Срезы ссылаются на буфер и меняются при следующих обновлениях.
+        """
+        window = self._slice(n)
+        return {name: getattr(self, name)[window] for name in COLUMNS}
+
+    def closed_tail(self, n=None):
+        """Как tail(), но без незакрытой последней свечи"""
+        if self.last_closed:
+            return self.tail(n)
+        window = self._slice(None if n is None else n + 1)
+        window = slice(window.start, window.stop - 1)
+        return {name: getattr(self, name)[window] for name in COLUMNS}
+
+    def last(self):
+        if not self.size:
+            return None
+        candle = {name: getattr(self, name)[self.head].item() for name in COLUMNS}
+        candle['is_closed'] = self.last_closed
+        return candle
+
+    def to_frame(self, n=None):
+        """DataFrame последних n строк для расчета индикаторов"""
+        return pd.DataFrame(self.tail(n))
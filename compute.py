@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from globals import COMPUTE_EXECUTOR, COMPUTE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Порядок колонок в общем буфере окон свечей
+WINDOW_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+def _latest_row(df, indicators=None):
+    from indicators import TechnicalIndicators
+    df = TechnicalIndicators.calculate(df, indicators)
+    if df.empty:
+        return None
+    return {column: (value.item() if hasattr(value, 'item') else value)
+            for column, value in df.iloc[-1].items()}
+
+def compute_windows(block, layout, indicators=None):
+    """Последняя строка индикаторов для каждого окна.
+
+    block - массив (rows, 5) со всеми окнами подряд, layout - список
+    (key, offset, rows), indicators - имена из реестра (None - все).
+    Выполняется в рабочем потоке или процессе.
+    """
+    import pandas as pd
+    results = {}
+    for key, offset, rows in layout:
+        window = block[offset:offset + rows]
+        df = pd.DataFrame(window, columns=WINDOW_COLUMNS)
+        try:
+            results[key] = _latest_row(df, indicators)
+        except Exception as e:
+            logger.error("Error computing indicators for %s: %s", key, str(e))
+            results[key] = None
+    return results
+
+def _attach(name):
+    """Подключение к блоку родителя без регистрации в resource_tracker.
+
+    Блок создает и удаляет родитель. Иначе рабочий процесс регистрирует
+    его как свой: трекер ругается на утечку и может удалить блок раньше
+    времени, а unregister из рабочего снимает и регистрацию родителя.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def compute_shared(name, total_rows, layout, indicators=None):
+    """compute_windows поверх shared memory: окна не сериализуются между процессами"""
+    shm = _attach(name)
+    block = np.ndarray((total_rows, len(WINDOW_COLUMNS)), dtype=np.float64, buffer=shm.buf)
+    try:
+        return compute_windows(block, layout, indicators)
+    finally:
+        del block
+        shm.close()
+
+def _fill(block, windows, layout):
+    for key, start, rows in layout:
+        for i, column in enumerate(WINDOW_COLUMNS):
+            block[start:start + rows, i] = windows[key][column]
+
+class ComputeExecutor:
+    """Исполнитель тяжелых пакетных расчетов: inline, thread или process.
+
+    Одна задача покрывает сразу много потоков; пакет делится на
+    workers частей, которые считаются параллельно.
+    """
+
+    def __init__(self, mode=COMPUTE_EXECUTOR, workers=COMPUTE_WORKERS):
+        if mode not in ('inline', 'thread', 'process'):
+            raise ValueError(f"Unknown compute executor: {mode}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None and self.mode != 'inline':
+            if self.mode == 'thread':
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='compute')
+            else:
+                # spawn: fork из процесса с потоками (запись в БД, uvicorn) небезопасен
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    def _split(self, layout):
+        chunks = [layout[i::self.workers] for i in range(self.workers)]
+        return [chunk for chunk in chunks if chunk]
+
+    async def latest_indicators(self, windows, indicators=None):
+        """windows: {key: {'open': ..., ..., 'volume': ...}} -> {key: последняя строка или None}"""
+        windows = {key: window for key, window in windows.items() if len(window['close'])}
+        if not windows:
+            return {}
+
+        if indicators is not None:
+            indicators = tuple(indicators)
+        layout = []
+        offset = 0
+        for key, window in windows.items():
+            rows = len(window['close'])
+            layout.append((key, offset, rows))
+            offset += rows
+        total_rows = offset
+
+        if self.mode == 'process':
+            shm = shared_memory.SharedMemory(create=True, size=total_rows * len(WINDOW_COLUMNS) * 8)
+            try:
+                block = np.ndarray((total_rows, len(WINDOW_COLUMNS)), dtype=np.float64, buffer=shm.buf)
+                _fill(block, windows, layout)
+                del block
+                loop = asyncio.get_running_loop()
+                pool = self._get_pool()
+                parts = await asyncio.gather(*[
+                    loop.run_in_executor(pool, compute_shared, shm.name, total_rows, chunk, indicators)
+                    for chunk in self._split(layout)
+                ])
+            finally:
+                shm.close()
+                shm.unlink()
+        else:
+            block = np.empty((total_rows, len(WINDOW_COLUMNS)), dtype=np.float64)
+            _fill(block, windows, layout)
+            if self.mode == 'inline':
+                parts = [compute_windows(block, layout, indicators)]
+            else:
+                loop = asyncio.get_running_loop()
+                pool = self._get_pool()
+                parts = await asyncio.gather(*[
+                    loop.run_in_executor(pool, compute_windows, block, chunk, indicators)
+                    for chunk in self._split(layout)
+                ])
+
+        results = {}
+        for part in parts:
+            results.update(part)
+        return results
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+compute_executor = ComputeExecutor()
@@ -0,0 +1,74 @@
+from globals import TIMEFRAME_MS, SIGNAL_COOLDOWN, SIGNAL_COOLDOWN_CANDLES, SIGNAL_BREAKTHROUGH
+from metrics import registry
+
+class SignalCooldown:
+    """Индекс последних сигналов по (symbol, timeframe, direction).
+
+    Запись хранит свечу, на которой прошел сигнал, его силу и конец окна
+    подавления. Новый сигнал по тому же ключу на той же свече или до конца
+    окна отбрасывается, если его сила не больше прошлой на breakthrough.
+    Время берется из свечей, а не из часов, поэтому при воспроизведении
+    записи окна работают так же.
+    """
+
+    def __init__(self, windows=SIGNAL_COOLDOWN, candles=SIGNAL_COOLDOWN_CANDLES, breakthrough=SIGNAL_BREAKTHROUGH):
+        self.windows = windows
+        self.candles = candles
+        self.breakthrough = breakthrough
+        self.entries = {}
+        self.accepted = 0
+        self.suppressed = 0
+        self.upgraded = 0
+
+    def window_ms(self, timeframe):
+        if timeframe in self.windows:
+            return self.windows[timeframe] * 1000
+        return self.candles * TIMEFRAME_MS.get(timeframe, 60_000)
+
+    def allow(self, symbol, timeframe, direction, candle, strength):
+        """(пропустить ли сигнал, id прошлого сигнала, если новый его перебивает)"""
+        entry = self.entries.get((symbol, timeframe, direction))
+        if entry is None or candle >= entry['until']:
+            self.accepted += 1
+            return True, None
+        if strength >= entry['strength'] + self.breakthrough:
+            self.upgraded += 1
+            return True, entry['signal_id']
+        self.suppressed += 1
+        return False, None
+
+    def record(self, symbol, timeframe, direction, candle, strength, signal_id):
+        frame_ms = TIMEFRAME_MS.get(timeframe, 60_000)
+        self.entries[(symbol, timeframe, direction)] = {
+            'candle': candle,
+            'strength': strength,
+            'signal_id': signal_id,
+            'until': candle + frame_ms + self.window_ms(timeframe)
+        }
+
+    def forget(self, symbols):
+        symbols = set(symbols)
+        self.entries = {key: entry for key, entry in self.entries.items() if key[0] not in symbols}
+
+    def export(self):
+        return [[*key, entry['candle'], entry['strength'], entry['signal_id'], entry['until']]
+                for key, entry in self.entries.items()]
+
+    def restore(self, rows):
+        for symbol, timeframe, direction, candle, strength, signal_id, until in rows:
+            self.entries.setdefault((symbol, timeframe, direction), {
+                'candle': candle, 'strength': strength, 'signal_id': signal_id, 'until': until})
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'accepted': self.accepted,
+            'suppressed': self.suppressed,
+            'upgraded': self.upgraded
+        }
+
+signal_cooldown = SignalCooldown()
+registry.gauge('signal_cooldown', "Signal deduplication index statistics", signal_cooldown.stats)
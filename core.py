@@ -1,14 +1,90 @@
 import asyncio
 import logging
-from database import init_database, load_weights, save_weights
-from websocket import start_websocket_connections, stop_websocket_connections
-from signal_analyzer import SignalAnalyzer, stop_analysis
-from globals import bot_status, indicator_weights
+from database import init_database, load_weights, weights_saved_at, save_weights, db_writer
+from websocket import start_websocket_connections, stop_websocket_connections, init_candle_aggregator, stream_gate
+from signal_analyzer import start_analysis, stop_analysis
+from globals import bot_status, indicator_weights, TRADING_PAIRS, SHARDS
 from learning import LearningSystem
+from compute import compute_executor
+from outcome_scheduler import outcome_scheduler
 from telegram import send_telegram_message
+from snapshot import snapshot_manager
+from backfill import backfill_history
+from archive import candle_archive
+from sharding import shard_supervisor
+from refit import weight_refit
 
 logger = logging.getLogger(__name__)
 
+async def start_pipeline(sink=None):
+    """Прием данных, анализ и оценка результатов для TRADING_PAIRS (без уведомлений о запуске)"""
+    # Асинхронная инициализация базы данных
+    await asyncio.to_thread(init_database)
+    
+    # Загрузка адаптивных весов
+    loaded_weights = await asyncio.to_thread(load_weights)
+    if loaded_weights:
+        indicator_weights.update(loaded_weights)
+        logger.info("Loaded weights from database")
+    else:
+        logger.info("Using default weights")
+    
+    # Инициализация системы обучения
+    LearningSystem.initialize()
+    
+    # Проверка файлов архива свечей (обрезка недописанных записей, уплотнение)
+    await asyncio.to_thread(candle_archive.open, TRADING_PAIRS)
+    
+    # Свечи, ожидающие сигналы и обучение из последнего снимка
+    pending_signals = await snapshot_manager.restore(await asyncio.to_thread(weights_saved_at), TRADING_PAIRS)
+    
+    # Потоки подключаются до загрузки истории, их сообщения копятся до ее окончания:
+    # иначе свеча, закрывшаяся во время догрузки, дала бы агрегатору разрыв
+    aggregator = init_candle_aggregator()
+    stream_gate.hold(TRADING_PAIRS)
+    manager = await start_websocket_connections()
+    await manager.wait_connected()
+    logger.info("WebSocket connections started")
+    
+    # Догрузка истории через REST; агрегатор получает базовые свечи
+    # с начала текущих старших баров
+    await backfill_history(aggregator)
+    
+    # Возобновление отложенных оценок результатов сигналов
+    await outcome_scheduler.start(TRADING_PAIRS)
+    
+    # Запуск анализатора сигналов, затем накопленные за время догрузки сообщения
+    start_analysis(pending_signals, sink)
+    released = await stream_gate.release(TRADING_PAIRS)
+    logger.info("Released %d buffered stream messages", released)
+    snapshot_manager.start()
+    logger.info("Signal analysis started")
+
+async def stop_pipeline(persist_learning=True):
+    # Остановка WebSocket соединений
+    await stop_websocket_connections()
+    logger.info("WebSocket connections stopped")
+    
+    # Снимок до остановки анализатора, пока доступны ожидающие сигналы
+    await snapshot_manager.stop()
+    await snapshot_manager.save()
+    
+    # Остановка анализатора сигналов
+    stop_analysis()
+    compute_executor.shutdown()
+    await outcome_scheduler.stop()
+    candle_archive.close()
+    logger.info("Signal analysis stopped")
+    
+    # Асинхронное сохранение данных
+    if persist_learning:
+        # Сначала применяются накопленные результаты - они меняют веса
+        LearningSystem.save_performance()
+        save_weights(indicator_weights)
+    # Дожидаемся записи всей очереди в базу
+    await asyncio.to_thread(db_writer.stop)
+    logger.info("Data saved successfully")
+
 async def init_bot():
     """Инициализация и запуск бота"""
     try:
@@ -17,29 +93,13 @@ async def init_bot():
             return
             
         logger.info("Starting bot...")
-        
-        # Асинхронная инициализация базы данных
-        await asyncio.to_thread(init_database)
-        
-        # Загрузка адаптивных весов
-        loaded_weights = await asyncio.to_thread(load_weights)
-        if loaded_weights:
-            indicator_weights.update(loaded_weights)
-            logger.info("Loaded weights from database")
+        if SHARDS > 0:
+            # Пары распределяются по рабочим процессам, здесь остаются Telegram и API
+            await shard_supervisor.start()
         else:
-            logger.info("Using default weights")
-        
-        # Инициализация системы обучения
-        LearningSystem.initialize()
-        
-        # Запуск WebSocket соединений
-        asyncio.create_task(start_websocket_connections())
-        logger.info("WebSocket connections started")
-        
-        # Запуск анализатора сигналов
-        analyzer = SignalAnalyzer()
-        asyncio.create_task(analyzer.analyze_all())
-        logger.info("Signal analysis started")
+            await start_pipeline()
+        # Веса ведет этот процесс (в шардированном режиме - супервизор)
+        weight_refit.start()
         
         bot_status['running'] = True
         logger.info("Bot started successfully")
@@ -58,19 +118,12 @@ async def stop_bot():
             
         logger.info("Stopping bot...")
         bot_status['running'] = False
+        weight_refit.stop()
         
-        # Остановка WebSocket соединений
-        await stop_websocket_connections()
-        logger.info("WebSocket connections stopped")
-        
-        # Остановка анализатора сигналов
-        stop_analysis()
-        logger.info("Signal analysis stopped")
-        
-        # Асинхронное сохранение данных
-        await asyncio.to_thread(save_weights, indicator_weights)
-        await asyncio.to_thread(LearningSystem.save_performance)
-        logger.info("Data saved successfully")
+        if SHARDS > 0:
+            await shard_supervisor.stop()
+        else:
+            await stop_pipeline()
         
         logger.info("Bot stopped successfully")
         await send_telegram_message("🔴 Бот остановлен!")
@@ -1,18 +1,195 @@
 import sqlite3
 import os
+import asyncio
 import logging
+import queue
+import threading
+import time
 from datetime import datetime
+from globals import DB_WRITE_QUEUE_SIZE, DB_BATCH_SIZE, DB_FLUSH_INTERVAL, DB_BUSY_TIMEOUT
+from metrics import registry, DB_WRITE_SECONDS, DB_WRITE_BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 DB_PATH = 'data/trading_bot.db'
+# Повторы пакета, если база осталась заблокированной дольше DB_BUSY_TIMEOUT
+DB_LOCK_RETRIES = 3
+# PRAGMA user_version: 1 - signal_stats заполнена по истории сигналов
+SCHEMA_VERSION = 1
 
 def get_connection():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    return sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+
+_STOP = object()
+
+class _FlushRequest:
+    def __init__(self, loop, future):
+        self.loop = loop
+        self.future = future
+
+    def done(self):
+        def resolve():
+            if not self.future.done():
+                self.future.set_result(None)
+        self.loop.call_soon_threadsafe(resolve)
+
+class DatabaseWriter:
+    """Отложенная запись в SQLite.
+
+    Одно долгоживущее соединение в отдельном потоке (WAL), ограниченная
+    очередь операций и пакетные транзакции по размеру или по времени.
+    enqueue() не блокирует вызывающий код.
+    """
+
+    def __init__(self, max_queue=DB_WRITE_QUEUE_SIZE, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self.thread.start()
+
+    def enqueue(self, sql, params=(), many=False):
+        """Ставит запрос в очередь; False, если очередь переполнена"""
+        self.start()
+        try:
+            self.queue.put_nowait((sql, params, many))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.error("DB write queue full, dropping write (%d dropped)", self.dropped)
+            return False
+
+    async def flush(self):
+        """Ждет, пока все поставленные ранее записи окажутся в базе"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await asyncio.to_thread(self.queue.put, _FlushRequest(loop, future))
+        await future
+
+    def stop(self, timeout=10):
+        """Сбрасывает очередь и останавливает поток записи"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # Поток еще пишет: второй писатель не запускается, пока этот не завершится
+            logger.error("DB writer did not stop in %ss, %d writes still queued", timeout, self.queue.qsize())
+            return
+        self.thread = None
+
+    def _connect(self):
+        conn = get_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is None or item is _STOP or isinstance(item, _FlushRequest):
+                    self._write_batch(conn, batch)
+                    batch, deadline = [], None
+                    if isinstance(item, _FlushRequest):
+                        item.done()
+                    elif item is _STOP:
+                        break
+                    continue
+
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.batch_size:
+                    self._write_batch(conn, batch)
+                    batch, deadline = [], None
+        finally:
+            conn.close()
+
+    def _execute(self, conn, batch):
+        """Одна транзакция; пока базу держит другой процесс (шард), повторяется целиком"""
+        for attempt in range(DB_LOCK_RETRIES):
+            try:
+                with conn:
+                    for sql, params, many in batch:
+                        if many:
+                            conn.executemany(sql, params)
+                        else:
+                            conn.execute(sql, params)
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == DB_LOCK_RETRIES - 1:
+                    raise
+                logger.warning("Database is locked, retrying batch of %d (attempt %s/%s)",
+                               len(batch), attempt + 1, DB_LOCK_RETRIES)
+                time.sleep(2 ** attempt)
+
+    def _write_batch(self, conn, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            self._execute(conn, batch)
+            logger.debug("DB batch written: %d operations", len(batch))
+        except Exception as e:
+            if 'locked' in str(e):
+                # Запись по одной уперлась бы в ту же блокировку
+                logger.error("Database stayed locked, dropping batch of %d operations", len(batch))
+            else:
+                # Транзакция откатилась: пишем по одной, чтобы не терять остальные операции
+                logger.error("DB batch error, retrying individually: %s", str(e))
+                for item in batch:
+                    try:
+                        self._execute(conn, [item])
+                    except Exception as e:
+                        logger.error("DB write error: %s", str(e))
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+
+db_writer = DatabaseWriter()
+registry.gauge('db_write_queue_depth', "Writes waiting for the SQLite writer", db_writer.queue.qsize)
+registry.gauge('db_writes_dropped', "Writes dropped because the queue was full", lambda: db_writer.dropped)
+
+def use_database(path):
+    """Переключает модуль на другой файл базы (replay, бенчмарк); возвращает прежний путь.
+
+    Поток записи держит соединение со старым файлом, поэтому он
+    останавливается и при следующей записи откроется заново.
+    """
+    global DB_PATH
+    db_writer.stop()
+    previous, DB_PATH = DB_PATH, path
+    return previous
+
+def ensure_columns(cursor, table, columns):
+    """Добавляет недостающие колонки в существующую таблицу"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
 
 def init_database():
     try:
         with get_connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS signals (
@@ -27,12 +204,56 @@ def init_database():
                     profitable INTEGER DEFAULT NULL
                 )
             ''')
+            # Колонки планировщика результатов (добавлены к существующей таблице)
+            ensure_columns(cursor, 'signals', {
+                'entry_price': 'REAL',
+                'entry_time': 'INTEGER',
+                'due_at': 'INTEGER',
+                'resolved_at': 'INTEGER',
+                # Значения индикаторов на момент сигнала (scoring.encode_features)
+                'features': 'BLOB',
+                # Время создания в мс - ключ сортировки и пагинации истории
+                'created_at': 'INTEGER'
+            })
+            cursor.execute('''
+                UPDATE signals SET created_at = CAST(strftime('%s', timestamp) AS INTEGER) * 1000
+                WHERE created_at IS NULL
+            ''')
+            # История: сортировка (created_at, id), фильтры по паре и таймфрейму
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_signals_created ON signals (created_at, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_signals_symbol_created ON signals (symbol, created_at, id)')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_signals_symbol_timeframe_created
+                ON signals (symbol, timeframe, created_at, id)
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_signals_timeframe_created ON signals (timeframe, created_at, id)')
+            # Незавершенные оценки результатов (load_pending_outcomes)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_signals_pending ON signals (due_at)
+                WHERE due_at IS NOT NULL AND resolved_at IS NULL
+            ''')
+            # Сводка результатов по паре, таймфрейму и индикатору, обновляется при оценке сигнала
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS signal_stats (
+                    dimension TEXT,
+                    key TEXT,
+                    total INTEGER DEFAULT 0,
+                    profitable INTEGER DEFAULT 0,
+                    PRIMARY KEY (dimension, key)
+                )
+            ''')
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] < SCHEMA_VERSION:
+                rebuild_signal_stats(cursor)
+                cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS indicator_weights (
                     indicator TEXT PRIMARY KEY,
                     weight REAL
                 )
             ''')
+            # Время записи в мс: снимок применяет свои веса, только если он новее
+            ensure_columns(cursor, 'indicator_weights', {'updated_at': 'INTEGER'})
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS performance (
                     indicator TEXT PRIMARY KEY,
@@ -45,41 +266,226 @@ def init_database():
     except Exception as e:
         logger.error("Database init error: %s", str(e))
 
-def store_signal(signal_id, symbol, timeframe, signal_type, strength, accuracy, indicators):
+def store_signal(signal_id, symbol, timeframe, signal_type, strength, accuracy, indicators, features=None):
+    db_writer.enqueue('''
+        INSERT INTO signals (id, symbol, timeframe, signal_type, strength, accuracy, indicators, features, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (signal_id, symbol, timeframe, signal_type, strength, accuracy, ','.join(indicators), features,
+          int(time.time() * 1000)))
+    logger.info("Signal queued: %s", signal_id)
+
+def update_signal_strength(signal_id, strength, indicators, features=None):
+    db_writer.enqueue('''
+        UPDATE signals SET strength = ?, indicators = ?, features = COALESCE(?, features) WHERE id = ?
+    ''', (strength, ','.join(indicators), features, signal_id))
+
+def stat_keys(symbol, timeframe, indicators):
+    """Строки signal_stats, которые затрагивает сигнал"""
+    return [('all', '*'), ('symbol', symbol), ('timeframe', timeframe)] + \
+        [('indicator', indicator) for indicator in indicators if indicator]
+
+def rebuild_signal_stats(cursor):
+    """Полный пересчет сводки по оцененным сигналам (один раз, до SCHEMA_VERSION)"""
+    stats = {}
+    cursor.execute('SELECT symbol, timeframe, indicators, profitable FROM signals WHERE profitable IS NOT NULL')
+    for symbol, timeframe, indicators, profitable in cursor.fetchall():
+        for key in stat_keys(symbol, timeframe, (indicators or '').split(',')):
+            total, wins = stats.get(key, (0, 0))
+            stats[key] = (total + 1, wins + profitable)
+    cursor.executemany('INSERT OR REPLACE INTO signal_stats (dimension, key, total, profitable) VALUES (?, ?, ?, ?)',
+                       [(dimension, key, total, wins) for (dimension, key), (total, wins) in stats.items()])
+    if stats:
+        logger.info("Signal stats rebuilt: %d rows", len(stats))
+
+def update_signal_result(signal_id, profitable, signal=None):
+    """profitable=None - результат определить не удалось.
+
+    signal - словарь с symbol, timeframe и indicators для обновления signal_stats;
+    сводка меняется только если сигнал еще не был оценен.
+    """
+    if signal is not None and profitable is not None:
+        db_writer.enqueue('''
+            INSERT INTO signal_stats (dimension, key, total, profitable)
+            SELECT ?, ?, 1, ? WHERE EXISTS (SELECT 1 FROM signals WHERE id = ? AND resolved_at IS NULL)
+            ON CONFLICT (dimension, key) DO UPDATE SET
+                total = total + 1, profitable = profitable + excluded.profitable
+        ''', [(dimension, key, 1 if profitable else 0, signal_id)
+              for dimension, key in stat_keys(signal['symbol'], signal['timeframe'], signal['indicators'])],
+            many=True)
+    db_writer.enqueue('''
+        UPDATE signals SET profitable = ?, resolved_at = ? WHERE id = ?
+    ''', (None if profitable is None else 1 if profitable else 0, int(time.time() * 1000), signal_id))
+    logger.info("Signal result queued: %s -> %s", signal_id, profitable)
+
+def schedule_signal_outcome(signal_id, entry_price, entry_time, due_at):
+    db_writer.enqueue('''
+        UPDATE signals SET entry_price = ?, entry_time = ?, due_at = ? WHERE id = ?
+    ''', (entry_price, entry_time, due_at, signal_id))
+
+def load_pending_outcomes(symbols=None):
+    """Отправленные сигналы, результат которых еще не оценен (по парам symbols, None - все)"""
+    if not os.path.exists(DB_PATH):
+        return []
     try:
         with get_connection() as conn:
-            conn.execute('''
-                INSERT INTO signals (id, symbol, timeframe, signal_type, strength, accuracy, indicators)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (signal_id, symbol, timeframe, signal_type, strength, accuracy, ','.join(indicators)))
-            conn.commit()
-        logger.info("Signal stored: %s", signal_id)
+            query = '''
+                SELECT id, symbol, timeframe, signal_type, indicators, entry_price, entry_time, due_at
+                FROM signals WHERE due_at IS NOT NULL AND resolved_at IS NULL
+            '''
+            params = ()
+            if symbols is not None:
+                symbols = list(symbols)
+                query += f" AND symbol IN ({','.join('?' * len(symbols))})"
+                params = symbols
+            cursor = conn.execute(query, params)
+            return [{
+                'id': row[0],
+                'symbol': row[1],
+                'timeframe': row[2],
+                'signal_type': row[3],
+                'indicators': row[4].split(',') if row[4] else [],
+                'entry_price': row[5],
+                'entry_time': row[6],
+                'due_at': row[7]
+            } for row in cursor.fetchall()]
     except Exception as e:
-        logger.error("Store signal error: %s", str(e))
+        logger.error("Load pending outcomes error: %s", str(e))
+        return []
 
-def update_signal_result(signal_id, profitable):
+def load_training_signals():
+    """(signal_type, features, profitable) всех оцененных сигналов с сохраненными признаками"""
+    if not os.path.exists(DB_PATH):
+        return []
     try:
         with get_connection() as conn:
-            conn.execute('''
-                UPDATE signals SET profitable = ? WHERE id = ?
-            ''', (1 if profitable else 0, signal_id))
-            conn.commit()
-        logger.info("Signal result updated: %s -> %s", signal_id, profitable)
+            cursor = conn.execute('''
+                SELECT signal_type, features, profitable FROM signals
+                WHERE profitable IS NOT NULL AND features IS NOT NULL
+            ''')
+            return cursor.fetchall()
     except Exception as e:
-        logger.error("Update signal error: %s", str(e))
+        logger.error("Load training signals error: %s", str(e))
+        return []
 
 def save_weights(weights):
+    updated_at = int(time.time() * 1000)
+    db_writer.enqueue('''
+        INSERT OR REPLACE INTO indicator_weights (indicator, weight, updated_at)
+        VALUES (?, ?, ?)
+    ''', [(indicator, weight, updated_at) for indicator, weight in weights.items()], many=True)
+    logger.info("Weights queued: %d indicators", len(weights))
+
+# Фильтр outcome истории сигналов
+OUTCOME_CONDITIONS = {
+    'profitable': 'profitable = 1',
+    'unprofitable': 'profitable = 0',
+    'pending': 'resolved_at IS NULL',
+    'unknown': 'resolved_at IS NOT NULL AND profitable IS NULL'
+}
+SIGNAL_FIELDS = ('id', 'symbol', 'timeframe', 'signal_type', 'strength', 'accuracy', 'indicators', 'created_at',
+                 'entry_price', 'entry_time', 'due_at', 'resolved_at', 'profitable')
+
+def read_with_schema(read):
+    """read(conn) для API, которое отвечает и до /start (init_database).
+
+    Без файла базы - None. База без таблиц или от прошлой версии схемы
+    сначала приводится к текущей схеме, затем чтение повторяется.
+    """
+    if not os.path.exists(DB_PATH):
+        return None
     try:
         with get_connection() as conn:
-            for indicator, weight in weights.items():
-                conn.execute('''
-                    INSERT OR REPLACE INTO indicator_weights (indicator, weight)
-                    VALUES (?, ?)
-                ''', (indicator, weight))
-            conn.commit()
-        logger.info("Weights saved: %d indicators", len(weights))
+            return read(conn)
+    except sqlite3.OperationalError as e:
+        if 'no such' not in str(e):
+            raise
+        logger.info("Database schema is missing (%s), creating it", str(e))
+    init_database()
+    with get_connection() as conn:
+        return read(conn)
+
+def query_signals(symbol=None, timeframe=None, signal_type=None, outcome=None, since=None, until=None,
+                  limit=50, cursor=None):
+    """Страница истории сигналов от новых к старым и курсор следующей страницы.
+
+    Пагинация по ключу (created_at, id): cursor - "created_at:id" последней
+    строки предыдущей страницы, поэтому глубина страницы не влияет на скорость.
+    """
+    if outcome is not None and outcome not in OUTCOME_CONDITIONS:
+        raise ValueError(f"Unknown outcome: {outcome}")
+    if signal_type is not None and signal_type not in ('BUY', 'SELL'):
+        raise ValueError(f"Unknown signal type: {signal_type}")
+    conditions, params = ['created_at IS NOT NULL'], []
+    for column, value in (('symbol', symbol), ('timeframe', timeframe), ('signal_type', signal_type)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if outcome is not None:
+        conditions.append(OUTCOME_CONDITIONS[outcome])
+    if since is not None:
+        conditions.append('created_at >= ?')
+        params.append(int(since))
+    if until is not None:
+        conditions.append('created_at < ?')
+        params.append(int(until))
+    if cursor:
+        created_at, _, last_id = cursor.partition(':')
+        if not created_at.isdigit() or not last_id:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        conditions.append('(created_at, id) < (?, ?)')
+        params.extend([int(created_at), last_id])
+    rows = read_with_schema(lambda conn: conn.execute(f'''
+        SELECT {', '.join(SIGNAL_FIELDS)} FROM signals
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall())
+    if rows is None:
+        return [], None
+    signals = []
+    for row in rows[:limit]:
+        signal = dict(zip(SIGNAL_FIELDS, row))
+        signal['indicators'] = signal['indicators'].split(',') if signal['indicators'] else []
+        signal['profitable'] = None if signal['profitable'] is None else bool(signal['profitable'])
+        signals.append(signal)
+    next_cursor = f"{signals[-1]['created_at']}:{signals[-1]['id']}" if len(rows) > limit else None
+    return signals, next_cursor
+
+def load_signal_stats(dimension=None):
+    """{dimension: {key: {total, profitable, hit_rate}}} из signal_stats"""
+    query = 'SELECT dimension, key, total, profitable FROM signal_stats'
+    params = ()
+    if dimension is not None:
+        query += ' WHERE dimension = ?'
+        params = (dimension,)
+    rows = read_with_schema(lambda conn: conn.execute(query + ' ORDER BY dimension, total DESC', params).fetchall())
+    stats = {}
+    for dimension, key, total, profitable in rows or []:
+        stats.setdefault(dimension, {})[key] = {
+            'total': total,
+            'profitable': profitable,
+            'hit_rate': profitable / total if total else 0.0
+        }
+    return stats
+
+def save_performance_rows(rows):
+    """rows - [(indicator, success, total)], одной операцией в одной транзакции"""
+    db_writer.enqueue('''
+        INSERT OR REPLACE INTO performance (indicator, success, total)
+        VALUES (?, ?, ?)
+    ''', rows, many=True)
+    logger.info("Performance queued: %d indicators", len(rows))
+
+def load_performance():
+    if not os.path.exists(DB_PATH):
+        return {}
+    try:
+        with get_connection() as conn:
+            cursor = conn.execute('SELECT indicator, success, total FROM performance')
+            return {row[0]: {'success': row[1], 'total': row[2]} for row in cursor.fetchall()}
     except Exception as e:
-        logger.error("Save weights error: %s", str(e))
+        logger.error("Load performance error: %s", str(e))
+        return {}
 
 def load_weights():
     if not os.path.exists(DB_PATH):
@@ -94,3 +500,15 @@ def load_weights():
     except Exception as e:
         logger.error("Load weights error: %s", str(e))
         return {}
+
+def weights_saved_at():
+    """Время последней записи весов в мс; 0 - веса записаны до появления updated_at, None - весов нет"""
+    if not os.path.exists(DB_PATH):
+        return None
+    try:
+        with get_connection() as conn:
+            count, saved_at = conn.execute('SELECT COUNT(*), MAX(updated_at) FROM indicator_weights').fetchone()
+            return (saved_at or 0) if count else None
+    except Exception as e:
+        logger.error("Load weights error: %s", str(e))
+        return None
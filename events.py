@@ -0,0 +1,48 @@
+import asyncio
+from globals import CLOSED_ONLY_TIMEFRAMES
+
+CANDLE_UPDATED = 'updated'
+CANDLE_CLOSED = 'closed'
+
+class KlineEventQueue:
+    """Очередь изменений по потокам (symbol, timeframe) с объединением событий.
+
+    Пока поток ждет обработки, новые события по нему не добавляются в очередь,
+    а только повышают тип: закрытие свечи важнее обновления незакрытой.
+    """
+
+    def __init__(self, closed_only=CLOSED_ONLY_TIMEFRAMES):
+        self.closed_only = set(closed_only)
+        self.pending = {}
+        self.queue = asyncio.Queue()
+
+    def publish(self, symbol, timeframe, event):
+        if event == CANDLE_UPDATED and timeframe in self.closed_only:
+            return
+        key = (symbol, timeframe)
+        if key in self.pending:
+            if event == CANDLE_CLOSED:
+                self.pending[key] = CANDLE_CLOSED
+            return
+        self.pending[key] = event
+        self.queue.put_nowait(key)
+
+    async def get(self):
+        key = await self.queue.get()
+        return key, self.pending.pop(key)
+
+    def drain(self):
+        """Все уже накопившиеся события без ожидания"""
+        events = []
+        while not self.queue.empty():
+            key = self.queue.get_nowait()
+            events.append((key, self.pending.pop(key)))
+        return events
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def clear(self):
+        self.drain()
+
+kline_events = KlineEventQueue()
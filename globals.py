@@ -3,15 +3,125 @@ import os
 # Используем переменные окружения как основной источник
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', "")
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', "")
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', "https://api.telegram.org")
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_SENDERS = int(os.environ.get('TELEGRAM_SENDERS', 2))
+TELEGRAM_QUEUE_SIZE = int(os.environ.get('TELEGRAM_QUEUE_SIZE', 1000))
 
 TRADING_PAIRS = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT', 'XRPUSDT', 
                  'DOGEUSDT', 'ADAUSDT', 'MATICUSDT', 'AVAXUSDT', 'DOTUSDT']
 TIMEFRAMES = ['1m', '5m', '15m', '30m', '1h', '4h', '1d']
 
+# Binance combined streams: несколько потоков мультиплексируются в одно соединение
+BINANCE_WS_URL = os.environ.get('BINANCE_WS_URL', "wss://stream.binance.com:9443")
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', 4))
+WS_MAX_STREAMS_PER_CONNECTION = int(os.environ.get('WS_MAX_STREAMS_PER_CONNECTION', 200))
+
+# Старшие таймфреймы строятся локально из одного базового потока на пару
+AGGREGATE_TIMEFRAMES = os.environ.get('AGGREGATE_TIMEFRAMES', '1') == '1'
+BASE_TIMEFRAME = os.environ.get('BASE_TIMEFRAME', '1m')
+
+# Длительность таймфреймов Binance в миллисекундах
+TIMEFRAME_MS = {
+    '1m': 60_000,
+    '3m': 180_000,
+    '5m': 300_000,
+    '15m': 900_000,
+    '30m': 1_800_000,
+    '1h': 3_600_000,
+    '2h': 7_200_000,
+    '4h': 14_400_000,
+    '6h': 21_600_000,
+    '8h': 28_800_000,
+    '12h': 43_200_000,
+    '1d': 86_400_000
+}
+
 SIGNAL_THRESHOLD = 0.85
 MIN_INDICATORS = 5
 CONFIRMATION_THRESHOLD = 0.7
 
+# Емкость кольцевого буфера свечей на каждый (symbol, timeframe)
+CANDLE_HISTORY = int(os.environ.get('CANDLE_HISTORY', 500))
+
+# Таймфреймы, которые анализируются только по закрытию свечи (без незакрытых баров)
+CLOSED_ONLY_TIMEFRAMES = [tf for tf in os.environ.get('CLOSED_ONLY_TIMEFRAMES', '4h,1d').split(',') if tf]
+# Где считаются пакетные индикаторы: inline, thread или process
+# (process в шардах заменяется на thread, чтобы не плодить shards x workers процессов)
+COMPUTE_EXECUTOR = os.environ.get('COMPUTE_EXECUTOR', 'thread')
+COMPUTE_WORKERS = int(os.environ.get('COMPUTE_WORKERS', 2))
+
+# Максимум снимков индикаторов в LRU-кэше (по одному на symbol/timeframe)
+INDICATOR_CACHE_SIZE = int(os.environ.get('INDICATOR_CACHE_SIZE', 512))
+
+# Фоновая запись в SQLite: размер очереди, размер пакета и интервал сброса (секунды)
+DB_WRITE_QUEUE_SIZE = int(os.environ.get('DB_WRITE_QUEUE_SIZE', 10000))
+DB_BATCH_SIZE = int(os.environ.get('DB_BATCH_SIZE', 200))
+DB_FLUSH_INTERVAL = float(os.environ.get('DB_FLUSH_INTERVAL', 1.0))
+# Сколько ждать снятия блокировки базы другим процессом (шарды пишут в один файл), секунды
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 30))
+
+# Запись сырых kline-сообщений для последующего воспроизведения (replay.py)
+RECORD_KLINES = os.environ.get('RECORD_KLINES', '0') == '1'
+RECORDINGS_DIR = os.environ.get('RECORDINGS_DIR', 'data/recordings')
+RECORD_SEGMENT_SECONDS = int(os.environ.get('RECORD_SEGMENT_SECONDS', 3600))
+
+# Архив закрытых свечей на диске (archive.py): файл на каждый (symbol, timeframe)
+ARCHIVE_KLINES = os.environ.get('ARCHIVE_KLINES', '1') == '1'
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'data/archive')
+
+# Снимок состояния в памяти для быстрого перезапуска
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'data/snapshot.npz')
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', 300))
+# Поток из снимка не используется, если с его последней свечи пропущено больше баров
+SNAPSHOT_MAX_GAP_CANDLES = int(os.environ.get('SNAPSHOT_MAX_GAP_CANDLES', 5))
+
+# Загрузка истории свечей через REST при запуске (0 - не загружать)
+BINANCE_REST_URL = os.environ.get('BINANCE_REST_URL', "https://api.binance.com")
+BACKFILL_CANDLES = int(os.environ.get('BACKFILL_CANDLES', CANDLE_HISTORY))
+BACKFILL_CONCURRENCY = int(os.environ.get('BACKFILL_CONCURRENCY', 5))
+# Свой бюджет веса запросов в минуту (лимит Binance на IP выше)
+BACKFILL_WEIGHT_LIMIT = int(os.environ.get('BACKFILL_WEIGHT_LIMIT', 1000))
+
+# Шардирование: SHARDS рабочих процессов делят TRADING_PAIRS (0 - все в одном процессе)
+SHARDS = int(os.environ.get('SHARDS', 0))
+# round_robin - поровну по порядку, hash - по crc32 символа (не зависит от состава списка)
+SHARD_STRATEGY = os.environ.get('SHARD_STRATEGY', 'round_robin')
+# Явное закрепление пар: "BTCUSDT:0,ETHUSDT:1"
+SHARD_MAP = {pair: int(shard) for pair, _, shard in
+             (item.partition(':') for item in os.environ.get('SHARD_MAP', '').split(',') if item)}
+# Как часто рабочие процессы присылают метрики супервизору, секунды
+SHARD_REPORT_INTERVAL = float(os.environ.get('SHARD_REPORT_INTERVAL', 5))
+
+# Повтор сигнала того же направления по той же паре и таймфрейму подавляется:
+# на той же свече и в течение SIGNAL_COOLDOWN_CANDLES баров после нее
+SIGNAL_COOLDOWN_CANDLES = int(os.environ.get('SIGNAL_COOLDOWN_CANDLES', 3))
+# Окна подавления по таймфреймам в секундах, заменяют окно в барах: "1m:300,1h:7200"
+SIGNAL_COOLDOWN = {timeframe: int(seconds) for timeframe, _, seconds in
+                   (item.partition(':') for item in os.environ.get('SIGNAL_COOLDOWN', '').split(',') if item)}
+# На сколько сила сигнала должна превысить прошлую, чтобы пройти подавление
+SIGNAL_BREAKTHROUGH = float(os.environ.get('SIGNAL_BREAKTHROUGH', 0.05))
+
+# Результаты сигналов применяются к весам пакетом не чаще раза в LEARNING_BATCH_DELAY секунд,
+# статистика пишется в таблицу performance не чаще раза в LEARNING_PERSIST_DELAY секунд
+LEARNING_BATCH_DELAY = float(os.environ.get('LEARNING_BATCH_DELAY', 1.0))
+LEARNING_PERSIST_DELAY = float(os.environ.get('LEARNING_PERSIST_DELAY', 30))
+
+# Переобучение весов логистической регрессией по оцененным сигналам (refit.py):
+# период в секундах (0 - только вручную), минимум сигналов, L2-регуляризация
+REFIT_INTERVAL = int(os.environ.get('REFIT_INTERVAL', 86400))
+REFIT_MIN_SIGNALS = int(os.environ.get('REFIT_MIN_SIGNALS', 200))
+REFIT_REGULARIZATION = float(os.environ.get('REFIT_REGULARIZATION', 1.0))
+
+# Фоновая загрузка модулей анализа после старта API (иначе - при первом /start)
+PRELOAD_ANALYSIS = os.environ.get('PRELOAD_ANALYSIS', '1') == '1'
+PRELOAD_DELAY = float(os.environ.get('PRELOAD_DELAY', 1.0))
+
+# Период проверки ожидающих подтверждения сигналов, секунды
+PENDING_CHECK_INTERVAL = 3
+
 bot_status = {
     'running': False,
     'paused': False,
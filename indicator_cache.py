@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from globals import INDICATOR_CACHE_SIZE
+from metrics import registry
+
+class IndicatorCache:
+    """LRU-кэш снимков индикаторов по (symbol, timeframe).
+
+    Снимок действителен, пока последняя свеча потока имеет те же время
+    открытия и цену закрытия, с которыми он был сохранен.
+    """
+
+    def __init__(self, maxsize=INDICATOR_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def candle_key(store):
+        last = store.last()
+        return None if last is None else (last['timestamp'], last['close'])
+
+    def get(self, symbol, timeframe, store, columns=None):
+        """columns - колонки, которые должны быть в снимке (снимок мог считаться не по всем индикаторам)"""
+        key = (symbol, timeframe)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == self.candle_key(store) and \
+                (columns is None or all(column in entry[1] for column in columns)):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, symbol, timeframe, store, snapshot, candle=None):
+        """candle - ключ свечи, на которой считался снимок, если расчет шел асинхронно"""
+        if snapshot is None:
+            return
+        key = (symbol, timeframe)
+        self.entries[key] = (candle or self.candle_key(store), snapshot)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, symbol, timeframe):
+        self.entries.pop((symbol, timeframe), None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+indicator_cache = IndicatorCache()
+registry.gauge('indicator_cache', "Indicator snapshot cache statistics", indicator_cache.stats)
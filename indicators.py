@@ -5,62 +5,171 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Запас свечей сверх минимального lookback, чтобы EMA/RMA успели сойтись
+INDICATOR_WARMUP = 50
+
+class Indicator:
+    """Описание индикатора: входные колонки, минимум свечей до первого значения, выходные колонки"""
+
+    def __init__(self, name, inputs, lookback, outputs, compute):
+        self.name = name
+        self.inputs = inputs
+        self.lookback = lookback
+        self.outputs = outputs
+        self.compute = compute
+
+class IndicatorContext:
+    """Общие промежуточные ряды одного расчета (OBV, EMA, свечные модели) - считаются один раз"""
+
+    def __init__(self, df):
+        self.df = df
+        self.cache = {}
+
+    def memo(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def obv(self):
+        return self.memo('obv', lambda: ta.obv(self.df['close'], self.df['volume']))
+
+    def ema(self, column, length):
+        source = self.obv() if column == 'OBV' else self.df[column]
+        return self.memo(('ema', column, length), lambda: ta.ema(source, length=length))
+
+    def cdl(self, pattern):
+        df = self.df
+        return self.memo(('cdl', pattern),
+                         lambda: ta.cdl_pattern(df['open'], df['high'], df['low'], df['close'], pattern))
+
+def _ema(ctx):
+    return {'EMA_12': ctx.ema('close', 12), 'EMA_26': ctx.ema('close', 26)}
+
+def _sma(ctx):
+    return {'SMA_20': ta.sma(ctx.df['close'], length=20)}
+
+def _macd(ctx):
+    macd = ta.macd(ctx.df['close'], fast=12, slow=26, signal=9)
+    return {'MACD': macd['MACD_12_26_9'], 'MACD_signal': macd['MACDs_12_26_9']}
+
+def _adx(ctx):
+    df = ctx.df
+    return {'ADX': ta.adx(df['high'], df['low'], df['close'])['ADX_14']}
+
+def _supertrend(ctx):
+    df = ctx.df
+    supertrend = ta.supertrend(df['high'], df['low'], df['close'], length=10, multiplier=3)
+    return {'Supertrend': supertrend['SUPERT_10_3.0']}  # 1 - восходящий, -1 - нисходящий
+
+def _rsi(ctx):
+    return {'RSI': ta.rsi(ctx.df['close'], length=14)}
+
+def _cci(ctx):
+    df = ctx.df
+    return {'CCI': ta.cci(df['high'], df['low'], df['close'], length=20)}
+
+def _stoch(ctx):
+    df = ctx.df
+    stoch = ta.stoch(df['high'], df['low'], df['close'], k=14, d=3)
+    return {'Stoch_k': stoch['STOCHk_14_3_3'], 'Stoch_d': stoch['STOCHd_14_3_3']}
+
+def _williams(ctx):
+    df = ctx.df
+    return {'Williams': ta.willr(df['high'], df['low'], df['close'], length=14)}
+
+def _atr(ctx):
+    df = ctx.df
+    return {'ATR': ta.atr(df['high'], df['low'], df['close'], length=14)}
+
+def _bbands(ctx):
+    bb = ta.bbands(ctx.df['close'], length=20, std=2)
+    return {'BB_upper': bb['BBU_20_2.0'], 'BB_middle': bb['BBM_20_2.0'], 'BB_lower': bb['BBL_20_2.0']}
+
+def _kc(ctx):
+    df = ctx.df
+    kc = ta.kc(df['high'], df['low'], df['close'], length=20, scalar=2)
+    return {'KC_upper': kc['KCUe_20_2'], 'KC_middle': kc['KCLe_20_2'], 'KC_lower': kc['KCLe_20_2']}
+
+def _obv(ctx):
+    return {'OBV': ctx.obv(), 'OBV_trend': ctx.ema('OBV', 20) - ctx.ema('OBV', 50)}
+
+def _pvo(ctx):
+    return {'Volume_Osc': ta.pvo(ctx.df['volume'])['PVO_12_26_9']}
+
+def _patterns(ctx):
+    engulfing = ctx.cdl("engulfing")
+    piercing = ctx.cdl("piercing")
+    return {
+        'Bullish_Engulfing': engulfing == 100,
+        'Bearish_Engulfing': engulfing == -100,
+        'Hammer': ctx.cdl("hammer") == 100,
+        'Pin_Bar_bull': piercing == 100,
+        'Pin_Bar_bear': piercing == -100
+    }
+
+HLC = ('high', 'low', 'close')
+
+# Порядок совпадает с порядком колонок calculate_all_indicators
+INDICATORS = {spec.name: spec for spec in [
+    # Трендовые
+    Indicator('EMA', ('close',), 26, ('EMA_12', 'EMA_26'), _ema),
+    Indicator('SMA', ('close',), 20, ('SMA_20',), _sma),
+    Indicator('MACD', ('close',), 34, ('MACD', 'MACD_signal'), _macd),
+    Indicator('ADX', HLC, 28, ('ADX',), _adx),
+    Indicator('Supertrend', HLC, 11, ('Supertrend',), _supertrend),
+    # Осцилляторы
+    Indicator('RSI', ('close',), 15, ('RSI',), _rsi),
+    Indicator('CCI', HLC, 20, ('CCI',), _cci),
+    Indicator('Stochastic', HLC, 18, ('Stoch_k', 'Stoch_d'), _stoch),
+    Indicator('Williams', HLC, 14, ('Williams',), _williams),
+    # Волатильность
+    Indicator('ATR', HLC, 15, ('ATR',), _atr),
+    Indicator('Bollinger_Bands', ('close',), 20, ('BB_upper', 'BB_middle', 'BB_lower'), _bbands),
+    Indicator('Keltner_Channel', HLC, 21, ('KC_upper', 'KC_middle', 'KC_lower'), _kc),
+    # Объем
+    Indicator('OBV', ('close', 'volume'), 50, ('OBV', 'OBV_trend'), _obv),
+    Indicator('Volume_Oscillator', ('volume',), 26, ('Volume_Osc',), _pvo),
+    # Свечные модели
+    Indicator('Patterns', ('open', 'high', 'low', 'close'), 11,
+              ('Bullish_Engulfing', 'Bearish_Engulfing', 'Hammer', 'Pin_Bar_bull', 'Pin_Bar_bear'), _patterns),
+]}
+
+# Что нужно is_signal_confirmed для подтверждения старшим таймфреймом
+CONFIRMATION_INDICATORS = ('EMA', 'MACD', 'Bollinger_Bands', 'ADX', 'OBV')
+
+def resolve(indicators=None):
+    if indicators is None:
+        return list(INDICATORS.values())
+    unknown = [name for name in indicators if name not in INDICATORS]
+    if unknown:
+        raise KeyError(f"Unknown indicators: {', '.join(unknown)}")
+    return [spec for spec in INDICATORS.values() if spec.name in indicators]
+
+def lookback(indicators=None):
+    return max(spec.lookback for spec in resolve(indicators))
+
+def window_size(indicators=None):
+    """Сколько последних свечей передавать в расчет для набора индикаторов"""
+    return lookback(indicators) + INDICATOR_WARMUP
+
+def output_columns(indicators=None):
+    return [column for spec in resolve(indicators) for column in spec.outputs]
+
 class TechnicalIndicators:
     @staticmethod
-    def calculate_all_indicators(df):
+    def calculate(df, indicators=None):
+        """Только запрошенные индикаторы; строки отбрасываются по пропускам в их колонках"""
         try:
-            # Трендовые
-            df['EMA_12'] = ta.ema(df['close'], length=12)
-            df['EMA_26'] = ta.ema(df['close'], length=26)
-            df['SMA_20'] = ta.sma(df['close'], length=20)
-            
-            macd = ta.macd(df['close'], fast=12, slow=26, signal=9)
-            df['MACD'] = macd['MACD_12_26_9']
-            df['MACD_signal'] = macd['MACDs_12_26_9']
-            
-            df['ADX'] = ta.adx(df['high'], df['low'], df['close'])['ADX_14']
-            
-            supertrend = ta.supertrend(df['high'], df['low'], df['close'], length=10, multiplier=3)
-            df['Supertrend'] = supertrend['SUPERT_10_3.0']  # 1 - восходящий, -1 - нисходящий
-            
-            # Осцилляторы
-            df['RSI'] = ta.rsi(df['close'], length=14)
-            df['CCI'] = ta.cci(df['high'], df['low'], df['close'], length=20)
-            
-            stoch = ta.stoch(df['high'], df['low'], df['close'], k=14, d=3)
-            df['Stoch_k'] = stoch['STOCHk_14_3_3']
-            df['Stoch_d'] = stoch['STOCHd_14_3_3']
-            
-            df['Williams'] = ta.willr(df['high'], df['low'], df['close'], length=14)
-            
-            # Волатильность
-            df['ATR'] = ta.atr(df['high'], df['low'], df['close'], length=14)
-            
-            bb = ta.bbands(df['close'], length=20, std=2)
-            df['BB_upper'] = bb['BBU_20_2.0']
-            df['BB_middle'] = bb['BBM_20_2.0']
-            df['BB_lower'] = bb['BBL_20_2.0']
-            
-            kc = ta.kc(df['high'], df['low'], df['close'], length=20, scalar=2)
-            df['KC_upper'] = kc['KCUe_20_2']
-            df['KC_middle'] = kc['KCLe_20_2']
-            df['KC_lower'] = kc['KCLe_20_2']
-            
-            # Объем
-            df['OBV'] = ta.obv(df['close'], df['volume'])
-            df['OBV_trend'] = ta.ema(df['OBV'], length=20) - ta.ema(df['OBV'], length=50)
-            
-            pvo = ta.pvo(df['volume'])
-            df['Volume_Osc'] = pvo['PVO_12_26_9']
-            
-            # Свечные модели
-            df['Bullish_Engulfing'] = ta.cdl_pattern(df['open'], df['high'], df['low'], df['close'], "engulfing") == 100
-            df['Bearish_Engulfing'] = ta.cdl_pattern(df['open'], df['high'], df['low'], df['close'], "engulfing") == -100
-            df['Hammer'] = ta.cdl_pattern(df['open'], df['high'], df['low'], df['close'], "hammer") == 100
-            df['Pin_Bar_bull'] = ta.cdl_pattern(df['open'], df['high'], df['low'], df['close'], "piercing") == 100
-            df['Pin_Bar_bear'] = ta.cdl_pattern(df['open'], df['high'], df['low'], df['close'], "piercing") == -100
-            
-            return df.dropna()
+            specs = resolve(indicators)
+            ctx = IndicatorContext(df)
+            for spec in specs:
+                for column, values in spec.compute(ctx).items():
+                    df[column] = values
+            return df.dropna(subset=[column for spec in specs for column in spec.outputs])
         except Exception as e:
             logger.error(f"Error calculating indicators: {e}")
             return df
+
+    @staticmethod
+    def calculate_all_indicators(df):
+        return TechnicalIndicators.calculate(df)
@@ -1,89 +1,186 @@
+import asyncio
 import logging
 import json
 import os
 import numpy as np
-from globals import indicator_weights
+from globals import indicator_weights, LEARNING_BATCH_DELAY, LEARNING_PERSIST_DELAY
+from database import load_performance, save_performance_rows
 
 logger = logging.getLogger(__name__)
 
+# Старый формат хранения, переносится в таблицу performance при первом запуске
 PERFORMANCE_FILE = 'data/performance.json'
+MIN_SIGNALS = 10  # Минимум сигналов для адаптации
+MIN_WEIGHT = 0.02
+MAX_WEIGHT = 0.15
 
 class LearningSystem:
-    performance_data = {}
+    """Статистика индикаторов в массивах success/total и адаптация весов.
+
+    Результаты сигналов копятся в pending и применяются пакетом через
+    LEARNING_BATCH_DELAY; изменившиеся строки пишутся в таблицу performance
+    не чаще раза в LEARNING_PERSIST_DELAY. Все изменения идут из цикла
+    событий, поэтому одновременные оценки результатов не гоняются за данными.
+    """
+
     learning_rate = 0.01  # Скорость обучения
-    
+    names = []
+    index = {}
+    success = np.zeros(0, dtype=np.int64)
+    total = np.zeros(0, dtype=np.int64)
+    dirty = set()
+    pending = []
+    apply_handle = None
+    persist_handle = None
+    # Вызывается после применения пакета (супервизор рассылает веса шардам)
+    on_apply = None
+
+    @classmethod
+    def _reset(cls):
+        cls.names, cls.index = [], {}
+        cls.success = np.zeros(0, dtype=np.int64)
+        cls.total = np.zeros(0, dtype=np.int64)
+        cls.dirty, cls.pending = set(), []
+
+    @classmethod
+    def _slot(cls, indicator):
+        slot = cls.index.get(indicator)
+        if slot is None:
+            slot = cls.index[indicator] = len(cls.names)
+            cls.names.append(indicator)
+            cls.success = np.append(cls.success, 0)
+            cls.total = np.append(cls.total, 0)
+        return slot
+
     @classmethod
     def initialize(cls):
-        """Загрузка данных о производительности"""
+        """Загрузка данных о производительности из базы"""
+        cls._reset()
         try:
-            if os.path.exists(PERFORMANCE_FILE):
+            data = load_performance()
+            if not data and os.path.exists(PERFORMANCE_FILE):
                 with open(PERFORMANCE_FILE, 'r') as f:
-                    cls.performance_data = json.load(f)
-                logger.info("Performance data loaded")
+                    data = json.load(f)
+                cls.dirty.update(data)
+                logger.info("Migrating %s to the performance table", PERFORMANCE_FILE)
+            for indicator, stats in data.items():
+                slot = cls._slot(indicator)
+                cls.success[slot] = stats['success']
+                cls.total[slot] = stats['total']
+            logger.info("Performance data loaded: %d indicators", len(cls.names))
         except Exception as e:
             logger.error(f"Error loading performance data: {e}")
-    
+
+    @classmethod
+    def export(cls):
+        return {indicator: {'success': int(cls.success[slot]), 'total': int(cls.total[slot])}
+                for indicator, slot in cls.index.items()}
+
+    @classmethod
+    def merge(cls, data):
+        """Статистика из снимка: по каждому индикатору остается запись с большим total"""
+        for indicator, stats in data.items():
+            slot = cls._slot(indicator)
+            if stats['total'] > cls.total[slot]:
+                cls.success[slot] = stats['success']
+                cls.total[slot] = stats['total']
+                cls.dirty.add(indicator)
+
     @classmethod
     def save_performance(cls):
-        """Сохранение данных о производительности"""
-        try:
-            with open(PERFORMANCE_FILE, 'w') as f:
-                json.dump(cls.performance_data, f)
-            logger.info("Performance data saved")
-        except Exception as e:
-            logger.error(f"Error saving performance data: {e}")
-    
+        """Применяет накопленные результаты и ставит изменившиеся строки в очередь записи"""
+        for handle in (cls.apply_handle, cls.persist_handle):
+            if handle is not None:
+                handle.cancel()
+        cls.apply_handle = cls.persist_handle = None
+        cls.apply_pending()
+        if not cls.dirty:
+            return
+        rows = [(indicator, int(cls.success[cls.index[indicator]]), int(cls.total[cls.index[indicator]]))
+                for indicator in sorted(cls.dirty)]
+        cls.dirty = set()
+        save_performance_rows(rows)
+
     @classmethod
     def update_weights(cls, signal_result):
-        """Адаптация весов на основе результата сигнала"""
+        """Ставит результат сигнала в очередь на адаптацию весов"""
+        if not signal_result['indicators']:
+            return False
+        cls.pending.append((signal_result['indicators'], bool(signal_result['profitable'])))
         try:
-            if not signal_result['indicators']:
-                return
-                
-            # Обновляем статистику
-            for indicator in signal_result['indicators']:
-                if indicator not in cls.performance_data:
-                    cls.performance_data[indicator] = {'success': 0, 'total': 0}
-                
-                cls.performance_data[indicator]['total'] += 1
-                if signal_result['profitable']:
-                    cls.performance_data[indicator]['success'] += 1
-            
-            # Адаптация весов
-            for indicator, data in cls.performance_data.items():
-                if data['total'] > 10:  # Минимум 10 сигналов для адаптации
-                    success_rate = data['success'] / data['total']
-                    current_weight = indicator_weights.get(indicator, 0)
-                    
-                    # Увеличиваем вес успешных индикаторов
-                    if success_rate > 0.6:
-                        new_weight = current_weight * (1 + cls.learning_rate)
-                    # Уменьшаем вес неуспешных
-                    elif success_rate < 0.4:
-                        new_weight = current_weight * (1 - cls.learning_rate)
-                    else:
-                        new_weight = current_weight
-                    
-                    # Ограничиваем диапазон весов
-                    new_weight = max(0.02, min(0.15, new_weight))
-                    indicator_weights[indicator] = new_weight
-            
-            cls.save_performance()
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (скрипты, бэктест) - сразу
+            cls.apply_pending()
             return True
+        if cls.apply_handle is None:
+            cls.apply_handle = loop.call_later(LEARNING_BATCH_DELAY, cls._apply_scheduled)
+        return True
+
+    @classmethod
+    def _apply_scheduled(cls):
+        cls.apply_handle = None
+        cls.apply_pending()
+        if cls.on_apply is not None:
+            cls.on_apply()
+        if cls.persist_handle is None and cls.dirty:
+            cls.persist_handle = asyncio.get_running_loop().call_later(LEARNING_PERSIST_DELAY, cls._persist_scheduled)
+
+    @classmethod
+    def _persist_scheduled(cls):
+        cls.persist_handle = None
+        cls.save_performance()
+
+    @classmethod
+    def apply_pending(cls):
+        """Пакетное обновление статистики и весов по накопленным результатам.
+
+        Счетчики после каждого результата получаются накопленной суммой по
+        матрице (результат x индикатор), шаги адаптации - проходом по ее
+        строкам сразу для всех индикаторов. Итог совпадает с поштучной
+        обработкой.
+        """
+        batch, cls.pending = cls.pending, []
+        if not batch:
+            return 0
+        try:
+            for indicators, _ in batch:
+                for indicator in indicators:
+                    cls._slot(indicator)
+                    cls.dirty.add(indicator)
+            totals = np.zeros((len(batch), len(cls.names)), dtype=np.int64)
+            successes = np.zeros_like(totals)
+            for row, (indicators, profitable) in enumerate(batch):
+                slots = [cls.index[indicator] for indicator in indicators]
+                np.add.at(totals[row], slots, 1)
+                if profitable:
+                    np.add.at(successes[row], slots, 1)
+            totals = cls.total + np.cumsum(totals, axis=0)
+            successes = cls.success + np.cumsum(successes, axis=0)
+            cls.total, cls.success = totals[-1].copy(), successes[-1].copy()
+
+            mature = totals > MIN_SIGNALS
+            rate = np.divide(successes, totals, out=np.zeros(totals.shape), where=mature)
+            factor = np.where(rate > 0.6, 1 + cls.learning_rate, np.where(rate < 0.4, 1 - cls.learning_rate, 1.0))
+            weights = np.array([indicator_weights.get(indicator, 0) for indicator in cls.names], dtype=np.float64)
+            for step in range(len(batch)):
+                weights = np.where(mature[step], np.clip(weights * factor[step], MIN_WEIGHT, MAX_WEIGHT), weights)
+            for slot in np.flatnonzero(mature[-1]):
+                indicator_weights[cls.names[slot]] = float(weights[slot])
+            return len(batch)
         except Exception as e:
             logger.error(f"Error updating weights: {e}")
-            return False
-    
+            return 0
+
     @classmethod
     def get_performance_report(cls):
         """Отчет о производительности индикаторов"""
         report = []
-        for indicator, data in cls.performance_data.items():
-            if data['total'] > 0:
-                success_rate = data['success'] / data['total']
+        for indicator, slot in cls.index.items():
+            if cls.total[slot] > 0:
                 report.append({
                     'indicator': indicator,
-                    'success_rate': success_rate,
+                    'success_rate': cls.success[slot] / cls.total[slot],
                     'weight': indicator_weights.get(indicator, 0)
                 })
         return sorted(report, key=lambda x: x['success_rate'], reverse=True)
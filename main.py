@@ -1,11 +1,14 @@
 import sys
 import os
+import asyncio
+import importlib
 import logging
-from fastapi import FastAPI, HTTPException
-import uvicorn
-from core import init_bot, stop_bot
-from telegram import send_telegram_message, send_demo_signal
-from globals import bot_status
+import time
+from fastapi import FastAPI, HTTPException, Response
+from globals import bot_status, SHARDS, PRELOAD_ANALYSIS, PRELOAD_DELAY
+from metrics import registry, loop_monitor, CONTENT_TYPE
+# core (pandas, numpy, aiohttp, websockets) загружается в фоне после старта сервера
+# или при первом /start, чтобы порт открывался сразу
 
 # Проверка критических переменных окружения
 REQUIRED_ENV_VARS = ['TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_ID']
@@ -28,6 +31,20 @@ if missing_vars:
         sys.exit(1)
 
 app = FastAPI(title="Crypto Trading Bot Pro", version="2.0")
+analysis_stack = None
+
+def load_analysis_stack():
+    """Задача импорта core в отдельном потоке; повторный вызов возвращает ту же задачу"""
+    global analysis_stack
+    if analysis_stack is None:
+        analysis_stack = asyncio.create_task(_import_core())
+    return analysis_stack
+
+async def _import_core():
+    started = time.perf_counter()
+    module = await asyncio.to_thread(importlib.import_module, 'core')
+    logger.info("Analysis stack loaded in %.2fs", time.perf_counter() - started)
+    return module
 
 @app.on_event("startup")
 async def startup_event():
@@ -44,6 +61,16 @@ async def startup_event():
         'unprofitable_signals': 0
     })
     logger.info("Bot status initialized")
+    loop_monitor.start()
+    if PRELOAD_ANALYSIS:
+        # Небольшая задержка: первые проверки здоровья не конкурируют с импортом за GIL
+        asyncio.get_running_loop().call_later(PRELOAD_DELAY, load_analysis_stack)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    loop_monitor.stop()
+    if 'telegram' in sys.modules:
+        await sys.modules['telegram'].telegram_client.close()
 
 @app.get("/")
 def home():
@@ -51,16 +78,26 @@ def home():
         "status": "Bot is ready",
         "running": bot_status.get('running', False),
         "signals_sent": bot_status.get('signals_sent', 0),
+        "analysis_loaded": analysis_stack is not None and analysis_stack.done(),
         "telegram_configured": bool(os.environ.get('TELEGRAM_BOT_TOKEN')) and bool(os.environ.get('TELEGRAM_CHAT_ID'))
     }
 
+registry.gauge('bot_status', "Counters from bot_status",
+               lambda: {key: value for key, value in bot_status.items() if isinstance(value, (int, float))})
+
+@app.get("/metrics")
+def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 @app.get("/start")
 async def start():
     if bot_status.get('running', False):
         return {"status": "already_running"}
     try:
         logger.info("Initiating bot startup...")
-        await init_bot()
+        core = await load_analysis_stack()
+        from telegram import send_telegram_message, send_demo_signal
+        await core.init_bot()
         logger.info("Bot initialized, sending Telegram messages...")
         success = await send_telegram_message("🟢 Подключение к Binance успешно! Анализ начат.")
         if not success:
@@ -83,7 +120,9 @@ async def stop():
     if not bot_status.get('running', False):
         return {"status": "already_stopped"}
     try:
-        await stop_bot()
+        core = await load_analysis_stack()
+        from telegram import send_telegram_message
+        await core.stop_bot()
         success = await send_telegram_message("🔴 Бот остановлен!")
         if not success:
             logger.warning("Failed to send stop Telegram message")
@@ -93,6 +132,45 @@ async def stop():
         logger.error("Error stopping bot: %s", str(e))
         raise HTTPException(status_code=500, detail=f"Failed to stop bot: {str(e)}")
 
+@app.get("/signals")
+async def signals(symbol: str = None, timeframe: str = None, signal_type: str = None, outcome: str = None,
+                  since: int = None, until: int = None, limit: int = 50, cursor: str = None):
+    """История сигналов; since/until - мс, outcome - profitable, unprofitable, pending или unknown"""
+    from database import query_signals
+    try:
+        items, next_cursor = await asyncio.to_thread(
+            query_signals, symbol, timeframe, signal_type, outcome, since, until, max(1, min(limit, 500)), cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"signals": items, "next_cursor": next_cursor}
+
+@app.get("/signals/stats")
+async def signal_stats(dimension: str = None):
+    """Доля прибыльных сигналов по паре, таймфрейму и индикатору из сводной таблицы"""
+    from database import load_signal_stats
+    return await asyncio.to_thread(load_signal_stats, dimension)
+
+@app.get("/shards")
+def shards():
+    if SHARDS <= 0:
+        raise HTTPException(status_code=404, detail="Sharding is disabled")
+    from sharding import shard_supervisor
+    return shard_supervisor.describe()
+
+@app.get("/shards/rebalance")
+async def rebalance_shards(strategy: str = None):
+    if SHARDS <= 0:
+        raise HTTPException(status_code=404, detail="Sharding is disabled")
+    if not bot_status.get('running', False):
+        raise HTTPException(status_code=409, detail="Bot is not running")
+    from sharding import shard_supervisor
+    try:
+        assignment = await shard_supervisor.rebalance(strategy=strategy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "rebalanced", "shards": assignment}
+
 if __name__ == "__main__":
+    import uvicorn
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False, access_log=False)
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'tradingbot_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм в секундах: от 50 мкс до 10 с
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+def _format_labels(names, values, *extra):
+    pairs = list(zip(names, values)) + [pair for pair in extra if pair is not None]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+class _Series:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами.
+
+    observe() - поиск корзины и два инкремента без блокировок: метрики
+    пишутся из цикла событий, потерю редкого инкремента из другого потока
+    допускаем ради дешевизны.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def _series(self, values):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = _Series(len(self.buckets) + 1)
+        return series
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values) or self._series(label_values)
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    def export(self):
+        return {values: (list(series.counts), series.sum) for values, series in self.series.items()}
+
+    def collect(self, exported=None, shard=None):
+        """exported/shard - данные рабочего процесса, выводятся с меткой shard"""
+        if exported is None:
+            exported = self.export()
+        shard_label = None if shard is None else ('shard', shard)
+        lines = []
+        for values, (counts, total) in sorted(exported.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, shard_label, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values, shard_label)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Gauge:
+    """Значение, которое считывается функцией в момент запроса /metrics"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.callback = callback
+
+    def export(self):
+        try:
+            return self.callback()
+        except Exception as e:
+            logger.error("Metric %s failed: %s", self.name, str(e))
+            return None
+
+    def collect(self, exported=None, shard=None):
+        value = self.export() if shard is None else exported
+        if value is None:
+            return []
+        shard_label = None if shard is None else ('shard', shard)
+        if isinstance(value, dict):
+            return [f"{self.name}{_format_labels(('key',), (key,), shard_label)} {_format_value(item)}"
+                    for key, item in sorted(value.items())]
+        return [f"{self.name}{_format_labels((), (), shard_label)} {_format_value(value)}"]
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        # Последние выгрузки рабочих процессов: {shard: export()}
+        self.remote = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram(name, documentation, buckets, labels))
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def export(self):
+        """Значения всех метрик для передачи супервизору"""
+        return {name: metric.export() for name, metric in self.metrics.items()}
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+            for shard, exported in sorted(self.remote.items()):
+                if exported.get(metric.name) is not None:
+                    lines.extend(metric.collect(exported[metric.name], shard))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+KLINE_PROCESS_SECONDS = registry.histogram(
+    'kline_process_seconds', "Time to store one kline message")
+INDICATOR_SECONDS = registry.histogram(
+    'indicator_compute_seconds', "Indicator computation per stream", labels=('timeframe',))
+ANALYZER_SWEEP_SECONDS = registry.histogram(
+    'analyzer_sweep_seconds', "Analyzer pass over a batch of changed streams")
+ANALYZER_SWEEP_STREAMS = registry.histogram(
+    'analyzer_sweep_streams', "Streams scored per analyzer pass", buckets=SIZE_BUCKETS)
+EVENT_LOOP_LAG_SECONDS = registry.histogram(
+    'event_loop_lag_seconds', "Delay of a timer callback behind schedule")
+DB_WRITE_SECONDS = registry.histogram(
+    'db_write_seconds', "SQLite batch transaction time")
+DB_WRITE_BATCH_SIZE = registry.histogram(
+    'db_write_batch_size', "Operations per SQLite transaction", buckets=SIZE_BUCKETS)
+TELEGRAM_SEND_SECONDS = registry.histogram(
+    'telegram_send_seconds', "Telegram delivery time including retries")
+
+class LoopLagMonitor:
+    """Замер задержки цикла событий: насколько позже срока просыпается таймер"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.task = None
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+loop_monitor = LoopLagMonitor()
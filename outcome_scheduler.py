@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import logging
+import time
+import numpy as np
+from globals import market_data, bot_status, TIMEFRAME_MS
+from database import schedule_signal_outcome, update_signal_result, load_pending_outcomes
+from learning import LearningSystem
+from archive import candle_archive
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Через сколько часов оценивается результат сигнала
+OUTCOME_HORIZON_HOURS = {'1d': 24}
+DEFAULT_HORIZON_HOURS = 4
+# Повторная попытка, если свеча на момент горизонта еще не закрыта
+OUTCOME_RETRY_SECONDS = 60
+# Сколько горизонтов ждать данных по паре (пара исключена из торговли или ушла
+# в другой шард), после чего результат записывается как неопределенный
+OUTCOME_EXPIRE_HORIZONS = 3
+# Порог изменения цены для прибыльного сигнала
+PROFIT_THRESHOLD = 0.01
+
+def horizon_ms(timeframe):
+    return OUTCOME_HORIZON_HOURS.get(timeframe, DEFAULT_HORIZON_HOURS) * 3_600_000
+
+def price_at(symbol, moment):
+    """Цена закрытия последней закрытой свечи, закончившейся не позже moment.
+
+    Ищется в самом мелком таймфрейме, где такая свеча есть, затем в архиве.
+    None - свеча еще не закрыта (данные придут позже); KeyError - данных
+    за этот момент нет.
+    """
+    stores = market_data.get(symbol, {})
+    if not any(len(store) for store in stores.values()):
+        # Данные по паре еще не поступили
+        return None
+    # reached - буфер дошел до нужной свечи, но ее там нет; pending - свеча еще придет
+    reached = pending = False
+    for timeframe in sorted(stores, key=lambda tf: TIMEFRAME_MS.get(tf, 0)):
+        frame_ms = TIMEFRAME_MS.get(timeframe)
+        store = stores[timeframe]
+        if not frame_ms or not len(store):
+            continue
+        target = moment - moment % frame_ms - frame_ms
+        timestamps = store.column('timestamp')
+        if timestamps[-1] < target:
+            # Этот таймфрейм отстает (например, еще не собран агрегатором)
+            pending = True
+            continue
+        index = int(np.searchsorted(timestamps, target))
+        if timestamps[index] == target:
+            if index == len(timestamps) - 1 and not store.last_closed:
+                pending = True
+                continue
+            return float(store.column('close')[index])
+        reached = True
+        # Свеча вытеснена из буфера или пропущена - пробуем более крупный таймфрейм
+    if not reached:
+        # Ни один таймфрейм еще не дошел до момента оценки
+        return None
+    # Вытесненные из буферов свечи ищутся в архиве на диске
+    for timeframe in sorted(stores, key=lambda tf: TIMEFRAME_MS.get(tf, 0)):
+        frame_ms = TIMEFRAME_MS.get(timeframe)
+        if frame_ms:
+            price = candle_archive.close_at(symbol, timeframe, moment - moment % frame_ms - frame_ms)
+            if price is not None:
+                return price
+    if pending:
+        # Отстающий таймфрейм еще может догнать; срок ожидания ограничен OUTCOME_EXPIRE_HORIZONS
+        return None
+    raise KeyError(f"no candle for {symbol} at {moment}")
+
+class OutcomeScheduler:
+    """Оценка результатов сигналов по расписанию.
+
+    Сроки хранятся в таблице signals, в памяти - одна куча и один таймер
+    вместо спящей задачи на каждый сигнал. При запуске незавершенные оценки
+    подгружаются из базы.
+    """
+
+    def __init__(self):
+        self.heap = []  # (due_at, signal_id)
+        self.signals = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        # Куда уходит результат для обучения (в шардированном режиме - супервизору)
+        self.learner = None
+
+    def schedule(self, signal_data, entry_price, entry_time):
+        due_at = int(time.time() * 1000) + horizon_ms(signal_data['timeframe'])
+        schedule_signal_outcome(signal_data['id'], entry_price, entry_time, due_at)
+        self._push({
+            'id': signal_data['id'],
+            'symbol': signal_data['symbol'],
+            'timeframe': signal_data['timeframe'],
+            'signal_type': signal_data['signal_type'],
+            'indicators': signal_data['indicators'],
+            'entry_price': entry_price,
+            'entry_time': entry_time,
+            'due_at': due_at
+        })
+
+    def _push(self, signal):
+        self.signals[signal['id']] = signal
+        heapq.heappush(self.heap, (signal['due_at'], signal['id']))
+        self.wakeup.set()
+
+    async def load(self, symbols=None):
+        """Подгружает из базы незавершенные оценки по парам symbols (None - все)"""
+        pending = await asyncio.to_thread(load_pending_outcomes, symbols)
+        for signal in pending:
+            if signal['id'] not in self.signals:
+                self._push(signal)
+        if pending:
+            logger.info("Resumed %d pending signal evaluations", len(pending))
+
+    async def start(self, symbols=None):
+        await self.load(symbols)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def forget(self, symbols):
+        """Снимает оценки по парам, которые обслуживает другой процесс (в базе они остаются)"""
+        symbols = set(symbols)
+        self.signals = {signal_id: signal for signal_id, signal in self.signals.items()
+                        if signal['symbol'] not in symbols}
+        self.heap = [item for item in self.heap if item[1] in self.signals]
+        heapq.heapify(self.heap)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        # Сроки сохранены в базе, при следующем запуске оценки продолжатся
+        self.heap = []
+        self.signals = {}
+
+    async def run(self):
+        while True:
+            try:
+                self.wakeup.clear()
+                if not self.heap:
+                    await self.wakeup.wait()
+                    continue
+                delay = self.heap[0][0] / 1000 - time.time()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                now = time.time() * 1000
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    _, signal_id = heapq.heappop(self.heap)
+                    signal = self.signals.pop(signal_id, None)
+                    if signal is not None:
+                        due.append(signal)
+                self.evaluate_batch(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Outcome scheduler error: %s", str(e))
+                await asyncio.sleep(10)
+
+    def evaluate_batch(self, signals):
+        for signal in signals:
+            try:
+                exit_price = price_at(signal['symbol'], signal['due_at'])
+            except KeyError as e:
+                logger.warning("Can't evaluate signal %s: %s", signal['id'], str(e))
+                update_signal_result(signal['id'], None)
+                continue
+            if exit_price is None:
+                signal['retries'] = signal.get('retries', 0) + 1
+                if signal['retries'] * OUTCOME_RETRY_SECONDS * 1000 >= \
+                        OUTCOME_EXPIRE_HORIZONS * horizon_ms(signal['timeframe']):
+                    logger.warning("No data to evaluate signal %s after %d retries, giving up",
+                                   signal['id'], signal['retries'])
+                    update_signal_result(signal['id'], None)
+                    continue
+                self.signals[signal['id']] = signal
+                heapq.heappush(self.heap, (int(time.time() * 1000) + OUTCOME_RETRY_SECONDS * 1000, signal['id']))
+                continue
+            self.resolve(signal, exit_price)
+
+    def resolve(self, signal, exit_price):
+        entry_price = signal['entry_price']
+        if not entry_price:
+            update_signal_result(signal['id'], None)
+            return
+        price_change = (exit_price - entry_price) / entry_price
+        profitable = (signal['signal_type'] == 'BUY' and price_change > PROFIT_THRESHOLD) or \
+                     (signal['signal_type'] == 'SELL' and price_change < -PROFIT_THRESHOLD)
+        update_signal_result(signal['id'], profitable, signal)
+
+        if profitable:
+            bot_status['profitable_signals'] = bot_status.get('profitable_signals', 0) + 1
+        else:
+            bot_status['unprofitable_signals'] = bot_status.get('unprofitable_signals', 0) + 1
+
+        (self.learner or LearningSystem.update_weights)({
+            'id': signal['id'],
+            'symbol': signal['symbol'],
+            'timeframe': signal['timeframe'],
+            'signal_type': signal['signal_type'],
+            'indicators': signal['indicators'],
+            'profitable': profitable
+        })
+
+outcome_scheduler = OutcomeScheduler()
+registry.gauge('pending_outcomes', "Sent signals waiting for outcome evaluation",
+               lambda: len(outcome_scheduler.signals))
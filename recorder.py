@@ -0,0 +1,80 @@
+import glob
+import gzip
+import logging
+import os
+import time
+from globals import RECORDINGS_DIR, RECORD_SEGMENT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = 'klines-*.tsv.gz'
+
+class KlineRecorder:
+    """Запись сырых сообщений kline-потоков в сжатые сегменты.
+
+    Строка сегмента: время получения (мс) и исходное сообщение через
+    табуляцию. Новый сегмент начинается каждые segment_seconds, поэтому
+    оборванная запись теряет только хвост последнего файла.
+    """
+
+    def __init__(self, directory=RECORDINGS_DIR, segment_seconds=RECORD_SEGMENT_SECONDS):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.file = None
+        self.path = None
+        self.opened_at = 0.0
+        self.messages = 0
+
+    def _open_segment(self, now):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = time.strftime('klines-%Y%m%d-%H%M%S', time.gmtime(now)) + f"-{int(now * 1000) % 1000:03d}.tsv.gz"
+        self.path = os.path.join(self.directory, name)
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8', compresslevel=6)
+        self.opened_at = now
+        logger.info("Recording klines to %s", self.path)
+
+    def record(self, message, received=None):
+        now = time.time() if received is None else received
+        try:
+            if self.file is None or now - self.opened_at >= self.segment_seconds:
+                self._open_segment(now)
+            if isinstance(message, bytes):
+                message = message.decode('utf-8')
+            # Переводы строк в JSON допустимы только как пробелы, сообщение остается валидным
+            self.file.write(f"{int(now * 1000)}\t{message.replace(chr(10), ' ')}\n")
+            self.messages += 1
+        except Exception as e:
+            logger.error("Kline recorder error: %s", str(e))
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception as e:
+                logger.error("Error closing segment %s: %s", self.path, str(e))
+            self.file = None
+
+def segment_paths(paths):
+    """Файлы сегментов по списку файлов/каталогов, в порядке записи"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(glob.glob(os.path.join(path, SEGMENT_PATTERN)))
+        else:
+            found.append(path)
+    return sorted(found, key=os.path.basename)
+
+def read_segments(paths):
+    """Генератор (время получения в мс, сообщение) по сегментам"""
+    for path in segment_paths(paths):
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    received, sep, message = line.rstrip('\n').partition('\t')
+                    if sep and received.isdigit():
+                        yield int(received), message
+        except (EOFError, OSError) as e:
+            # Сегмент не был закрыт (остановка процесса) - читаем, сколько успели записать
+            logger.warning("Segment %s is truncated: %s", path, str(e))
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import numpy as np
+from globals import indicator_weights, REFIT_INTERVAL, REFIT_MIN_SIGNALS, REFIT_REGULARIZATION
+from database import load_training_signals, save_weights, db_writer
+from scoring import SCORING_COLUMNS, FEATURE_DTYPE, decode_features, signal_matrix
+from learning import LearningSystem, MIN_SIGNALS, MIN_WEIGHT, MAX_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+MAX_ITERATIONS = 25
+TOLERANCE = 1e-8
+
+def training_set(rows):
+    """(имена индикаторов, согласие индикатора с направлением сигнала -1/0/1, метки 0/1) или None"""
+    size = len(SCORING_COLUMNS) * FEATURE_DTYPE.itemsize
+    # Признаки другой длины записаны при другом наборе SCORING_COLUMNS
+    rows = [row for row in rows if row[1] is not None and len(row[1]) == size]
+    if not rows:
+        return None
+    features = decode_features([row[1] for row in rows])
+    names, matrix = signal_matrix({name: features[:, i] for i, name in enumerate(SCORING_COLUMNS)})
+    direction = np.array([1.0 if row[0] == 'BUY' else -1.0 for row in rows])
+    labels = np.array([float(row[2]) for row in rows])
+    return names, matrix * direction[:, None], labels
+
+def fit_logistic(X, y, regularization=REFIT_REGULARIZATION, iterations=MAX_ITERATIONS):
+    """Логистическая регрессия методом Ньютона (IRLS) с L2-регуляризацией; beta[0] - свободный член"""
+    A = np.column_stack([np.ones(len(X)), X])
+    penalty = np.full(A.shape[1], float(regularization))
+    penalty[0] = 0.0
+    beta = np.zeros(A.shape[1])
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-np.clip(A @ beta, -30, 30)))
+        gradient = A.T @ (p - y) + penalty * beta
+        hessian = (A * (p * (1 - p))[:, None]).T @ A + np.diag(penalty)
+        step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+        beta -= step
+        if np.max(np.abs(step)) < TOLERANCE:
+            break
+    return beta
+
+def refit_weights(rows, weights, min_signals=REFIT_MIN_SIGNALS, regularization=REFIT_REGULARIZATION):
+    """(новые веса, статистика) по оцененным сигналам; None, если данных мало.
+
+    Вес индикатора пропорционален положительной части его коэффициента;
+    сумма весов переобученных индикаторов сохраняется, чтобы сила сигнала
+    оставалась сравнимой с SIGNAL_THRESHOLD. Индикаторы, которые были
+    активны реже MIN_SIGNALS раз или отсутствуют в weights, не меняются.
+    """
+    data = training_set(rows)
+    if data is None or len(data[2]) < min_signals:
+        return None
+    names, X, y = data
+    beta = fit_logistic(X, y, regularization)
+    coefficients = beta[1:]
+    fitted = [i for i, name in enumerate(names)
+              if name in weights and np.count_nonzero(X[:, i]) >= MIN_SIGNALS]
+    positive = np.maximum(coefficients[fitted], 0.0)
+    if not fitted or positive.sum() <= 0:
+        return None
+    budget = sum(weights[names[i]] for i in fitted)
+    scaled = np.clip(positive * budget / positive.sum(), MIN_WEIGHT, MAX_WEIGHT)
+
+    p = 1.0 / (1.0 + np.exp(-np.clip(beta[0] + X @ coefficients, -30, 30)))
+    eps = 1e-12
+    stats = {
+        'signals': len(y),
+        'base_rate': float(y.mean()),
+        'log_loss': float(-np.mean(y * np.log(p + eps) + (1 - y) * np.log(1 - p + eps))),
+        'accuracy': float(np.mean((p > 0.5) == (y > 0.5))),
+        'coefficients': {name: float(value) for name, value in zip(names, coefficients)}
+    }
+    return {names[i]: float(weight) for i, weight in zip(fitted, scaled)}, stats
+
+class WeightRefit:
+    """Периодическое переобучение весов по всей истории оцененных сигналов"""
+
+    def __init__(self, interval=REFIT_INTERVAL):
+        self.interval = interval
+        self.task = None
+        self.last_stats = None
+
+    async def refit(self):
+        started = time.perf_counter()
+        rows = await asyncio.to_thread(load_training_signals)
+        result = await asyncio.to_thread(refit_weights, rows, dict(indicator_weights))
+        if result is None:
+            logger.info("Weight refit skipped: %d resolved signals with features", len(rows))
+            return None
+        weights, stats = result
+        # Подмена одним update в цикле событий: анализатор видит либо старые, либо новые веса
+        indicator_weights.update(weights)
+        save_weights(indicator_weights)
+        if LearningSystem.on_apply is not None:
+            LearningSystem.on_apply()
+        self.last_stats = stats
+        logger.info("Weights refit on %d signals in %.2fs: log loss %.4f, accuracy %.3f",
+                    stats['signals'], time.perf_counter() - started, stats['log_loss'], stats['accuracy'])
+        return weights
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refit()
+            except Exception as e:
+                logger.error("Weight refit error: %s", str(e))
+
+    def start(self):
+        if self.interval > 0 and (self.task is None or self.task.done()):
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+weight_refit = WeightRefit()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refit indicator weights on resolved signals")
+    parser.add_argument('--apply', action='store_true',
+                        help="Save the new weights to the database (a running bot overwrites them on stop)")
+    parser.add_argument('--min-signals', type=int, default=REFIT_MIN_SIGNALS)
+    parser.add_argument('--regularization', type=float, default=REFIT_REGULARIZATION)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from database import load_weights
+    indicator_weights.update(load_weights())
+    started = time.perf_counter()
+    rows = load_training_signals()
+    result = refit_weights(rows, dict(indicator_weights), args.min_signals, args.regularization)
+    if result is None:
+        logger.error("Not enough resolved signals with features: %d", len(rows))
+        return 1
+    weights, stats = result
+    stats['elapsed'] = time.perf_counter() - started
+    stats['weights'] = {name: {'old': indicator_weights[name], 'new': weight} for name, weight in weights.items()}
+    if args.apply:
+        indicator_weights.update(weights)
+        save_weights(indicator_weights)
+        db_writer.stop()
+    json.dump(stats, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
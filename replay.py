@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from globals import AGGREGATE_TIMEFRAMES, RECORDINGS_DIR, bot_status
+from recorder import read_segments
+import websocket
+
+logger = logging.getLogger(__name__)
+
+class KlineReplay:
+    """Подача записанных сообщений обратно в обработчик потоков.
+
+    speed=1 - в реальном времени, N - в N раз быстрее, None - без пауз.
+    Без пауз после каждого сообщения управление отдается циклу событий,
+    чтобы анализатор видел те же очереди событий, что и при живом потоке.
+    """
+
+    def __init__(self, paths, speed=1.0, handler=None, aggregate=AGGREGATE_TIMEFRAMES):
+        self.paths = paths
+        self.speed = speed
+        self.handler = handler
+        self.aggregate = aggregate
+        self.messages = 0
+
+    async def dispatch(self, message):
+        data = json.loads(message)
+        kline = data.get('data', {}).get('k')
+        if not kline:
+            return
+        await self.handler(kline['s'], kline['i'], kline)
+        self.messages += 1
+
+    async def run(self):
+        if self.handler is None:
+            websocket.init_candle_aggregator(self.aggregate)
+            self.handler = websocket.handle_kline
+        started = time.perf_counter()
+        first = None
+        for received, message in read_segments(self.paths):
+            if self.speed:
+                if first is None:
+                    first = received
+                delay = started + (received - first) / 1000 / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                await self.dispatch(message)
+            except Exception as e:
+                logger.error("Replay error: %s", str(e))
+            if not self.speed:
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+        return {
+            'messages': self.messages,
+            'elapsed': elapsed,
+            'messages_per_sec': self.messages / elapsed if elapsed > 0 else 0.0
+        }
+
+async def replay(paths, speed, analyze=False, db_path=None, telegram=False):
+    """Прогон записи; с analyze - через анализатор.
+
+    Сигналы собираются в список вместо Telegram (telegram=True - отправлять),
+    запись идет во временную базу или в db_path, рабочая база не трогается.
+    """
+    analyzer = None
+    sent = []
+    if analyze:
+        import database
+        from signal_analyzer import start_analysis, stop_analysis
+        temp_dir = None if db_path else tempfile.mkdtemp(prefix='replay-db-')
+        previous_db = database.use_database(db_path or os.path.join(temp_dir, 'replay.db'))
+        database.init_database()
+
+        async def collect(*signal):
+            sent.append(signal)
+            return True
+
+        bot_status['running'] = True
+        analyzer = start_analysis(sink=None if telegram else collect)
+    try:
+        stats = await KlineReplay(paths, speed).run()
+        if analyzer is not None:
+            # Даем анализатору разобрать хвост очереди событий
+            await asyncio.sleep(0.1)
+            stats['pending_signals'] = len(analyzer.pending_signals)
+            stats['signals_sent'] = len(sent)
+    finally:
+        if analyzer is not None:
+            bot_status['running'] = False
+            stop_analysis()
+            if telegram:
+                from telegram import telegram_client
+                await telegram_client.close()
+            database.use_database(previous_db)
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+    stats['data_received'] = bot_status.get('data_received', 0)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded kline segments")
+    parser.add_argument('paths', nargs='*', default=[RECORDINGS_DIR], help="Segment files or directories")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument('--fast', action='store_true', help="Replay as fast as possible")
+    parser.add_argument('--analyze', action='store_true', help="Run the signal analyzer on replayed data")
+    parser.add_argument('--archive', action='store_true', help="Append replayed candles to the candle archive")
+    parser.add_argument('--telegram', action='store_true', help="Actually send signals to Telegram")
+    parser.add_argument('--db', help="Keep signals in this SQLite file (default: a temporary database)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.archive:
+        from archive import candle_archive
+        candle_archive.enabled = False
+    stats = asyncio.run(replay(args.paths, None if args.fast else args.speed, args.analyze, args.db, args.telegram))
+    json.dump(stats, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import numpy as np
+from globals import indicator_weights
+
+# Колонки индикаторов, по которым считаются сигналы
+SCORING_COLUMNS = [
+    'close', 'EMA_12', 'EMA_26', 'SMA_20', 'MACD', 'MACD_signal', 'Supertrend', 'ADX',
+    'RSI', 'Stoch_k', 'Stoch_d', 'Williams', 'CCI', 'BB_upper', 'BB_lower', 'KC_upper', 'KC_lower',
+    'Volume_Osc', 'OBV_trend', 'Bullish_Engulfing', 'Bearish_Engulfing', 'Hammer', 'Pin_Bar_bull', 'Pin_Bar_bear'
+]
+
+# Вектор признаков сигнала в базе: значения SCORING_COLUMNS в float32
+FEATURE_DTYPE = np.dtype('<f4')
+
+def encode_features(vector):
+    return np.asarray(vector, dtype=FEATURE_DTYPE).tobytes()
+
+def decode_features(blobs, columns=SCORING_COLUMNS):
+    """Матрица (сигнал x колонка) из списка BLOB; все BLOB должны быть одной длины"""
+    return np.frombuffer(b''.join(blobs), dtype=FEATURE_DTYPE).reshape(-1, len(columns)).astype(np.float64)
+
+def signal_matrix(ind):
+    """Голоса индикаторов за направление по пороговым правилам.
+
+    ind - словарь/DataFrame колонок индикаторов (строки - бары или потоки).
+    Возвращает (имена, матрица строк x индикаторов со значениями -1/0/1).
+    """
+    def col(name):
+        return np.asarray(ind[name], dtype=float)
+
+    def sign(condition_up, condition_down=None):
+        if condition_down is None:
+            return np.where(condition_up, 1.0, -1.0)
+        return np.where(condition_up, 1.0, np.where(condition_down, -1.0, 0.0))
+
+    close = col('close')
+    rsi, stoch_k, stoch_d = col('RSI'), col('Stoch_k'), col('Stoch_d')
+    williams, cci = col('Williams'), col('CCI')
+    signals = {
+        'EMA': sign(col('EMA_12') > col('EMA_26')),
+        'SMA': sign(close > col('SMA_20')),
+        'MACD': sign(col('MACD') > col('MACD_signal')),
+        'Supertrend': sign(col('Supertrend') > 0),
+        'ADX': np.where(col('ADX') > 20, 1.0, 0.0),
+        'RSI': np.where(rsi > 65, -1.0, np.where(rsi < 35, 1.0, 0.0)),
+        'Stochastic': sign((stoch_k < 25) & (stoch_d < 25), (stoch_k > 75) & (stoch_d > 75)),
+        'Williams': sign(williams < -75, williams > -25),
+        'CCI': sign(cci < -90, cci > 90),
+        'Bollinger_Bands': np.where(close > col('BB_upper'), -1.0, np.where(close < col('BB_lower'), 1.0, 0.0)),
+        'Keltner_Channel': np.where(close > col('KC_upper'), -1.0, np.where(close < col('KC_lower'), 1.0, 0.0)),
+        'Volume_Oscillator': sign(col('Volume_Osc') > 0),
+        'OBV': sign(col('OBV_trend') > 0),
+        'Engulfing': sign(np.asarray(ind['Bullish_Engulfing'], dtype=bool), np.asarray(ind['Bearish_Engulfing'], dtype=bool)),
+        'Hammer': np.where(np.asarray(ind['Hammer'], dtype=bool), 1.0, 0.0),
+        'Pin_Bar': sign(np.asarray(ind['Pin_Bar_bull'], dtype=bool), np.asarray(ind['Pin_Bar_bear'], dtype=bool)),
+    }
+    names = list(signals)
+    return names, np.column_stack([signals[name] for name in names])
+
+def signal_strength(names, matrix, weights):
+    """Сила (средневзвешенный голос ненулевых индикаторов из weights) и маска активных индикаторов"""
+    w = np.array([weights.get(name, 0.0) for name in names])
+    known = np.array([name in weights for name in names])
+    active = (matrix != 0) & known
+    total_weight = active @ w
+    strength = np.divide((matrix * active) @ w, total_weight,
+                         out=np.zeros(len(matrix)), where=total_weight > 0)
+    return strength, active
+
+class FeatureMatrix:
+    """Последние значения индикаторов всех потоков в одной матрице (поток x колонка)"""
+
+    def __init__(self, columns=SCORING_COLUMNS, capacity=64):
+        self.columns = list(columns)
+        self.column_index = {name: i for i, name in enumerate(self.columns)}
+        self.values = np.full((capacity, len(self.columns)), np.nan)
+        self.rows = {}
+
+    def row(self, key):
+        if key not in self.rows:
+            if len(self.rows) == len(self.values):
+                grown = np.full((2 * len(self.values), len(self.columns)), np.nan)
+                grown[:len(self.values)] = self.values
+                self.values = grown
+            self.rows[key] = len(self.rows)
+        return self.rows[key]
+
+    def set(self, key, latest):
+        row = self.row(key)
+        values = self.values[row]
+        for i, name in enumerate(self.columns):
+            values[i] = latest[name]
+
+    def view(self, rows):
+        block = self.values[rows]
+        return {name: block[:, i] for i, name in enumerate(self.columns)}
+
+class SignalScorer:
+    """Оценка сигналов сразу по всем изменившимся потокам одним матричным проходом"""
+
+    def __init__(self):
+        self.features = FeatureMatrix()
+
+    def update(self, key, latest):
+        self.features.set(key, latest)
+
+    def vector(self, key):
+        """Копия значений SCORING_COLUMNS потока"""
+        return self.features.values[self.features.rows[key]].copy()
+
+    def score(self, keys, weights=None):
+        """Возвращает (имена индикаторов, сила по потокам, маска активных индикаторов)"""
+        rows = np.array([self.features.rows[key] for key in keys], dtype=np.intp)
+        names, matrix = signal_matrix(self.features.view(rows))
+        strength, active = signal_strength(names, matrix, indicator_weights if weights is None else weights)
+        return names, strength, active
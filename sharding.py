@@ -0,0 +1,410 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from globals import (TRADING_PAIRS, SHARDS, SHARD_STRATEGY, SHARD_MAP, SHARD_REPORT_INTERVAL, bot_status,
+                     indicator_weights, market_data)
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать завершения рабочих процессов при остановке, секунды
+WORKER_STOP_TIMEOUT = 30
+MONITOR_INTERVAL = 5
+# Суммируются по шардам в bot_status супервизора
+SHARD_COUNTERS = ('connections', 'data_received')
+
+def assign_shards(pairs, shards, strategy=SHARD_STRATEGY, overrides=SHARD_MAP):
+    """{shard: [пары]}; закрепленные в overrides пары идут в свой шард"""
+    if strategy not in ('round_robin', 'hash'):
+        raise ValueError(f"Unknown shard strategy: {strategy}")
+    assignment = {shard: [] for shard in range(shards)}
+    for pair in pairs:
+        if pair in overrides:
+            assignment[overrides[pair] % shards].append(pair)
+    for pair in pairs:
+        if pair in overrides:
+            continue
+        if strategy == 'hash':
+            shard = zlib.crc32(pair.encode()) % shards
+        else:
+            shard = min(assignment, key=lambda s: len(assignment[s]))
+        assignment[shard].append(pair)
+    return assignment
+
+def shard_path(path, shard):
+    root, extension = os.path.splitext(path)
+    return f"{root}-shard{shard}{extension}"
+
+class ShardWorker:
+    """Рабочий процесс: прием данных, анализ и оценка результатов для своей части пар.
+
+    Сигналы, результаты для обучения и метрики уходят супервизору по pipe,
+    обратно приходят веса индикаторов, новый список пар и команда остановки.
+    """
+
+    def __init__(self, shard, pairs, weights, conn):
+        self.shard = shard
+        self.pairs = list(pairs)
+        self.weights = weights
+        self.conn = conn
+        self.stopping = None
+        # Ожидающие сигналы, переданные другим шардом до загрузки истории их пар
+        self.adopted = {}
+
+    def send(self, kind, payload=None):
+        try:
+            self.conn.send((kind, payload))
+        except (BrokenPipeError, OSError) as e:
+            logger.error("Shard %s can't reach supervisor: %s", self.shard, str(e))
+            self.stopping.set()
+
+    async def sink(self, symbol, timeframe, signal_type, strength, accuracy, indicators, signal_id):
+        self.send('signal', {'symbol': symbol, 'timeframe': timeframe, 'signal_type': signal_type,
+                             'strength': strength, 'accuracy': accuracy, 'indicators': indicators,
+                             'signal_id': signal_id})
+        return True
+
+    def learner(self, result):
+        self.send('outcome', result)
+        return True
+
+    def on_message(self):
+        try:
+            while self.conn.poll():
+                kind, payload = self.conn.recv()
+                if kind == 'weights':
+                    indicator_weights.update(payload)
+                elif kind == 'pairs':
+                    asyncio.create_task(self.reassign(payload))
+                elif kind == 'pending':
+                    self.adopt(payload)
+                elif kind == 'stop':
+                    self.stopping.set()
+        except (EOFError, OSError):
+            # Супервизор завершился
+            self.stopping.set()
+
+    def adopt(self, signals):
+        """Ожидающие сигналы пар, перешедших из другого шарда"""
+        import websocket
+        import signal_analyzer
+        analyzer = signal_analyzer.analyzer
+        for signal in signals:
+            symbol = signal['symbol']
+            if symbol not in TRADING_PAIRS:
+                logger.warning("Shard %s got pending signal %s for foreign pair %s, dropping",
+                               self.shard, signal['id'], symbol)
+            elif analyzer is None or symbol in websocket.stream_gate.held:
+                # История пары еще грузится, сигнал подождет reassign()
+                self.adopted[signal['id']] = signal
+            else:
+                analyzer.pending_signals[signal['id']] = signal
+        logger.info("Shard %s adopted %d pending signals", self.shard, len(signals))
+
+    def release_adopted(self, symbols):
+        import signal_analyzer
+        analyzer = signal_analyzer.analyzer
+        ready = {signal_id: signal for signal_id, signal in self.adopted.items() if signal['symbol'] in symbols}
+        for signal_id in ready:
+            self.adopted.pop(signal_id)
+        if analyzer:
+            analyzer.pending_signals.update(ready)
+
+    def hand_over(self, symbols):
+        """Отдает супервизору неподтвержденные сигналы ушедших пар для их нового шарда"""
+        import signal_analyzer
+        analyzer = signal_analyzer.analyzer
+        signals = [signal for signal in analyzer.pending_signals.values()
+                   if signal['symbol'] in symbols] if analyzer else []
+        signals += [signal for signal in self.adopted.values() if signal['symbol'] in symbols]
+        for signal in signals:
+            if analyzer:
+                analyzer.pending_signals.pop(signal['id'], None)
+            self.adopted.pop(signal['id'], None)
+        if signals:
+            logger.info("Shard %s hands %d pending signals over: %s", self.shard, len(signals),
+                        ', '.join(sorted({signal['symbol'] for signal in signals})))
+            self.send('pending', signals)
+
+    async def reassign(self, pairs):
+        import websocket
+        import signal_analyzer
+        from backfill import KlineBackfill
+        from indicator_cache import indicator_cache
+        from cooldown import signal_cooldown
+        from outcome_scheduler import outcome_scheduler
+        added = [pair for pair in pairs if pair not in TRADING_PAIRS]
+        removed = [pair for pair in TRADING_PAIRS if pair not in pairs]
+        TRADING_PAIRS[:] = pairs
+        timeframes = websocket.upstream_timeframes()
+        # Сразу, пока новый шард догружает историю этих пар
+        self.hand_over(removed)
+        try:
+            if removed:
+                if websocket.stream_manager:
+                    await websocket.stream_manager.unsubscribe([(s, tf) for s in removed for tf in timeframes])
+                outcome_scheduler.forget(removed)
+                signal_cooldown.forget(removed)
+                analyzer = signal_analyzer.analyzer
+                for symbol in removed:
+                    for timeframe in market_data.pop(symbol, {}):
+                        indicator_cache.invalidate(symbol, timeframe)
+                        if analyzer:
+                            analyzer.engine.drop(symbol, timeframe)
+            if added:
+                # Как при запуске: подписка до догрузки истории, сообщения ждут ее окончания
+                websocket.stream_gate.hold(added)
+                if websocket.stream_manager:
+                    await websocket.stream_manager.subscribe([(s, tf) for s in added for tf in timeframes])
+                    await websocket.stream_manager.wait_connected()
+                try:
+                    await KlineBackfill().run(pairs=added, aggregator=websocket.candle_aggregator)
+                    await outcome_scheduler.load(added)
+                finally:
+                    await websocket.stream_gate.release(added)
+                    self.release_adopted(added)
+            logger.info("Shard %s pairs: +%s -%s", self.shard, added, removed)
+        except Exception as e:
+            logger.error("Shard %s reassign error: %s", self.shard, str(e))
+        self.report()
+
+    def report(self):
+        self.send('metrics', {
+            'export': registry.export(),
+            'status': {key: bot_status.get(key, 0) for key in SHARD_COUNTERS},
+            'pairs': list(TRADING_PAIRS)
+        })
+
+    async def reporter(self):
+        while True:
+            await asyncio.sleep(SHARD_REPORT_INTERVAL)
+            self.report()
+
+    async def run(self):
+        from core import start_pipeline, stop_pipeline
+        from compute import compute_executor
+        from outcome_scheduler import outcome_scheduler
+        from snapshot import snapshot_manager
+        self.stopping = asyncio.Event()
+        TRADING_PAIRS[:] = self.pairs
+        # Шард уже отдельный процесс: свой пул процессов на каждый шард не нужен
+        if compute_executor.mode == 'process':
+            compute_executor.mode = 'thread'
+        snapshot_manager.path = shard_path(snapshot_manager.path, self.shard)
+        outcome_scheduler.learner = self.learner
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.conn.fileno(), self.on_message)
+
+        bot_status['running'] = True
+        await start_pipeline(self.sink)
+        # Веса ведет супервизор
+        indicator_weights.update(self.weights)
+        reporter = asyncio.create_task(self.reporter())
+        self.send('ready', {'pid': os.getpid(), 'pairs': self.pairs})
+        logger.info("Shard %s started with %d pairs", self.shard, len(self.pairs))
+
+        await self.stopping.wait()
+        reporter.cancel()
+        bot_status['running'] = False
+        loop.remove_reader(self.conn.fileno())
+        await stop_pipeline(persist_learning=False)
+        self.report()
+        logger.info("Shard %s stopped", self.shard)
+
+def worker_main(shard, pairs, weights, conn):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - shard{shard} - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    try:
+        asyncio.run(ShardWorker(shard, pairs, weights, conn).run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+class ShardSupervisor:
+    """Запускает рабочие процессы по шардам и принимает от них сигналы и метрики.
+
+    Telegram, обучение весов и HTTP API остаются в процессе супервизора.
+    Упавший процесс перезапускается с тем же набором пар.
+    """
+
+    def __init__(self, shards=SHARDS, strategy=SHARD_STRATEGY, overrides=SHARD_MAP):
+        self.shards = shards
+        self.strategy = strategy
+        self.overrides = overrides
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = {}
+        self.status = {}
+        self.monitor_task = None
+        self.running = False
+
+    def _spawn(self, shard, pairs):
+        parent, child = self.context.Pipe()
+        # Не daemon: у рабочего процесса может быть свой пул вычислений
+        process = self.context.Process(target=worker_main, name=f"shard-{shard}",
+                                       args=(shard, pairs, dict(indicator_weights), child))
+        process.start()
+        child.close()
+        asyncio.get_running_loop().add_reader(parent.fileno(), self._on_readable, shard)
+        previous = self.workers.get(shard, {})
+        self.workers[shard] = {'process': process, 'conn': parent, 'pairs': list(pairs),
+                               'restarts': previous.get('restarts', 0), 'started': time.time()}
+        logger.info("Shard %s started (pid %s): %s", shard, process.pid, ', '.join(pairs))
+
+    def _close(self, shard):
+        worker = self.workers[shard]
+        conn = worker['conn']
+        if not conn.closed:
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+            conn.close()
+
+    def _on_readable(self, shard):
+        conn = self.workers[shard]['conn']
+        try:
+            while conn.poll():
+                kind, payload = conn.recv()
+                self.handle(shard, kind, payload)
+        except (EOFError, OSError):
+            # Процесс завершился, перезапуск - в monitor()
+            self._close(shard)
+
+    def handle(self, shard, kind, payload):
+        if kind == 'signal':
+            from telegram import send_signal
+            asyncio.create_task(send_signal(**payload))
+        elif kind == 'outcome':
+            from learning import LearningSystem
+            key = 'profitable_signals' if payload['profitable'] else 'unprofitable_signals'
+            bot_status[key] = bot_status.get(key, 0) + 1
+            # Веса рассылаются после применения пакета (LearningSystem.on_apply)
+            LearningSystem.update_weights(payload)
+        elif kind == 'metrics':
+            registry.remote[shard] = payload['export']
+            self.status[shard] = dict(payload['status'], pairs=payload['pairs'], reported=time.time())
+            for key in SHARD_COUNTERS:
+                bot_status[key] = sum(status.get(key, 0) for status in self.status.values())
+        elif kind == 'pending':
+            self.hand_over(shard, payload)
+        elif kind == 'ready':
+            logger.info("Shard %s ready (pid %s)", shard, payload['pid'])
+
+    def hand_over(self, source, signals):
+        """Пересылает ожидающие сигналы ушедших из шарда пар их новому шарду"""
+        owners = {pair: shard for shard, worker in self.workers.items() for pair in worker['pairs']}
+        batches = {}
+        for signal in signals:
+            owner = owners.get(signal['symbol'])
+            if owner is None or owner == source:
+                logger.warning("No shard owns %s, dropping pending signal %s", signal['symbol'], signal['id'])
+                continue
+            batches.setdefault(owner, []).append(signal)
+        for shard, batch in batches.items():
+            logger.info("Handing %d pending signals from shard %s to shard %s", len(batch), source, shard)
+            self.send(shard, 'pending', batch)
+
+    def send(self, shard, kind, payload=None):
+        conn = self.workers[shard]['conn']
+        try:
+            if not conn.closed:
+                conn.send((kind, payload))
+        except (BrokenPipeError, OSError) as e:
+            logger.error("Can't send %s to shard %s: %s", kind, shard, str(e))
+
+    def broadcast(self, kind, payload=None):
+        for shard in self.workers:
+            self.send(shard, kind, payload)
+
+    async def start(self):
+        from database import init_database, load_weights
+        from learning import LearningSystem
+        # Схема базы создается один раз до запуска процессов
+        await asyncio.to_thread(init_database)
+        loaded_weights = await asyncio.to_thread(load_weights)
+        if loaded_weights:
+            indicator_weights.update(loaded_weights)
+        LearningSystem.initialize()
+        LearningSystem.on_apply = lambda: self.broadcast('weights', dict(indicator_weights))
+
+        self.running = True
+        for shard, pairs in assign_shards(TRADING_PAIRS, self.shards, self.strategy, self.overrides).items():
+            self._spawn(shard, pairs)
+        self.monitor_task = asyncio.create_task(self.monitor())
+
+    async def monitor(self):
+        while self.running:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            for shard, worker in list(self.workers.items()):
+                if not self.running or worker['process'].is_alive():
+                    continue
+                self._close(shard)
+                worker['restarts'] += 1
+                delay = min(60, 2 ** worker['restarts'])
+                logger.error("Shard %s exited with code %s, restarting in %ss",
+                             shard, worker['process'].exitcode, delay)
+                await asyncio.sleep(delay)
+                if self.running:
+                    self._spawn(shard, worker['pairs'])
+
+    async def rebalance(self, pairs=None, strategy=None):
+        """Перераспределяет пары без перезапуска процессов; шарды подписываются/отписываются сами"""
+        # Неизвестная стратегия отклоняется до того, как заменит текущую
+        assignment = assign_shards(TRADING_PAIRS if pairs is None else pairs, self.shards,
+                                   strategy or self.strategy, self.overrides)
+        if strategy is not None:
+            self.strategy = strategy
+        for shard, shard_pairs in assignment.items():
+            worker = self.workers.get(shard)
+            if worker is None or worker['pairs'] == shard_pairs:
+                continue
+            worker['pairs'] = shard_pairs
+            self.send(shard, 'pairs', shard_pairs)
+        return assignment
+
+    async def stop(self):
+        from database import save_weights, db_writer
+        from learning import LearningSystem
+        self.running = False
+        if self.monitor_task:
+            self.monitor_task.cancel()
+            self.monitor_task = None
+        self.broadcast('stop')
+        for shard, worker in self.workers.items():
+            process = worker['process']
+            await asyncio.to_thread(process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Shard %s did not stop in time, terminating", shard)
+                process.terminate()
+            # Последний отчет процесса перед выходом
+            self._on_readable(shard)
+            self._close(shard)
+        self.workers = {}
+        self.status = {}
+        registry.remote.clear()
+
+        LearningSystem.on_apply = None
+        LearningSystem.save_performance()
+        save_weights(indicator_weights)
+        await asyncio.to_thread(db_writer.stop)
+
+    def describe(self):
+        return {
+            'strategy': self.strategy,
+            'shards': {
+                shard: {
+                    'pid': worker['process'].pid,
+                    'alive': worker['process'].is_alive(),
+                    'pairs': worker['pairs'],
+                    'restarts': worker['restarts'],
+                    'status': self.status.get(shard, {})
+                } for shard, worker in self.workers.items()
+            }
+        }
+
+shard_supervisor = ShardSupervisor()
@@ -1,48 +1,93 @@
 import asyncio
 import time
 import logging
-import pandas as pd
-from globals import market_data, indicator_weights, SIGNAL_THRESHOLD, MIN_INDICATORS, bot_status, TIMEFRAME_HIERARCHY, CONFIRMATION_THRESHOLD
-from database import store_signal, update_signal_result
+import numpy as np
+from globals import market_data, SIGNAL_THRESHOLD, MIN_INDICATORS, bot_status, TIMEFRAME_HIERARCHY, CONFIRMATION_THRESHOLD, PENDING_CHECK_INTERVAL
+from events import kline_events
+from database import store_signal, update_signal_strength
+from outcome_scheduler import outcome_scheduler
 from telegram import send_signal
-from indicators import TechnicalIndicators
-from learning import LearningSystem
+from compute import compute_executor
+from indicator_cache import indicator_cache
+from cooldown import signal_cooldown
+from streaming_indicators import IndicatorEngine
+from scoring import SignalScorer, SCORING_COLUMNS, encode_features
+from indicators import CONFIRMATION_INDICATORS, output_columns, window_size
+from metrics import registry, INDICATOR_SECONDS, ANALYZER_SWEEP_SECONDS, ANALYZER_SWEEP_STREAMS
 
 logger = logging.getLogger(__name__)
+# Старшие таймфреймы считаются только по индикаторам подтверждения
+CONFIRMATION_COLUMNS = ['close'] + output_columns(CONFIRMATION_INDICATORS)
+CONFIRMATION_WINDOW = window_size(CONFIRMATION_INDICATORS)
 analysis_task = None
+analyzer = None
 
 class SignalAnalyzer:
-    def __init__(self):
-        self.indicators = TechnicalIndicators()
+    def __init__(self, sink=None):
+        # sink - замена send_signal (в шардированном режиме сигнал уходит супервизору)
+        self.sink = sink
+        self.engine = IndicatorEngine()
+        self.scorer = SignalScorer()
         self.active = True
         self.pending_signals = {}
         
     async def analyze_all(self):
+        """Анализ по событиям: поток пересчитывается только когда в нем появились новые данные"""
+        last_check = time.monotonic()
         while self.active and bot_status.get('running', False):
             try:
-                for symbol in list(market_data.keys()):
-                    for timeframe in list(market_data.get(symbol, {}).keys()):
-                        if len(market_data[symbol][timeframe]) > 50:
-                            await self.analyze_symbol(symbol, timeframe)
-                await self.check_pending_signals()
-                await asyncio.sleep(3)
+                try:
+                    first = await asyncio.wait_for(kline_events.get(), timeout=PENDING_CHECK_INTERVAL)
+                    # Все изменившиеся потоки оцениваются одним матричным проходом
+                    keys = [(symbol, timeframe) for (symbol, timeframe), event in [first] + kline_events.drain()
+                            if len(market_data[symbol][timeframe]) > 50]
+                    await self.analyze_batch(keys)
+                except asyncio.TimeoutError:
+                    pass
+                if time.monotonic() - last_check >= PENDING_CHECK_INTERVAL:
+                    await self.check_pending_signals()
+                    last_check = time.monotonic()
             except Exception as e:
                 logger.error("Analysis loop error: %s", str(e))
                 await asyncio.sleep(10)
     
     async def check_pending_signals(self):
         current_time = time.time()
-        expired_signals = []
-        for signal_id, signal_data in list(self.pending_signals.items()):
-            if current_time - signal_data['timestamp'] > 30:
-                if await self.is_signal_confirmed(signal_data):
-                    await self.send_confirmed_signal(signal_data)
-                expired_signals.append(signal_id)
-        for signal_id in expired_signals:
-            if signal_id in self.pending_signals:
-                del self.pending_signals[signal_id]
+        due_signals = [signal_data for signal_data in self.pending_signals.values()
+                       if current_time - signal_data['timestamp'] > 30]
+        if not due_signals:
+            return
+
+        # Старшие таймфреймы берутся из кэша, промахи считаются одним пакетом
+        snapshots = {}
+        windows = {}
+        candles = {}
+        for signal_data in due_signals:
+            symbol = signal_data['symbol']
+            for htf in TIMEFRAME_HIERARCHY.get(signal_data['timeframe'], []):
+                key = (symbol, htf)
+                if key in snapshots or key in windows:
+                    continue
+                if symbol in market_data and htf in market_data[symbol]:
+                    store = market_data[symbol][htf]
+                    snapshot = indicator_cache.get(symbol, htf, store, CONFIRMATION_COLUMNS)
+                    if snapshot is not None:
+                        snapshots[key] = snapshot
+                    else:
+                        windows[key] = store.tail(CONFIRMATION_WINDOW)
+                        candles[key] = indicator_cache.candle_key(store)
+        if windows:
+            computed = await compute_executor.latest_indicators(windows, CONFIRMATION_INDICATORS)
+            for (symbol, htf), snapshot in computed.items():
+                indicator_cache.put(symbol, htf, market_data[symbol][htf], snapshot, candles[(symbol, htf)])
+            snapshots.update(computed)
+
+        for signal_data in due_signals:
+            if self.is_signal_confirmed(signal_data, snapshots):
+                await self.send_confirmed_signal(signal_data)
+            self.pending_signals.pop(signal_data['id'], None)
     
-    async def is_signal_confirmed(self, signal_data):
+    def is_signal_confirmed(self, signal_data, snapshots):
         symbol = signal_data['symbol']
         signal_type = signal_data['signal_type']
         base_timeframe = signal_data['timeframe']
@@ -53,34 +98,31 @@ class SignalAnalyzer:
         confirmation_strength = 0
         required_confirmations = len(higher_timeframes)
         for htf in higher_timeframes:
-            if symbol in market_data and htf in market_data[symbol]:
-                df = pd.DataFrame(market_data[symbol][htf][-100:])
-                if df.empty:
-                    continue
-                df = self.indicators.calculate_all_indicators(df)
-                latest = df.iloc[-1]
-                try:
-                    if signal_type == 'BUY':
-                        if ((latest['EMA_12'] > latest['EMA_26'] or 
-                             latest['MACD'] > latest['MACD_signal'] or
-                             latest['close'] > latest['BB_middle']) and 
-                            latest['ADX'] > 20 and 
-                            latest['OBV_trend'] > 0):
-                            confirmation_strength += 1
-                    else:
-                        if ((latest['EMA_12'] < latest['EMA_26'] or 
-                             latest['MACD'] < latest['MACD_signal'] or
-                             latest['close'] < latest['BB_middle']) and 
-                            latest['ADX'] > 20 and 
-                            latest['OBV_trend'] < 0):
-                            confirmation_strength += 1
-                except KeyError:
-                    continue
+            latest = snapshots.get((symbol, htf))
+            if latest is None:
+                continue
+            try:
+                if signal_type == 'BUY':
+                    if ((latest['EMA_12'] > latest['EMA_26'] or 
+                         latest['MACD'] > latest['MACD_signal'] or
+                         latest['close'] > latest['BB_middle']) and 
+                        latest['ADX'] > 20 and 
+                        latest['OBV_trend'] > 0):
+                        confirmation_strength += 1
+                else:
+                    if ((latest['EMA_12'] < latest['EMA_26'] or 
+                         latest['MACD'] < latest['MACD_signal'] or
+                         latest['close'] < latest['BB_middle']) and 
+                        latest['ADX'] > 20 and 
+                        latest['OBV_trend'] < 0):
+                        confirmation_strength += 1
+            except KeyError:
+                continue
         return (confirmation_strength / required_confirmations) >= CONFIRMATION_THRESHOLD if required_confirmations > 0 else True
     
     async def send_confirmed_signal(self, signal_data):
         signal_id = signal_data['id']
-        await send_signal(
+        await (self.sink or send_signal)(
             signal_data['symbol'],
             signal_data['timeframe'],
             signal_data['signal_type'],
@@ -89,105 +131,77 @@ class SignalAnalyzer:
             signal_data['indicators'],
             signal_id
         )
-        asyncio.create_task(self.track_signal_result(signal_id, signal_data))
-    
-    async def track_signal_result(self, signal_id, signal_data):
-        symbol = signal_data['symbol']
-        timeframe = signal_data['timeframe']
-        signal_type = signal_data['signal_type']
         try:
-            entry_price = market_data[symbol][timeframe][-1]['close']
-        except (KeyError, IndexError) as e:
+            entry = market_data[signal_data['symbol']][signal_data['timeframe']].last()
+            outcome_scheduler.schedule(signal_data, entry['close'], entry['timestamp'])
+        except (KeyError, TypeError) as e:
             logger.error("Can't get entry price for %s: %s", signal_id, str(e))
+
+    def latest_snapshot(self, symbol, timeframe):
+        data = market_data[symbol][timeframe]
+        if len(data) < 50:
+            return None
+        latest = indicator_cache.get(symbol, timeframe, data, SCORING_COLUMNS)
+        if latest is None:
+            # Инкрементальный расчет: досчитываются только новые свечи
+            started = time.perf_counter()
+            latest = self.engine.latest(symbol, timeframe, data)
+            INDICATOR_SECONDS.observe(time.perf_counter() - started, timeframe)
+            if latest is None:
+                return None
+            indicator_cache.put(symbol, timeframe, data, latest)
+        return latest
+
+    async def analyze_batch(self, keys):
+        started = time.perf_counter()
+        ready = []
+        for symbol, timeframe in keys:
+            try:
+                latest = self.latest_snapshot(symbol, timeframe)
+                if latest is not None:
+                    self.scorer.update((symbol, timeframe), latest)
+                    ready.append((symbol, timeframe))
+            except Exception as e:
+                logger.error("Error analyzing %s/%s: %s", symbol, timeframe, str(e))
+        if not ready:
             return
-            
-        wait_hours = 4 if timeframe != '1d' else 24
-        await asyncio.sleep(wait_hours * 3600)
-        
+
         try:
-            current_price = market_data[symbol][timeframe][-1]['close']
-            price_change = (current_price - entry_price) / entry_price
-            profitable = (signal_type == 'BUY' and price_change > 0.01) or \
-                        (signal_type == 'SELL' and price_change < -0.01)
-            update_signal_result(signal_id, profitable)
-            
-            if profitable:
-                bot_status['profitable_signals'] = bot_status.get('profitable_signals', 0) + 1
-            else:
-                bot_status['unprofitable_signals'] = bot_status.get('unprofitable_signals', 0) + 1
-                
-            LearningSystem.update_weights({
-                'id': signal_id,
-                'symbol': symbol,
-                'timeframe': timeframe,
-                'signal_type': signal_type,
-                'indicators': signal_data['indicators'],
-                'profitable': profitable
-            })
+            names, strength, active = self.scorer.score(ready)
+            passed = (np.abs(strength) >= SIGNAL_THRESHOLD) & (active.sum(axis=1) >= MIN_INDICATORS)
+            for i in np.flatnonzero(passed):
+                symbol, timeframe = ready[i]
+                signal_type = "BUY" if strength[i] > 0 else "SELL"
+                indicators = [names[j] for j in np.flatnonzero(active[i])]
+                self.register_pending_signal(symbol, timeframe, signal_type, abs(float(strength[i])), indicators,
+                                             self.scorer.vector((symbol, timeframe)))
         except Exception as e:
-            logger.error("Error tracking signal %s: %s", signal_id, str(e))
+            logger.error("Error scoring %d streams: %s", len(ready), str(e))
+        ANALYZER_SWEEP_SECONDS.observe(time.perf_counter() - started)
+        ANALYZER_SWEEP_STREAMS.observe(len(ready))
 
     async def analyze_symbol(self, symbol, timeframe):
-        try:
-            data = market_data[symbol][timeframe]
-            if len(data) < 50:
-                return
-                
-            df = pd.DataFrame(data[-200:])
-            df = self.indicators.calculate_all_indicators(df)
-            if df.empty:
-                return
-                
-            latest = df.iloc[-1]
-            signals = self.calculate_indicator_signals(latest)
-            strength, indicators = self.calculate_signal_strength(signals)
-            
-            if abs(strength) >= SIGNAL_THRESHOLD and len(indicators) >= MIN_INDICATORS:
-                signal_type = "BUY" if strength > 0 else "SELL"
-                signal_id = self.register_pending_signal(
-                    symbol, timeframe, signal_type, abs(strength), indicators
-                )
-        except Exception as e:
-            logger.error("Error analyzing %s/%s: %s", symbol, timeframe, str(e))
+        await self.analyze_batch([(symbol, timeframe)])
 
-    def calculate_indicator_signals(self, latest):
-        signals = {}
-        try:
-            signals['EMA'] = 1.0 if latest['EMA_12'] > latest['EMA_26'] else -1.0
-            signals['SMA'] = 1.0 if latest['close'] > latest['SMA_20'] else -1.0
-            signals['MACD'] = 1.0 if latest['MACD'] > latest['MACD_signal'] else -1.0
-            signals['Supertrend'] = 1.0 if latest['Supertrend'] > 0 else -1.0
-            signals['ADX'] = 1.0 if latest['ADX'] > 20 else 0.0
-            signals['RSI'] = -1.0 if latest.get('RSI', 0) > 65 else 1.0 if latest.get('RSI', 0) < 35 else 0.0
-            signals['Stochastic'] = 1.0 if latest.get('Stoch_k', 0) < 25 and latest.get('Stoch_d', 0) < 25 else -1.0 if latest.get('Stoch_k', 0) > 75 and latest.get('Stoch_d', 0) > 75 else 0.0
-            signals['Williams'] = 1.0 if latest.get('Williams', 0) < -75 else -1.0 if latest.get('Williams', 0) > -25 else 0.0
-            signals['CCI'] = 1.0 if latest.get('CCI', 0) < -90 else -1.0 if latest.get('CCI', 0) > 90 else 0.0
-            signals['Bollinger_Bands'] = -1.0 if latest['close'] > latest.get('BB_upper', 0) else 1.0 if latest['close'] < latest.get('BB_lower', 0) else 0.0
-            signals['Keltner_Channel'] = -1.0 if latest['close'] > latest.get('KC_upper', 0) else 1.0 if latest['close'] < latest.get('KC_lower', 0) else 0.0
-            signals['Volume_Oscillator'] = 1.0 if latest.get('Volume_Osc', 0) > 0 else -1.0
-            signals['OBV'] = 1.0 if latest.get('OBV_trend', 0) > 0 else -1.0
-            signals['Engulfing'] = 1.0 if latest.get('Bullish_Engulfing', False) else -1.0 if latest.get('Bearish_Engulfing', False) else 0.0
-            signals['Hammer'] = 1.0 if latest.get('Hammer', False) else 0.0
-            signals['Pin_Bar'] = 1.0 if latest.get('Pin_Bar_bull', False) else -1.0 if latest.get('Pin_Bar_bear', False) else 0.0
-        except KeyError as e:
-            logger.error("Missing indicator data: %s", str(e))
-            return {}
-        return signals
+    def register_pending_signal(self, symbol, timeframe, signal_type, strength, indicators, features=None):
+        """id нового или усиленного сигнала; None, если повтор подавлен.
 
-    def calculate_signal_strength(self, signals):
-        total_strength = 0.0
-        total_weight = 0.0
-        active_indicators = []
-        for indicator, signal in signals.items():
-            if signal != 0 and indicator in indicator_weights:
-                weight = indicator_weights[indicator]
-                total_strength += signal * weight
-                total_weight += weight
-                active_indicators.append(indicator)
-        return (total_strength / total_weight, active_indicators) if total_weight > 0 else (0.0, [])
+        features - значения SCORING_COLUMNS на момент сигнала, для переобучения весов (refit.py)
+        """
+        candle = int(market_data[symbol][timeframe].last()['timestamp'])
+        allowed, previous = signal_cooldown.allow(symbol, timeframe, signal_type, candle, strength)
+        if not allowed:
+            return None
+        pending = self.pending_signals.get(previous)
+        if pending is not None:
+            # Неподтвержденный сигнал усиливается на месте: без новой строки и второго подтверждения
+            pending.update(strength=strength, indicators=indicators)
+            update_signal_strength(previous, strength, indicators,
+                                   None if features is None else encode_features(features))
+            signal_cooldown.record(symbol, timeframe, signal_type, candle, strength, previous)
+            return previous
 
-    def register_pending_signal(self, symbol, timeframe, signal_type, strength, indicators):
-        signal_id = f"{symbol}-{timeframe}-{int(time.time())}"
+        signal_id = f"{symbol}-{timeframe}-{signal_type}-{int(time.time() * 1000)}"
         self.pending_signals[signal_id] = {
             'id': signal_id,
             'symbol': symbol,
@@ -198,7 +212,9 @@ class SignalAnalyzer:
             'indicators': indicators,
             'timestamp': time.time()
         }
-        store_signal(signal_id, symbol, timeframe, signal_type, strength, self.pending_signals[signal_id]['accuracy'], indicators)
+        store_signal(signal_id, symbol, timeframe, signal_type, strength, self.pending_signals[signal_id]['accuracy'], indicators,
+                     None if features is None else encode_features(features))
+        signal_cooldown.record(symbol, timeframe, signal_type, candle, strength, signal_id)
         return signal_id
 
     def calculate_accuracy(self):
@@ -210,13 +226,22 @@ class SignalAnalyzer:
             return max(0.7, min(0.98, accuracy))
         return 0.93
 
-def start_analysis():
-    global analysis_task
-    analyzer = SignalAnalyzer()
+def start_analysis(pending_signals=None, sink=None):
+    global analysis_task, analyzer
+    # События, накопленные до запуска, относятся к прошлой сессии
+    kline_events.clear()
+    analyzer = SignalAnalyzer(sink)
+    if pending_signals:
+        analyzer.pending_signals.update(pending_signals)
     analysis_task = asyncio.create_task(analyzer.analyze_all())
+    return analyzer
 
 def stop_analysis():
-    global analysis_task
+    global analysis_task, analyzer
+    analyzer = None
     if analysis_task:
         analysis_task.cancel()
         analysis_task = None
+
+registry.gauge('pending_signals', "Signals waiting for higher timeframe confirmation",
+               lambda: len(analyzer.pending_signals) if analyzer else 0)
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import numpy as np
+from globals import (market_data, indicator_weights, TIMEFRAME_MS, SNAPSHOT_PATH, SNAPSHOT_INTERVAL,
+                     SNAPSHOT_MAX_GAP_CANDLES)
+from candle_store import CandleStore, COLUMNS
+from learning import LearningSystem
+import signal_analyzer
+from cooldown import signal_cooldown
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+# Ожидающий подтверждения сигнал старше этого (секунды) после перезапуска уже не актуален
+PENDING_MAX_AGE = 120
+
+def capture():
+    """Копия состояния для записи: закрытые свечи, ожидающие сигналы, обучение.
+
+    Выполняется в цикле событий, чтобы не читать буферы во время обновления.
+    """
+    streams = {}
+    for symbol, stores in market_data.items():
+        for timeframe, store in stores.items():
+            closed = store.closed_tail()
+            if len(closed['timestamp']):
+                streams[(symbol, timeframe)] = {name: closed[name].copy() for name in COLUMNS}
+    analyzer = signal_analyzer.analyzer
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'streams': [list(key) for key in streams],
+        'pending_signals': [dict(signal) for signal in analyzer.pending_signals.values()] if analyzer else [],
+        'performance': LearningSystem.export(),
+        'weights': dict(indicator_weights),
+        'cooldown': signal_cooldown.export()
+    }
+    return meta, streams
+
+def write(path, meta, streams):
+    """Запись в .npz через временный файл: прерванная запись не портит прошлый снимок"""
+    arrays = {'meta': np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)}
+    for i, data in enumerate(streams.values()):
+        arrays[f"ts{i}"] = data['timestamp']
+        arrays[f"px{i}"] = np.column_stack([data[name] for name in COLUMNS[1:]])
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def read(path):
+    """(meta, {(symbol, timeframe): (timestamps, ohlcv)}) или None"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+        if meta.get('version') != SNAPSHOT_VERSION:
+            logger.warning("Unsupported snapshot version %s", meta.get('version'))
+            return None
+        streams = {tuple(key): (data[f"ts{i}"], data[f"px{i}"]) for i, key in enumerate(meta['streams'])}
+    return meta, streams
+
+def restore(meta, streams, now=None, weights_saved_at=None, pairs=None):
+    """Загружает снимок в market_data и обучение; возвращает актуальные ожидающие сигналы.
+
+    Поток пропускается, если с его последней свечи прошло больше
+    SNAPSHOT_MAX_GAP_CANDLES баров или в памяти уже есть более свежие данные.
+    Если задан pairs, берутся только потоки, окна подавления и сигналы этих
+    пар: после перераспределения снимок шарда содержит и чужие пары.
+    Веса в базе главнее: веса снимка применяются, только если базе нечего
+    предложить (weights_saved_at=None) или снимок сделан позже записи весов.
+    """
+    now = time.time() if now is None else now
+    now_ms = int(now * 1000)
+    restored = skipped = 0
+    for (symbol, timeframe), (timestamps, prices) in streams.items():
+        if pairs is not None and symbol not in pairs:
+            continue
+        frame_ms = TIMEFRAME_MS.get(timeframe)
+        if not frame_ms or not len(timestamps):
+            continue
+        missed = (now_ms - int(timestamps[-1])) // frame_ms - 1
+        current = market_data.get(symbol, {}).get(timeframe)
+        if missed > SNAPSHOT_MAX_GAP_CANDLES or (current is not None and len(current)):
+            skipped += 1
+            continue
+        store = CandleStore()
+        store.load(timestamps, *(prices[:, i] for i in range(prices.shape[1])))
+        market_data.setdefault(symbol, {})[timeframe] = store
+        restored += 1
+
+    # Веса в базу пишутся при остановке и после переобучения; снимок новее
+    # только если процесс завершился аварийно после их последней записи
+    if weights_saved_at is None or meta['created'] * 1000 > weights_saved_at:
+        indicator_weights.update(meta.get('weights', {}))
+    else:
+        logger.info("Snapshot weights are older than the database, keeping database weights")
+    LearningSystem.merge(meta.get('performance', {}))
+
+    signal_cooldown.restore([row for row in meta.get('cooldown', []) if pairs is None or row[0] in pairs])
+
+    pending = {signal['id']: signal for signal in meta.get('pending_signals', [])
+               if now - signal['timestamp'] <= PENDING_MAX_AGE and (pairs is None or signal['symbol'] in pairs)}
+    logger.info("Snapshot from %.0fs ago: %d streams restored, %d stale, %d pending signals",
+                now - meta['created'], restored, skipped, len(pending))
+    return pending
+
+class SnapshotManager:
+    """Периодический снимок состояния и восстановление при запуске"""
+
+    def __init__(self, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.task = None
+
+    async def save(self):
+        try:
+            started = time.perf_counter()
+            meta, streams = capture()
+            await asyncio.to_thread(write, self.path, meta, streams)
+            logger.info("Snapshot saved: %d streams in %.3fs", len(streams), time.perf_counter() - started)
+        except Exception as e:
+            logger.error("Snapshot save error: %s", str(e))
+
+    async def restore(self, weights_saved_at=None, pairs=None):
+        try:
+            started = time.perf_counter()
+            state = await asyncio.to_thread(read, self.path)
+            if state is None:
+                return {}
+            pending = restore(*state, weights_saved_at=weights_saved_at, pairs=pairs)
+            logger.info("Snapshot loaded in %.3fs", time.perf_counter() - started)
+            return pending
+        except Exception as e:
+            logger.error("Snapshot restore error: %s", str(e))
+            return {}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+    def start(self):
+        if self.interval > 0 and (self.task is None or self.task.done()):
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+snapshot_manager = SnapshotManager()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Время старта: от запуска процесса до первого ответа HTTP, миллисекунды
+STARTUP_BUDGET_MS = 300
+
+def import_times(module, env=None):
+    """Разбор вывода python -X importtime: [(модуль, собственное мкс, с зависимостями мкс, глубина)]"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip())) // 2))
+    return rows
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def first_response(app='main:app', timeout=30.0, env=None):
+    """Миллисекунды от запуска uvicorn до первого ответа на GET /"""
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', app, '--host', '127.0.0.1', '--port', str(port),
+                                '--log-level', 'warning'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited:\n{process.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    response.read()
+                    return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"no response within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait(5)
+
+def report(module, top=15, env=None):
+    rows = import_times(module, env)
+    total = next((row for row in reversed(rows) if row[0] == module), rows[-1])[2]
+    return {
+        'module': module,
+        'total_ms': total / 1000,
+        'self': [{'module': name, 'ms': self_us / 1000}
+                 for name, self_us, _, _ in sorted(rows, key=lambda row: -row[1])[:top]],
+        'top_level': [{'module': name, 'ms': cumulative_us / 1000}
+                      for name, _, cumulative_us, depth in sorted(rows, key=lambda row: -row[2])
+                      if depth == 1][:top]
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time profile and time to first HTTP response")
+    parser.add_argument('modules', nargs='*', default=['main', 'core'], help="Modules to profile")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--http', action='store_true', help="Also start uvicorn and time the first response to /")
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help="Exit with code 1 if the first response (or import main alone) is slower")
+    parser.add_argument('--no-preload', action='store_true',
+                        help="Disable the background analysis preload (production default is on)")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    # По умолчанию окружение как у сервиса (PRELOAD_ANALYSIS из globals, включен)
+    env = dict(os.environ, PRELOAD_ANALYSIS='0') if args.no_preload else None
+    results = {'modules': [report(module, args.top, env) for module in args.modules],
+               'preload_analysis': not args.no_preload, 'budget_ms': args.budget_ms}
+    if args.http:
+        results['first_response_ms'] = first_response(env=env)
+        results['over_budget_ms'] = max(0.0, results['first_response_ms'] - args.budget_ms)
+
+    # Импорт приложения - нижняя граница времени до первого ответа, даже без --http
+    main_import = next((item['total_ms'] for item in results['modules'] if item['module'] == 'main'), 0.0)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for item in results['modules']:
+            print(f"import {item['module']}: {item['total_ms']:.1f} ms")
+            print("  top-level imports:")
+            for row in item['top_level']:
+                print(f"    {row['ms']:9.1f} ms  {row['module']}")
+            print("  slowest modules (self time):")
+            for row in item['self']:
+                print(f"    {row['ms']:9.1f} ms  {row['module']}")
+        if 'first_response_ms' in results:
+            verdict = (f"OVER budget by {results['over_budget_ms']:.0f} ms" if results['over_budget_ms']
+                       else "within budget")
+            print(f"first HTTP response: {results['first_response_ms']:.0f} ms, {verdict} "
+                  f"(budget {args.budget_ms:.0f} ms, preload {'on' if results['preload_analysis'] else 'off'})")
+        if main_import > args.budget_ms:
+            print(f"import main alone is {main_import:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    if results.get('over_budget_ms', 0) > 0 or main_import > args.budget_ms:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
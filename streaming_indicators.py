@@ -0,0 +1,347 @@
+import math
+import logging
+from collections import deque
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NAN = float('nan')
+
+# Колонки, которые отдает движок (совпадают с TechnicalIndicators.calculate_all_indicators)
+NUMERIC_COLUMNS = [
+    'EMA_12', 'EMA_26', 'SMA_20', 'MACD', 'MACD_signal', 'ADX', 'Supertrend',
+    'RSI', 'CCI', 'Stoch_k', 'Stoch_d', 'Williams', 'ATR',
+    'BB_upper', 'BB_middle', 'BB_lower', 'KC_upper', 'KC_middle', 'KC_lower',
+    'OBV', 'OBV_trend', 'Volume_Osc'
+]
+PATTERN_COLUMNS = ['Bullish_Engulfing', 'Bearish_Engulfing', 'Hammer', 'Pin_Bar_bull', 'Pin_Bar_bear']
+
+def _isnan(x):
+    return x != x
+
+# Примитивы. update(x, commit): при commit=False считается значение для
+# незакрытой свечи, а накопленное состояние не меняется.
+
+class EMA:
+    """ta.ema: затравка SMA первых length позиций (NaN пропускаются), затем adjust=False"""
+
+    def __init__(self, length):
+        self.length = length
+        self.alpha = 2.0 / (length + 1)
+        self.seed = []
+        self.value = NAN
+
+    def update(self, x, commit=True):
+        if len(self.seed) < self.length:
+            seed = self.seed + [x]
+            valid = [v for v in seed if not _isnan(v)]
+            value = sum(valid) / len(valid) if len(seed) == self.length and valid else NAN
+            if commit:
+                self.seed = seed
+                self.value = value
+            return value
+        value = self.value if _isnan(x) else self.value + self.alpha * (x - self.value)
+        if commit:
+            self.value = value
+        return value
+
+class RMA:
+    """ta.rma: ewm(alpha=1/length, adjust=True, min_periods=length)"""
+
+    def __init__(self, length):
+        self.length = length
+        self.decay = 1.0 - 1.0 / length
+        self.numerator = 0.0
+        self.denominator = 0.0
+        self.observations = 0
+
+    def update(self, x, commit=True):
+        if _isnan(x):
+            if self.observations == 0:
+                return NAN
+            return self.numerator / self.denominator if self.observations >= self.length else NAN
+        numerator = x + self.decay * self.numerator
+        denominator = 1.0 + self.decay * self.denominator
+        observations = self.observations + 1
+        if commit:
+            self.numerator, self.denominator, self.observations = numerator, denominator, observations
+        return numerator / denominator if observations >= self.length else NAN
+
+class Window:
+    """Скользящее окно из length последних значений"""
+
+    def __init__(self, length):
+        self.length = length
+        self.values = deque(maxlen=length)
+
+    def update(self, x, commit=True):
+        if commit:
+            self.values.append(x)
+            return self.values
+        if len(self.values) < self.length:
+            return list(self.values) + [x]
+        return list(self.values)[1:] + [x]
+
+class SMA:
+    def __init__(self, length):
+        self.window = Window(length)
+
+    def update(self, x, commit=True):
+        values = self.window.update(x, commit)
+        return sum(values) / len(values) if len(values) == self.window.length else NAN
+
+class StreamingIndicators:
+    """Инкрементальные индикаторы одного потока (symbol, timeframe).
+
+    Эквивалент TechnicalIndicators.calculate_all_indicators, посчитанного по
+    всей истории с первой свечи движка: EMA/RMA хранят аккумуляторы, окна -
+    последние length значений. Обновление стоит O(1) относительно длины истории.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_timestamp = None
+        self.last_row = None
+        self.prev = None  # (high, low, close) последней закрытой свечи
+        self.obv = 0.0
+
+        self.ema_12 = EMA(12)
+        self.ema_26 = EMA(26)
+        self.macd_signal = EMA(9)
+        self.close_20 = Window(20)
+
+        self.atr_14 = RMA(14)
+        self.atr_10 = RMA(10)
+        self.dm_plus = RMA(14)
+        self.dm_minus = RMA(14)
+        self.adx = RMA(14)
+        self.supertrend = (1, NAN, NAN)  # направление, верхняя и нижняя полосы
+
+        self.rsi_up = RMA(14)
+        self.rsi_down = RMA(14)
+        self.typical_20 = Window(20)
+        self.high_14 = Window(14)
+        self.low_14 = Window(14)
+        self.stoch_k = SMA(3)
+        self.stoch_d = SMA(3)
+
+        self.kc_basis = EMA(20)
+        self.kc_band = EMA(20)
+
+        self.obv_20 = EMA(20)
+        self.obv_50 = EMA(50)
+        self.volume_12 = EMA(12)
+        self.volume_26 = EMA(26)
+
+    def update(self, timestamp, open_, high, low, close, volume, commit=True):
+        """Значения индикаторов для свечи; commit=False - незакрытая свеча"""
+        prev = self.prev
+        row = {'timestamp': timestamp, 'open': open_, 'high': high, 'low': low,
+               'close': close, 'volume': volume}
+
+        # Тренд
+        ema_12 = self.ema_12.update(close, commit)
+        ema_26 = self.ema_26.update(close, commit)
+        row['EMA_12'] = ema_12
+        row['EMA_26'] = ema_26
+        closes = self.close_20.update(close, commit)
+        full_20 = len(closes) == 20
+        mean_20 = sum(closes) / 20 if full_20 else NAN
+        row['SMA_20'] = mean_20
+
+        macd = ema_26 if _isnan(ema_26) else ema_12 - ema_26
+        row['MACD'] = macd
+        row['MACD_signal'] = NAN if _isnan(macd) else self.macd_signal.update(macd, commit)
+
+        # Общий промежуточный результат: true range для ATR, ADX, Supertrend и KC
+        if prev is None:
+            true_range = NAN
+        else:
+            prev_high, prev_low, prev_close = prev
+            true_range = max(high - low, abs(high - prev_close), abs(prev_close - low))
+        atr_14 = self.atr_14.update(true_range, commit)
+        atr_10 = self.atr_10.update(true_range, commit)
+        row['ATR'] = atr_14
+
+        if prev is None:
+            dm_plus = dm_minus = NAN
+        else:
+            up = high - prev_high
+            down = prev_low - low
+            dm_plus = up if up > down and up > 0 else 0.0
+            dm_minus = down if down > up and down > 0 else 0.0
+        dm_plus = self.dm_plus.update(dm_plus, commit)
+        dm_minus = self.dm_minus.update(dm_minus, commit)
+        di_plus = 100 / atr_14 * dm_plus if atr_14 else NAN
+        di_minus = 100 / atr_14 * dm_minus if atr_14 else NAN
+        dx = 100 * abs(di_plus - di_minus) / (di_plus + di_minus) if di_plus + di_minus else NAN
+        row['ADX'] = self.adx.update(dx, commit)
+
+        row['Supertrend'] = self._supertrend(high, low, close, atr_10, commit)
+
+        # Осцилляторы
+        delta = NAN if prev is None else close - prev[2]
+        up_avg = self.rsi_up.update(NAN if prev is None else max(delta, 0.0), commit)
+        down_avg = self.rsi_down.update(NAN if prev is None else min(delta, 0.0), commit)
+        row['RSI'] = 100 * up_avg / (up_avg + abs(down_avg)) if up_avg + abs(down_avg) else NAN
+
+        typical = (high + low + close) / 3
+        typicals = self.typical_20.update(typical, commit)
+        if len(typicals) == 20:
+            typical_mean = sum(typicals) / 20
+            mad = sum(abs(v - typical_mean) for v in typicals) / 20
+            row['CCI'] = (typical - typical_mean) / (0.015 * mad) if mad else NAN
+        else:
+            row['CCI'] = NAN
+
+        highs = self.high_14.update(high, commit)
+        lows = self.low_14.update(low, commit)
+        if len(highs) == 14:
+            highest, lowest = max(highs), min(lows)
+            span = highest - lowest
+            stoch = 100 * (close - lowest) / span if span else NAN
+            row['Williams'] = 100 * ((close - lowest) / span - 1) if span else NAN
+        else:
+            stoch = NAN
+            row['Williams'] = NAN
+        stoch_k = NAN if _isnan(stoch) else self.stoch_k.update(stoch, commit)
+        row['Stoch_k'] = stoch_k
+        row['Stoch_d'] = NAN if _isnan(stoch_k) else self.stoch_d.update(stoch_k, commit)
+
+        # Волатильность
+        if full_20:
+            deviation = math.sqrt(sum((v - mean_20) ** 2 for v in closes) / 20)
+            row['BB_upper'] = mean_20 + 2 * deviation
+            row['BB_middle'] = mean_20
+            row['BB_lower'] = mean_20 - 2 * deviation
+        else:
+            row['BB_upper'] = row['BB_middle'] = row['BB_lower'] = NAN
+
+        basis = self.kc_basis.update(close, commit)
+        band = self.kc_band.update(true_range, commit)
+        row['KC_upper'] = basis + 2 * band
+        # Как в calculate_all_indicators: средняя линия берется из KCLe
+        row['KC_middle'] = basis - 2 * band
+        row['KC_lower'] = basis - 2 * band
+
+        # Объем
+        if prev is None:
+            obv = volume
+        else:
+            obv = self.obv + (volume if delta > 0 else -volume if delta < 0 else 0.0)
+        row['OBV'] = obv
+        row['OBV_trend'] = self.obv_20.update(obv, commit) - self.obv_50.update(obv, commit)
+
+        volume_fast = self.volume_12.update(volume, commit)
+        volume_slow = self.volume_26.update(volume, commit)
+        row['Volume_Osc'] = 100 * (volume_fast - volume_slow) / volume_slow if volume_slow else NAN
+
+        # Свечные модели: без TA-Lib ta.cdl_pattern ничего не возвращает,
+        # поэтому и пакетный расчет дает здесь False
+        for column in PATTERN_COLUMNS:
+            row[column] = False
+
+        if commit:
+            self.prev = (high, low, close)
+            self.obv = obv
+            self.last_timestamp = timestamp
+            self.last_row = row
+        return row
+
+    def _supertrend(self, high, low, close, atr, commit):
+        direction, prev_upper, prev_lower = self.supertrend
+        hl2 = (high + low) / 2
+        upper = hl2 + 3 * atr
+        lower = hl2 - 3 * atr
+        if self.prev is None:
+            direction, trend = 1, 0.0
+        else:
+            if close > prev_upper:
+                direction = 1
+            elif close < prev_lower:
+                direction = -1
+            else:
+                if direction > 0 and lower < prev_lower:
+                    lower = prev_lower
+                if direction < 0 and upper > prev_upper:
+                    upper = prev_upper
+            trend = lower if direction > 0 else upper
+        if commit:
+            self.supertrend = (direction, upper, lower)
+        return trend
+
+    def commit(self, timestamp, open_, high, low, close, volume):
+        return self.update(timestamp, open_, high, low, close, volume, commit=True)
+
+    def peek(self, timestamp, open_, high, low, close, volume):
+        return self.update(timestamp, open_, high, low, close, volume, commit=False)
+
+def is_ready(row):
+    return row is not None and not any(_isnan(row[column]) for column in NUMERIC_COLUMNS)
+
+class IndicatorEngine:
+    """Состояние StreamingIndicators для каждого (symbol, timeframe)"""
+
+    def __init__(self):
+        self.streams = {}
+
+    def get(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.streams:
+            self.streams[key] = StreamingIndicators()
+        return self.streams[key]
+
+    def latest(self, symbol, timeframe, store):
+        """Догоняет закрытые свечи из CandleStore и возвращает последнюю строку.
+
+        Незакрытая свеча считается предварительно и не меняет состояние.
+        Возвращает None, пока не прогреты все индикаторы.
+        """
+        if not len(store):
+            return None
+        stream = self.get(symbol, timeframe)
+        closed = store.closed_tail()
+        timestamps = closed['timestamp']
+        if stream.last_timestamp is None or (len(timestamps) and timestamps[0] > stream.last_timestamp):
+            # Первая синхронизация или разрыв в данных: прогоняем всю историю
+            stream.reset()
+            start = 0
+        else:
+            start = int(np.searchsorted(timestamps, stream.last_timestamp, side='right'))
+
+        for i in range(start, len(timestamps)):
+            stream.commit(int(timestamps[i]), float(closed['open'][i]), float(closed['high'][i]),
+                          float(closed['low'][i]), float(closed['close'][i]), float(closed['volume'][i]))
+        row = stream.last_row
+        if not store.last_closed:
+            candle = store.last()
+            row = stream.peek(candle['timestamp'], candle['open'], candle['high'],
+                              candle['low'], candle['close'], candle['volume'])
+        return row if is_ready(row) else None
+
+    def drop(self, symbol, timeframe):
+        self.streams.pop((symbol, timeframe), None)
+
+def compare_with_batch(df, indicators):
+    """Максимальное относительное расхождение с пакетным расчетом по каждой колонке.
+
+    df - OHLCV с колонками open/high/low/close/volume, indicators - результат
+    TechnicalIndicators.calculate_all_indicators(df.copy()).
+    """
+    stream = StreamingIndicators()
+    rows = {}
+    for index, candle in df.iterrows():
+        rows[index] = stream.commit(index, candle['open'], candle['high'], candle['low'],
+                                    candle['close'], candle['volume'])
+    report = {}
+    for column in NUMERIC_COLUMNS:
+        if column == 'OBV':
+            # Абсолютный уровень OBV зависит от начала окна и в сигналах не используется
+            continue
+        expected = indicators[column].to_numpy(dtype=float)
+        actual = np.array([rows[index][column] for index in indicators.index], dtype=float)
+        scale = np.maximum(np.abs(expected), 1e-12)
+        report[column] = float(np.nanmax(np.abs(actual - expected) / scale)) if len(expected) else 0.0
+    return report
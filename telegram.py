@@ -3,64 +3,259 @@ import asyncio
 import json
 import logging
 import time
+from collections import deque
 from datetime import datetime
-from globals import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, bot_status
+from globals import (TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_API_URL, TELEGRAM_GLOBAL_RATE,
+                     TELEGRAM_CHAT_RATE, TELEGRAM_SENDERS, TELEGRAM_QUEUE_SIZE, bot_status)
+from metrics import registry, TELEGRAM_SEND_SECONDS
 
 logger = logging.getLogger(__name__)
 
-async def validate_telegram_token():
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        logger.error("Telegram credentials not set")
-        return False
-        
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe"
-    try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            async with session.get(url) as response:
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def wait_time(self):
+        """Секунды до следующего токена; 0 - токен можно взять сейчас"""
+        now = self._refill()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        if self.wait_time() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        while True:
+            now = self._refill()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Блокирует выдачу токенов (ответ 429 с retry_after)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class TelegramClient:
+    """Долгоживущий клиент Bot API с общим пулом соединений.
+
+    У каждого чата своя очередь. В общую очередь готовых попадает чат, у
+    которого есть токен лимита на чат, поэтому фоновые отправители ждут
+    только общий лимит бота: чат на паузе после 429 не занимает отправителя
+    и не задерживает другие чаты, а сообщения одного чата уходят по порядку.
+    """
+
+    def __init__(self, token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID, api_url=TELEGRAM_API_URL,
+                 senders=TELEGRAM_SENDERS, queue_size=TELEGRAM_QUEUE_SIZE,
+                 global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE):
+        self.token = token
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip('/')
+        self.senders = max(1, senders)
+        self.queue_size = queue_size
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.session = None
+        self.chats = {}  # chat_id -> deque сообщений
+        self.scheduled = set()  # чаты в очереди готовых или ждущие своего токена
+        self.ready = None
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.tasks = []
+
+    @property
+    def configured(self):
+        return bool(self.token and self.chat_id)
+
+    def _method_url(self, method):
+        return f"{self.api_url}/bot{self.token}/{method}"
+
+    def start(self):
+        if self.session is not None and not self.session.closed:
+            return
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.senders * 2, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=15)
+        )
+        self.ready = asyncio.Queue()
+        self.scheduled = set()
+        for chat_id, messages in self.chats.items():
+            if messages:
+                self._schedule(chat_id)
+        self.tasks = [asyncio.create_task(self._sender()) for _ in range(self.senders)]
+
+    def enqueue(self, text, chat_id=None, max_retries=5):
+        """Отправка без ожидания; возвращает future с результатом или None"""
+        if not self.configured:
+            logger.error("Telegram credentials not set. Skipping message.")
+            return None
+        self.start()
+        if self.pending >= self.queue_size:
+            logger.error("Telegram queue full, dropping message")
+            return None
+        chat_id = chat_id or self.chat_id
+        future = asyncio.get_running_loop().create_future()
+        self.chats.setdefault(chat_id, deque()).append({'text': text, 'max_retries': max_retries,
+                                                        'attempts': 0, 'started': None, 'future': future})
+        self.pending += 1
+        self.idle.clear()
+        if chat_id not in self.scheduled:
+            self._schedule(chat_id)
+        return future
+
+    async def send(self, text, chat_id=None, max_retries=5):
+        """Отправка с ожиданием доставки"""
+        future = self.enqueue(text, chat_id, max_retries)
+        if future is None:
+            return False
+        return await future
+
+    async def validate(self):
+        if not self.configured:
+            logger.error("Telegram credentials not set")
+            return False
+        self.start()
+        try:
+            async with self.session.get(self._method_url('getMe'),
+                                        timeout=aiohttp.ClientTimeout(total=10)) as response:
                 if response.status == 200:
                     return True
                 data = await response.json()
                 logger.error("Token validation failed: %s", data.get('description', 'Unknown error'))
-    except Exception as e:
-        logger.error("Error validating token: %s", str(e))
-    return False
-
-async def send_telegram_message(message: str, max_retries=5):
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        logger.error("Telegram credentials not set. Skipping message.")
+        except Exception as e:
+            logger.error("Error validating token: %s", str(e))
         return False
-        
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "parse_mode": "HTML"
-    }
-    
-    for attempt in range(max_retries):
+
+    def _chat_bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, capacity=1)
+        return self.chat_buckets[chat_id]
+
+    def _schedule(self, chat_id):
+        """Ставит чат в очередь готовых, когда у него появится токен"""
+        self.scheduled.add(chat_id)
+        delay = self._chat_bucket(chat_id).wait_time()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.ready.put_nowait, chat_id)
+        else:
+            self.ready.put_nowait(chat_id)
+
+    async def _sender(self):
+        while True:
+            chat_id = await self.ready.get()
+            messages = self.chats.get(chat_id)
+            if not messages:
+                self.scheduled.discard(chat_id)
+                continue
+            if not self._chat_bucket(chat_id).try_acquire():
+                # Чат снова на паузе: ждет своего времени без участия отправителя
+                self._schedule(chat_id)
+                continue
+            message = messages[0]
+            if message['started'] is None:
+                message['started'] = time.perf_counter()
+            try:
+                result = await self._deliver(chat_id, message)
+            except Exception as e:
+                logger.error("Unexpected error: %s", str(e))
+                result = False
+            if result is not None:
+                messages.popleft()
+                self.pending -= 1
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - message['started'])
+                if not message['future'].done():
+                    message['future'].set_result(result)
+            if messages:
+                self._schedule(chat_id)
+            else:
+                self.scheduled.discard(chat_id)
+                del self.chats[chat_id]
+            if not self.pending:
+                self.idle.set()
+
+    async def _deliver(self, chat_id, message):
+        """Одна попытка: True/False - итог, None - повторить, когда чат снова будет готов"""
+        payload = {
+            "chat_id": chat_id,
+            "text": message['text'],
+            "parse_mode": "HTML"
+        }
+        chat_bucket = self._chat_bucket(chat_id)
+        await self.global_bucket.acquire()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=15)) as response:
-                    if response.status == 200:
-                        bot_status['signals_sent'] = bot_status.get('signals_sent', 0) + 1
-                        return True
-                    elif response.status == 429:
-                        retry_after = int(response.headers.get('Retry-After', 5))
-                        logger.warning("Rate limited. Waiting %s seconds...", retry_after)
-                        await asyncio.sleep(retry_after)
-                        continue
-                    else:
-                        error_text = await response.text()
-                        logger.error("Failed to send message. Status: %s, Response: %s", response.status, error_text[:200])
+            async with self.session.post(self._method_url('sendMessage'), json=payload) as response:
+                if response.status == 200:
+                    bot_status['signals_sent'] = bot_status.get('signals_sent', 0) + 1
+                    return True
+                elif response.status == 429:
+                    retry_after = int(response.headers.get('Retry-After', 5))
+                    try:
+                        data = await response.json()
+                        retry_after = int(data.get('parameters', {}).get('retry_after', retry_after))
+                    except Exception:
+                        pass
+                    logger.warning("Rate limited. Pausing chat %s for %s seconds...", chat_id, retry_after)
+                    # Ожидание лимита не расходует попытки
+                    chat_bucket.pause(retry_after)
+                    return None
+                else:
+                    error_text = await response.text()
+                    logger.error("Failed to send message. Status: %s, Response: %s", response.status, error_text[:200])
+                    if 400 <= response.status < 500:
+                        return False
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            logger.warning("Network error (attempt %s/%s): %s", attempt+1, max_retries, str(e))
-            await asyncio.sleep(2 ** attempt)
-        except Exception as e:
-            logger.error("Unexpected error: %s", str(e))
-            break
-            
-    logger.error("Failed to send message after %s attempts", max_retries)
-    return False
+            logger.warning("Network error (attempt %s/%s): %s", message['attempts'] + 1, message['max_retries'], str(e))
+            chat_bucket.pause(2 ** message['attempts'])
+
+        message['attempts'] += 1
+        if message['attempts'] >= message['max_retries']:
+            logger.error("Failed to send message after %s attempts", message['max_retries'])
+            return False
+        return None
+
+    async def close(self, timeout=10):
+        """Дожидается отправки очереди и закрывает соединения"""
+        if self.tasks:
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Telegram queue not drained: %d messages left", self.pending)
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+telegram_client = TelegramClient()
+registry.gauge('telegram_queue_depth', "Messages waiting to be sent", lambda: telegram_client.pending)
+
+async def validate_telegram_token():
+    return await telegram_client.validate()
+
+async def send_telegram_message(message: str, max_retries=5):
+    return await telegram_client.send(message, max_retries=max_retries)
 
 async def send_signal(symbol, timeframe, signal_type, strength, accuracy, indicators, signal_id):
     try:
@@ -76,7 +271,8 @@ async def send_signal(symbol, timeframe, signal_type, strength, accuracy, indica
 
 <b>Время:</b> {datetime.now().strftime('%H:%M:%S %d.%m.%Y')}
         """.strip()
-        return await send_telegram_message(message)
+        # Сигнал уходит через очередь, анализатор не ждет доставки
+        return telegram_client.enqueue(message) is not None
     except Exception as e:
         logger.error("Error sending signal: %s", str(e))
         return False
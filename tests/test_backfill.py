@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+import aiohttp
+import numpy as np
+import pytest
+from aiohttp import web
+import websocket
+from archive import candle_archive
+from backfill import KlineBackfill, merge_klines
+from candle_store import CandleStore
+from globals import TIMEFRAME_MS, market_data
+from websocket import CandleAggregator, StreamGate
+
+# Допуск на планирование задач и доставку по loopback, секунды
+SLACK = 0.05
+SYMBOL = 'BTCUSDT'
+
+def kline_row(timeframe, open_time):
+    """Строка /api/v3/klines, цены однозначно зависят от времени открытия"""
+    price = 100.0 + (open_time // TIMEFRAME_MS['1m']) % 50
+    return [open_time, str(price), str(price + 1), str(price - 1), str(price + 0.5), '10.0',
+            open_time + TIMEFRAME_MS[timeframe] - 1, '1000.0', 10, '5.0', '500.0', '0']
+
+class MockRestAPI:
+    """Локальная замена /api/v3/klines: свечи до текущего времени, последняя незакрыта"""
+
+    def __init__(self, limited=0, status=429, used_weight=None):
+        # Сколько первых запросов отклонить со status и Retry-After
+        self.limited = limited
+        self.status = status
+        self.retry_after = 1
+        # Значение X-MBX-USED-WEIGHT-1M; по умолчанию сумма весов запросов
+        self.used_weight = used_weight
+        self.requests = []
+        self.runner = None
+        self.url = None
+
+    async def klines(self, request):
+        params = request.query
+        limit = int(params['limit'])
+        self.requests.append((time.monotonic(), params['symbol'], params['interval'],
+                              int(params['startTime']), limit))
+        if self.limited:
+            self.limited -= 1
+            return web.json_response({'code': -1003, 'msg': 'Too many requests'}, status=self.status,
+                                     headers={'Retry-After': str(self.retry_after)})
+        frame_ms = TIMEFRAME_MS[params['interval']]
+        now_ms = int(time.time() * 1000)
+        start = -(-int(params['startTime']) // frame_ms) * frame_ms
+        rows = [kline_row(params['interval'], open_time)
+                for open_time in range(start, min(now_ms + 1, start + limit * frame_ms), frame_ms)]
+        used = self.used_weight if self.used_weight is not None else len(self.requests)
+        return web.json_response(rows, headers={'X-MBX-USED-WEIGHT-1M': str(used)})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/api/v3/klines', self.klines)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    # История не должна попадать в архив рабочего каталога
+    monkeypatch.setattr(candle_archive, 'enabled', False)
+    market_data.pop(SYMBOL, None)
+    yield
+    market_data.pop(SYMBOL, None)
+
+def test_paginates_and_drops_unclosed_candle():
+    async def scenario():
+        async with MockRestAPI() as api:
+            backfill = KlineBackfill(base_url=api.url, candles=2500)
+            loaded = await backfill.run(pairs=[SYMBOL], timeframes=['1m'])
+        return api, loaded
+
+    api, loaded = asyncio.run(scenario())
+    assert loaded == 2500
+    # 2500 закрытых свечей и текущая: три страницы, каждая продолжает предыдущую
+    assert [request[4] for request in api.requests] == [1000, 1000, 501]
+    starts = [request[3] for request in api.requests]
+    assert [later - earlier for earlier, later in zip(starts, starts[1:])] == [1000 * 60_000] * 2
+    store = market_data[SYMBOL]['1m']
+    now_ms = int(time.time() * 1000)
+    current = now_ms - now_ms % 60_000
+    assert store.last_closed
+    # Последняя строка - закрытая свеча перед текущей (минута могла смениться во время теста)
+    assert current - 2 * 60_000 <= store.last()['timestamp'] < current
+    timestamps = store.tail()['timestamp']
+    assert np.all(np.diff(timestamps) == 60_000)
+
+def test_waits_for_next_minute_when_weight_is_used_up():
+    async def scenario():
+        # Окно веса - календарная минута, не начинаем на ее границе
+        if time.time() % 60 > 58:
+            await asyncio.sleep(60 - time.time() % 60 + 0.1)
+        async with MockRestAPI(used_weight=1000) as api:
+            backfill = KlineBackfill(base_url=api.url, candles=50, weight_limit=1000)
+            now_ms = int(time.time() * 1000)
+            async with aiohttp.ClientSession() as session:
+                backfill.session = session
+                first = await backfill.fetch(SYMBOL, '1m', backfill.start_time(SYMBOL, '1m', now_ms), now_ms)
+                second = asyncio.create_task(
+                    backfill.fetch('ETHUSDT', '1m', backfill.start_time('ETHUSDT', '1m', now_ms), now_ms))
+                await asyncio.sleep(0.5)
+                blocked = not second.done()
+                second.cancel()
+        return api, backfill, first, blocked
+
+    api, backfill, first, blocked = asyncio.run(scenario())
+    assert len(first) == 50
+    # Заголовок сообщил, что вес минуты исчерпан: следующий запрос ждет новой минуты
+    assert backfill.used_weight == 1000
+    assert blocked
+    assert len(api.requests) == 1
+    assert backfill.blocked_until > time.time()
+    assert backfill.blocked_until % 60 == 0
+
+@pytest.mark.parametrize('status', [418, 429])
+def test_pauses_for_retry_after(status):
+    async def scenario():
+        async with MockRestAPI(limited=1, status=status) as api:
+            backfill = KlineBackfill(base_url=api.url, candles=10)
+            loaded = await backfill.run(pairs=[SYMBOL], timeframes=['1m'])
+        return api, loaded
+
+    api, loaded = asyncio.run(scenario())
+    assert loaded == 10
+    assert len(api.requests) == 2
+    assert api.requests[1][0] - api.requests[0][0] >= api.retry_after - SLACK
+
+def test_merge_keeps_live_candle():
+    frame_ms = TIMEFRAME_MS['1m']
+    current = 1_700_000_040_000 - 1_700_000_040_000 % frame_ms
+    store = market_data.setdefault(SYMBOL, {}).setdefault('1m', CandleStore())
+    store.update(current - frame_ms, 1.0, 2.0, 0.5, 1.5, 3.0, True)
+    store.update(current, 7.0, 8.0, 6.0, 7.5, 9.0, False)
+    # История с устаревшей копией текущей свечи
+    merge_klines(SYMBOL, '1m', [kline_row('1m', current - i * frame_ms) for i in range(5, -1, -1)])
+
+    timestamps = store.tail()['timestamp']
+    assert list(timestamps) == [current - i * frame_ms for i in range(5, -1, -1)]
+    last = store.last()
+    assert (last['open'], last['close'], last['volume'], last['is_closed']) == (7.0, 7.5, 9.0, False)
+    # Закрытая строка из буфера тоже не перезаписывается
+    assert store.tail()['close'][-2] == 1.5
+
+def test_gate_replays_candle_closed_during_backfill(monkeypatch, caplog):
+    aggregator = CandleAggregator(base='1m', targets=['5m'])
+    monkeypatch.setattr(websocket, 'candle_aggregator', aggregator)
+    gate = StreamGate(websocket.handle_kline)
+    now_ms = int(time.time() * 1000)
+    current = now_ms - now_ms % 60_000
+    row = kline_row('1m', current)
+    closing = {'t': current, 'o': row[1], 'h': row[2], 'l': row[3], 'c': row[4], 'v': row[5], 'x': True}
+
+    async def scenario():
+        gate.hold([SYMBOL])
+        # Текущая минута закрылась, пока грузилась история
+        await gate(SYMBOL, '1m', closing)
+        async with MockRestAPI() as api:
+            await KlineBackfill(base_url=api.url, candles=20).run(pairs=[SYMBOL], timeframes=['1m', '5m'],
+                                                                aggregator=aggregator)
+        return await gate.release([SYMBOL])
+
+    with caplog.at_level(logging.WARNING, logger='websocket'):
+        released = asyncio.run(scenario())
+    assert released == 1
+    assert not [record for record in caplog.records if 'Gap' in record.getMessage()]
+    state = aggregator.state[(SYMBOL, '5m')]
+    assert state['complete']
+    assert state['next'] >= current + 60_000
+    assert market_data[SYMBOL]['1m'].last()['timestamp'] >= current
+    assert market_data[SYMBOL]['5m'].last()['timestamp'] == current - current % TIMEFRAME_MS['5m']
+    # После release сообщения идут сразу в обработчик
+    assert not gate.held
+
+def test_fetches_only_missing_tail_of_restored_history():
+    now_ms = int(time.time() * 1000)
+    current = now_ms - now_ms % 60_000
+    # Как после восстановления снимка: 20 закрытых свечей, последние три пропущены
+    opens = [current - i * 60_000 for i in range(23, 3, -1)]
+    merge_klines(SYMBOL, '1m', [kline_row('1m', open_time) for open_time in opens])
+
+    async def scenario():
+        async with MockRestAPI() as api:
+            loaded = await KlineBackfill(base_url=api.url, candles=20).run(pairs=[SYMBOL], timeframes=['1m'])
+        return api, loaded
+
+    api, loaded = asyncio.run(scenario())
+    assert len(api.requests) == 1
+    assert api.requests[0][3] == opens[-1] + 60_000
+    assert loaded >= 3
+    assert np.all(np.diff(market_data[SYMBOL]['1m'].tail()['timestamp']) == 60_000)
@@ -0,0 +1,44 @@
+import sqlite3
+import pytest
+import database
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'test.db')
+    previous = database.use_database(path)
+    yield path
+    database.db_writer.stop()
+    database.use_database(previous)
+
+def test_reads_before_init_return_empty(db_path):
+    # Нет файла базы: /signals и /signals/stats до /start
+    assert database.query_signals() == ([], None)
+    assert database.load_signal_stats() == {}
+    # Файл есть, таблиц нет
+    sqlite3.connect(db_path).close()
+    assert database.query_signals() == ([], None)
+    assert database.load_signal_stats() == {}
+
+def test_reads_migrate_old_schema(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('''
+            CREATE TABLE signals (id TEXT PRIMARY KEY, symbol TEXT, timeframe TEXT, signal_type TEXT,
+                                  strength REAL, accuracy REAL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                  indicators TEXT, profitable INTEGER DEFAULT NULL)
+        ''')
+        conn.execute("INSERT INTO signals (id, symbol, timeframe, signal_type, strength, accuracy, indicators, "
+                     "profitable) VALUES ('a', 'BTCUSDT', '1h', 'BUY', 0.8, 0.9, 'rsi,macd', 1)")
+    signals, _ = database.query_signals()
+    assert [signal['id'] for signal in signals] == ['a']
+    assert database.load_signal_stats('symbol') == {'symbol': {'BTCUSDT': {'total': 1, 'profitable': 1,
+                                                                           'hit_rate': 1.0}}}
+
+def test_signal_stats_rebuilt_once(db_path, monkeypatch):
+    calls = []
+    rebuild = database.rebuild_signal_stats
+    monkeypatch.setattr(database, 'rebuild_signal_stats', lambda cursor: calls.append(1) or rebuild(cursor))
+    database.init_database()
+    database.init_database()
+    # Сводка пуста (оцененных сигналов нет), но повторный пересчет не нужен
+    assert len(calls) == 1
+    assert database.load_signal_stats() == {}
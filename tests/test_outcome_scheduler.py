@@ -0,0 +1,53 @@
+import pytest
+from archive import candle_archive
+from candle_store import CandleStore
+from globals import TIMEFRAME_MS, market_data
+from outcome_scheduler import price_at
+
+SYMBOL = 'TESTUSDT'
+MINUTE = TIMEFRAME_MS['1m']
+HOUR = TIMEFRAME_MS['1h']
+# Момент оценки на границе часа
+MOMENT = 1_700_000_000_000 - 1_700_000_000_000 % HOUR
+
+def make_store(timeframe, first, last):
+    frame_ms = TIMEFRAME_MS[timeframe]
+    store = CandleStore(capacity=100)
+    for timestamp in range(first, last + 1, frame_ms):
+        store.update(timestamp, 1.0, 1.0, 1.0, timestamp / frame_ms, 1.0, True)
+    return store
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    archived = {}
+    monkeypatch.setattr(candle_archive, 'close_at',
+                        lambda symbol, timeframe, timestamp: archived.get((timeframe, timestamp)))
+    yield archived
+    market_data.pop(SYMBOL, None)
+
+def test_lagging_coarse_timeframe_falls_through_to_archive(clean_state):
+    # Минутная свеча вытеснена, но буфер уже ушел дальше момента; часовой еще не собран
+    market_data[SYMBOL] = {'1m': make_store('1m', MOMENT + 10 * MINUTE, MOMENT + 20 * MINUTE),
+                           '1h': make_store('1h', MOMENT - 5 * HOUR, MOMENT - 2 * HOUR)}
+    clean_state[('1m', MOMENT - MINUTE)] = 42.0
+    assert price_at(SYMBOL, MOMENT) == 42.0
+
+def test_waits_while_no_timeframe_reached_moment():
+    market_data[SYMBOL] = {'1m': make_store('1m', MOMENT - 20 * MINUTE, MOMENT - 5 * MINUTE),
+                           '1h': make_store('1h', MOMENT - 5 * HOUR, MOMENT - 2 * HOUR)}
+    assert price_at(SYMBOL, MOMENT) is None
+
+def test_lagging_timeframe_is_retried_after_archive_miss():
+    market_data[SYMBOL] = {'1m': make_store('1m', MOMENT + 10 * MINUTE, MOMENT + 20 * MINUTE),
+                           '1h': make_store('1h', MOMENT - 5 * HOUR, MOMENT - 2 * HOUR)}
+    assert price_at(SYMBOL, MOMENT) is None
+
+def test_missing_everywhere_raises():
+    market_data[SYMBOL] = {'1m': make_store('1m', MOMENT + 10 * MINUTE, MOMENT + 20 * MINUTE)}
+    with pytest.raises(KeyError):
+        price_at(SYMBOL, MOMENT)
+
+def test_finest_closed_candle_wins():
+    market_data[SYMBOL] = {'1m': make_store('1m', MOMENT - 20 * MINUTE, MOMENT + 5 * MINUTE),
+                           '1h': make_store('1h', MOMENT - 5 * HOUR, MOMENT - 2 * HOUR)}
+    assert price_at(SYMBOL, MOMENT) == (MOMENT - MINUTE) / MINUTE
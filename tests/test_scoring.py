@@ -0,0 +1,61 @@
+import numpy as np
+from scoring import SignalScorer, signal_matrix, signal_strength, SCORING_COLUMNS
+
+BULLISH = {
+    'close': 90.0, 'EMA_12': 101.0, 'EMA_26': 100.0, 'SMA_20': 85.0, 'MACD': 1.0, 'MACD_signal': 0.5,
+    'Supertrend': 88.0, 'ADX': 30.0, 'RSI': 30.0, 'Stoch_k': 20.0, 'Stoch_d': 22.0, 'Williams': -80.0,
+    'CCI': -100.0, 'BB_upper': 110.0, 'BB_lower': 95.0, 'KC_upper': 108.0, 'KC_lower': 92.0,
+    'Volume_Osc': 5.0, 'OBV_trend': 10.0, 'Bullish_Engulfing': True, 'Bearish_Engulfing': False,
+    'Hammer': True, 'Pin_Bar_bull': True, 'Pin_Bar_bear': False
+}
+BEARISH = {
+    'close': 120.0, 'EMA_12': 99.0, 'EMA_26': 100.0, 'SMA_20': 125.0, 'MACD': 0.2, 'MACD_signal': 0.5,
+    'Supertrend': -1.0, 'ADX': 15.0, 'RSI': 70.0, 'Stoch_k': 80.0, 'Stoch_d': 90.0, 'Williams': -10.0,
+    'CCI': 120.0, 'BB_upper': 110.0, 'BB_lower': 95.0, 'KC_upper': 115.0, 'KC_lower': 92.0,
+    'Volume_Osc': -5.0, 'OBV_trend': -10.0, 'Bullish_Engulfing': False, 'Bearish_Engulfing': True,
+    'Hammer': False, 'Pin_Bar_bull': False, 'Pin_Bar_bear': True
+}
+NEUTRAL = dict(BULLISH, RSI=50.0, Stoch_k=50.0, Stoch_d=50.0, Williams=-50.0, CCI=0.0, close=100.0,
+               KC_lower=92.0, Bullish_Engulfing=False, Hammer=False, Pin_Bar_bull=False)
+
+def rows(*latest):
+    return {column: [row[column] for row in latest] for column in SCORING_COLUMNS}
+
+def test_threshold_rules():
+    names, matrix = signal_matrix(rows(BULLISH, BEARISH, NEUTRAL))
+    votes = [dict(zip(names, row)) for row in matrix]
+    assert set(votes[0].values()) == {1.0}
+    assert votes[1] == {'EMA': -1.0, 'SMA': -1.0, 'MACD': -1.0, 'Supertrend': -1.0, 'ADX': 0.0, 'RSI': -1.0,
+                        'Stochastic': -1.0, 'Williams': -1.0, 'CCI': -1.0, 'Bollinger_Bands': -1.0,
+                        'Keltner_Channel': -1.0, 'Volume_Oscillator': -1.0, 'OBV': -1.0, 'Engulfing': -1.0,
+                        'Hammer': 0.0, 'Pin_Bar': -1.0}
+    for name in ('RSI', 'Stochastic', 'Williams', 'CCI', 'Bollinger_Bands', 'Keltner_Channel', 'Engulfing',
+                 'Hammer', 'Pin_Bar'):
+        assert votes[2][name] == 0.0, name
+
+def test_strength_is_weighted_mean_of_active_votes():
+    names, matrix = signal_matrix(rows(BULLISH, BEARISH))
+    weights = {'EMA': 0.1, 'MACD': 0.3, 'ADX': 0.2, 'Hammer': 0.4}
+    strength, active = signal_strength(names, matrix, weights)
+    assert np.isclose(strength[0], 1.0)
+    # У медвежьей строки ADX и Hammer молчат: (-0.1 - 0.3) / 0.4
+    assert np.isclose(strength[1], -1.0)
+    assert [names[j] for j in np.flatnonzero(active[1])] == ['EMA', 'MACD']
+    # Индикаторы без веса не активны
+    assert active[0].sum() == len(weights)
+
+    strength, active = signal_strength(names, np.zeros_like(matrix), weights)
+    assert np.all(strength == 0) and not active.any()
+
+def test_scorer_matches_signal_matrix():
+    scorer = SignalScorer()
+    weights = {name: 0.05 for name in ('EMA', 'SMA', 'MACD', 'RSI', 'OBV', 'Engulfing')}
+    for i, latest in enumerate((BULLISH, BEARISH, NEUTRAL) * 30):
+        scorer.update(('PAIR%d' % i, '1m'), latest)
+    keys = [('PAIR5', '1m'), ('PAIR0', '1m'), ('PAIR1', '1m')]
+    names, strength, active = scorer.score(keys, weights)
+    expected = signal_strength(*signal_matrix(rows(NEUTRAL, BULLISH, BEARISH)), weights)
+    assert np.allclose(strength, expected[0])
+    assert np.array_equal(active, expected[1])
+    assert np.array_equal(scorer.vector(('PAIR1', '1m')),
+                          np.array([float(BEARISH[column]) for column in SCORING_COLUMNS]))
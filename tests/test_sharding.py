@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+from sharding import ShardSupervisor, assign_shards
+
+PAIRS = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'XRPUSDT']
+
+def make_supervisor():
+    supervisor = ShardSupervisor(shards=2, strategy='round_robin', overrides={})
+    supervisor.sent = []
+    supervisor.send = lambda shard, kind, payload=None: supervisor.sent.append((shard, kind, payload))
+    for shard, pairs in assign_shards(PAIRS, 2, 'round_robin', {}).items():
+        supervisor.workers[shard] = {'pairs': pairs}
+    return supervisor
+
+def test_invalid_strategy_keeps_current_assignment():
+    supervisor = make_supervisor()
+    before = {shard: list(worker['pairs']) for shard, worker in supervisor.workers.items()}
+    with pytest.raises(ValueError):
+        asyncio.run(supervisor.rebalance(PAIRS, strategy='bogus'))
+    assert supervisor.strategy == 'round_robin'
+    assert {shard: worker['pairs'] for shard, worker in supervisor.workers.items()} == before
+    assert supervisor.sent == []
+    # Обычное перераспределение после ошибки работает
+    assert asyncio.run(supervisor.rebalance(PAIRS)) == before
+
+def test_valid_strategy_is_saved():
+    supervisor = make_supervisor()
+    assignment = asyncio.run(supervisor.rebalance(PAIRS, strategy='hash'))
+    assert supervisor.strategy == 'hash'
+    assert assignment == assign_shards(PAIRS, 2, 'hash', {})
+    assert {shard: worker['pairs'] for shard, worker in supervisor.workers.items()} == assignment
@@ -0,0 +1,90 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from candle_store import CandleStore
+from streaming_indicators import (IndicatorEngine, StreamingIndicators, NUMERIC_COLUMNS, compare_with_batch,
+                                  is_ready)
+
+# Допустимое относительное расхождение с пакетным расчетом
+TOLERANCE = 1e-6
+
+def synthetic_candles(n=600, seed=7):
+    """Случайное блуждание цены с правдоподобными high/low и объемом"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, n))
+    volume = rng.uniform(10, 1000, n)
+    timestamp = 1_700_000_000_000 + 60_000 * np.arange(n, dtype=np.int64)
+    return pd.DataFrame({'timestamp': timestamp, 'open': open_, 'high': high, 'low': low,
+                         'close': close, 'volume': volume})
+
+def close_enough(actual, expected):
+    if math.isnan(expected):
+        return math.isnan(actual)
+    return abs(actual - expected) <= TOLERANCE * max(abs(expected), 1e-12)
+
+def test_matches_batch_indicators():
+    pytest.importorskip('pandas_ta')
+    from indicators import TechnicalIndicators
+    df = synthetic_candles()
+    indicators = TechnicalIndicators.calculate_all_indicators(df.copy())
+    assert len(indicators) > 400
+
+    report = compare_with_batch(df, indicators)
+    assert set(report) == set(NUMERIC_COLUMNS) - {'OBV'}
+    worst = {column: error for column, error in report.items() if not error <= TOLERANCE}
+    assert not worst, f"streaming indicators drift from pandas_ta: {worst}"
+
+    # Тот же результат через IndicatorEngine и кольцевой буфер
+    store = CandleStore(capacity=len(df))
+    engine = IndicatorEngine()
+    for candle in df.itertuples(index=False):
+        store.update(candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume, True)
+        engine.latest('BTCUSDT', '1m', store)
+    row = engine.latest('BTCUSDT', '1m', store)
+    expected = indicators.iloc[-1]
+    for column in NUMERIC_COLUMNS:
+        if column != 'OBV':
+            assert close_enough(row[column], float(expected[column])), column
+
+def test_engine_incremental_matches_full_replay():
+    df = synthetic_candles(400)
+    store = CandleStore(capacity=150)
+    engine = IndicatorEngine()
+    for i, candle in enumerate(df.itertuples(index=False)):
+        # Незакрытая свеча дважды меняется до закрытия
+        for step in (0.3, 0.7):
+            close = candle.open + (candle.close - candle.open) * step
+            store.update(candle.timestamp, candle.open, max(candle.open, close), min(candle.open, close),
+                         close, candle.volume * step, False)
+            engine.latest('BTCUSDT', '1m', store)
+        store.update(candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume, True)
+        row = engine.latest('BTCUSDT', '1m', store)
+        if i > 100:
+            assert is_ready(row)
+
+    # Буфер переполнялся, но состояние потока накоплено по всей истории
+    fresh = StreamingIndicators()
+    for candle in df.itertuples(index=False):
+        expected = fresh.commit(candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume)
+    for column in NUMERIC_COLUMNS:
+        assert close_enough(row[column], expected[column]), column
+
+def test_peek_does_not_change_state():
+    df = synthetic_candles(120)
+    stream = StreamingIndicators()
+    for candle in df.iloc[:-1].itertuples(index=False):
+        stream.commit(candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume)
+    last = df.iloc[-1]
+    before = dict(stream.last_row)
+    stream.peek(last['timestamp'], last['open'], last['high'] * 1.1, last['low'] * 0.9, last['close'] * 1.05,
+                last['volume'] * 3)
+    assert stream.last_row == before
+    peeked = stream.peek(last['timestamp'], last['open'], last['high'], last['low'], last['close'], last['volume'])
+    committed = stream.commit(last['timestamp'], last['open'], last['high'], last['low'], last['close'],
+                              last['volume'])
+    for column in NUMERIC_COLUMNS:
+        assert close_enough(peeked[column], committed[column]), column
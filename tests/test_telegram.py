@@ -0,0 +1,166 @@
+import asyncio
+import time
+from aiohttp import web
+from telegram import TelegramClient
+
+# Допуск на планирование задач и доставку по loopback, секунды
+SLACK = 0.05
+
+class MockBotAPI:
+    """Локальная замена Bot API: sendMessage отвечает 200, 429 или 500 по заданному сценарию"""
+
+    def __init__(self, limited=None, failing=None):
+        # {chat_id: сколько первых запросов отклонить с 429}
+        self.limited = dict(limited or {})
+        # {chat_id: сколько первых запросов завершить ошибкой 500}
+        self.failing = dict(failing or {})
+        self.requests = []
+        self.retry_after = 1
+        self.runner = None
+        self.url = None
+
+    async def send_message(self, request):
+        payload = await request.json()
+        chat_id = payload['chat_id']
+        if self.limited.get(chat_id):
+            self.limited[chat_id] -= 1
+            self.requests.append((time.monotonic(), chat_id, 429))
+            return web.json_response({'ok': False, 'error_code': 429,
+                                      'description': 'Too Many Requests: retry later',
+                                      'parameters': {'retry_after': self.retry_after}}, status=429)
+        if self.failing.get(chat_id):
+            self.failing[chat_id] -= 1
+            self.requests.append((time.monotonic(), chat_id, 500))
+            return web.json_response({'ok': False, 'error_code': 500, 'description': 'Internal error'}, status=500)
+        self.requests.append((time.monotonic(), chat_id, 200))
+        return web.json_response({'ok': True, 'result': {'text': payload['text']}})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/sendMessage', self.send_message)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+    def delivered(self, chat_id=None):
+        return [at for at, chat, status in self.requests if status == 200 and chat_id in (None, chat)]
+
+def make_client(api, **kwargs):
+    options = {'token': 'TEST', 'chat_id': 'main', 'api_url': api.url, 'senders': 4,
+               'global_rate': 100, 'chat_rate': 100}
+    options.update(kwargs)
+    return TelegramClient(**options)
+
+def gaps(times):
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+def test_global_bucket_limits_all_chats():
+    async def scenario():
+        async with MockBotAPI() as api:
+            client = make_client(api, global_rate=5)
+            started = time.monotonic()
+            futures = [client.enqueue(f"message {i}", chat_id=f"chat{i}") for i in range(10)]
+            results = await asyncio.gather(*futures)
+            await client.close()
+        assert results == [True] * 10
+        times = sorted(api.delivered())
+        # Запас в 5 токенов уходит сразу, дальше не чаще 5 в секунду
+        assert times[4] - started < 0.5
+        assert times[-1] - started >= 5 / 5 - SLACK
+        assert min(gaps(times[5:])) >= 1 / 5 - SLACK
+
+    asyncio.run(scenario())
+
+def test_chat_bucket_spaces_messages_to_one_chat():
+    async def scenario():
+        async with MockBotAPI() as api:
+            client = make_client(api, chat_rate=4)
+            results = await asyncio.gather(*[client.enqueue(f"message {i}", chat_id='A') for i in range(4)],
+                                           client.enqueue("other chat", chat_id='B'))
+            await client.close()
+        assert results == [True] * 5
+        times = api.delivered('A')
+        assert len(times) == 4
+        assert min(gaps(times)) >= 1 / 4 - SLACK
+        # Лимит одного чата не задерживает другие
+        assert api.delivered('B')[0] < times[1]
+
+    asyncio.run(scenario())
+
+def test_retry_after_pauses_chat_and_resumes():
+    async def scenario():
+        async with MockBotAPI(limited={'A': 1}) as api:
+            client = make_client(api)
+            first = client.enqueue("first", chat_id='A')
+            await asyncio.sleep(0.1)
+            second = client.enqueue("second", chat_id='A')
+            other = client.enqueue("other", chat_id='B')
+            results = await asyncio.gather(first, second, other)
+            await client.close()
+        assert results == [True, True, True]
+        limited_at = next(at for at, chat, status in api.requests if status == 429)
+        chat_a = api.delivered('A')
+        assert len(chat_a) == 2
+        # Чат A молчит retry_after секунд, затем очередь по нему продолжается
+        assert chat_a[0] >= limited_at + api.retry_after - SLACK
+        # Чат B в это время обслуживается
+        assert api.delivered('B')[0] < limited_at + api.retry_after
+
+    asyncio.run(scenario())
+
+def test_gives_up_after_max_retries():
+    async def scenario():
+        async with MockBotAPI(failing={'A': 10}) as api:
+            client = make_client(api)
+            result = await client.send("never delivered", chat_id='A', max_retries=3)
+            await client.close()
+        assert result is False
+        assert [status for _, _, status in api.requests] == [500, 500, 500]
+
+    asyncio.run(scenario())
+
+def test_rate_limit_does_not_use_up_retries():
+    async def scenario():
+        async with MockBotAPI(limited={'A': 5}) as api:
+            api.retry_after = 0
+            client = make_client(api)
+            result = await client.send("delivered after pauses", chat_id='A', max_retries=2)
+            await client.close()
+        assert result is True
+        assert [status for _, _, status in api.requests] == [429] * 5 + [200]
+
+    asyncio.run(scenario())
+
+def test_paused_chats_do_not_hold_senders():
+    async def scenario():
+        async with MockBotAPI(limited={'A': 1, 'B': 1}) as api:
+            # Отправителей столько же, сколько чатов на паузе
+            client = make_client(api, senders=2)
+            paused = [client.enqueue("a", chat_id='A'), client.enqueue("b", chat_id='B')]
+            await asyncio.sleep(0.1)
+            started = time.monotonic()
+            other = await client.send("c", chat_id='C')
+            delivered_in = time.monotonic() - started
+            results = await asyncio.gather(*paused)
+            await client.close()
+        assert other is True
+        assert delivered_in < api.retry_after / 2
+        assert results == [True, True]
+
+    asyncio.run(scenario())
+
+def test_unconfigured_client_skips_messages():
+    async def scenario():
+        client = TelegramClient(token='', chat_id='')
+        assert client.enqueue("text") is None
+        assert await client.send("text") is False
+        assert client.session is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+import websockets
+import websocket
+from websocket import StreamManager, stream_name, CONTROL_MESSAGE_INTERVAL
+
+class StandInServer:
+    """Локальная замена Binance combined streams: запоминает подключения и управляющие сообщения"""
+
+    def __init__(self):
+        self.paths = []
+        self.controls = []
+        self.clients = []
+        self.server = None
+
+    async def handler(self, connection, path=None):
+        request = getattr(connection, 'request', None)
+        self.paths.append(path or getattr(connection, 'path', None) or request.path)
+        self.clients.append(connection)
+        async for message in connection:
+            data = json.loads(message)
+            self.controls.append((time.monotonic(), data))
+            await connection.send(json.dumps({'result': None, 'id': data['id']}))
+
+    async def __aenter__(self):
+        self.server = await websockets.serve(self.handler, '127.0.0.1', 0)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self):
+        port = next(iter(self.server.sockets)).getsockname()[1]
+        return f"ws://127.0.0.1:{port}"
+
+    async def push(self, stream, kline):
+        await self.clients[-1].send(json.dumps({'stream': stream, 'data': {'e': 'kline', 'k': kline}}))
+
+async def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+def make_manager(url, received, **kwargs):
+    async def handler(symbol, timeframe, kline):
+        received.append((symbol, timeframe, kline))
+    return StreamManager(base_url=url, handler=handler, **kwargs)
+
+def test_combined_stream_routing():
+    async def scenario():
+        received = []
+        async with StandInServer() as server:
+            manager = make_manager(server.url, received)
+            await manager.start([('BTCUSDT', '1m'), ('ETHUSDT', '5m')])
+            try:
+                await wait_for(lambda: server.clients)
+                assert server.paths == ['/stream?streams=btcusdt@kline_1m/ethusdt@kline_5m']
+                await server.push('ethusdt@kline_5m', {'t': 1, 'x': False})
+                await server.push('xrpusdt@kline_1m', {'t': 2, 'x': False})
+                await server.push('btcusdt@kline_1m', {'t': 3, 'x': True})
+                await wait_for(lambda: len(received) == 2)
+            finally:
+                await manager.stop()
+        assert received == [('ETHUSDT', '5m', {'t': 1, 'x': False}), ('BTCUSDT', '1m', {'t': 3, 'x': True})]
+
+    asyncio.run(scenario())
+
+def test_streams_are_packed_into_connections():
+    async def scenario():
+        async with StandInServer() as server:
+            manager = make_manager(server.url, [], max_connections=2, max_streams_per_connection=2)
+            await manager.start([(symbol, '1m') for symbol in ('AUSDT', 'BUSDT', 'CUSDT', 'DUSDT', 'EUSDT')])
+            try:
+                await wait_for(lambda: len(server.clients) == 2)
+                assert sorted(len(connection.streams) for connection in manager.connections) == [2, 2]
+                # Пятому потоку места нет
+                assert stream_name('EUSDT', '1m') not in manager.routes
+            finally:
+                await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_runtime_subscribe_without_reconnect():
+    async def scenario():
+        received = []
+        async with StandInServer() as server:
+            manager = make_manager(server.url, received)
+            await manager.start([('BTCUSDT', '1m')])
+            try:
+                await wait_for(lambda: server.clients)
+                await manager.subscribe([('ETHUSDT', '1m'), ('SOLUSDT', '1h')])
+                await wait_for(lambda: server.controls)
+                await server.push('solusdt@kline_1h', {'t': 1, 'x': False})
+                await wait_for(lambda: received)
+                assert received[0][:2] == ('SOLUSDT', '1h')
+
+                await manager.unsubscribe([('BTCUSDT', '1m')])
+                await wait_for(lambda: len(server.controls) == 2)
+                await server.push('btcusdt@kline_1m', {'t': 2, 'x': False})
+                await server.push('ethusdt@kline_1m', {'t': 3, 'x': False})
+                await wait_for(lambda: len(received) == 2)
+                assert received[1][:2] == ('ETHUSDT', '1m')
+            finally:
+                await manager.stop()
+        assert len(server.paths) == 1
+        (_, subscribe), (_, unsubscribe) = server.controls
+        assert subscribe['method'] == 'SUBSCRIBE'
+        assert subscribe['params'] == ['ethusdt@kline_1m', 'solusdt@kline_1h']
+        assert unsubscribe['method'] == 'UNSUBSCRIBE'
+        assert unsubscribe['params'] == ['btcusdt@kline_1m']
+        assert unsubscribe['id'] > subscribe['id']
+
+    asyncio.run(scenario())
+
+def test_control_messages_are_rate_limited():
+    async def scenario():
+        async with StandInServer() as server:
+            manager = make_manager(server.url, [])
+            await manager.start([('BTCUSDT', '1m')])
+            try:
+                await wait_for(lambda: server.clients)
+                for symbol in ('AUSDT', 'BUSDT', 'CUSDT', 'DUSDT'):
+                    await manager.subscribe([(symbol, '1m')])
+                await wait_for(lambda: len(server.controls) == 4)
+            finally:
+                await manager.stop()
+        times = [received for received, _ in server.controls]
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        # Небольшой допуск на доставку через loopback
+        assert min(gaps) >= CONTROL_MESSAGE_INTERVAL - 0.02
+        assert len(server.paths) == 1
+
+    asyncio.run(scenario())
+
+def test_dispatch_ignores_control_replies():
+    async def scenario():
+        received = []
+        manager = make_manager('ws://unused', received)
+        await manager.subscribe([('BTCUSDT', '1m')])
+        await manager.dispatch(json.dumps({'result': None, 'id': 1}))
+        await manager.dispatch(json.dumps({'error': {'code': 2, 'msg': 'Invalid request'}, 'id': 2}))
+        await manager.dispatch(json.dumps({'stream': 'btcusdt@kline_1m', 'data': {'k': {'t': 5}}}))
+        assert received == [('BTCUSDT', '1m', {'t': 5})]
+        assert websocket.stream_name('BTCUSDT', '1m') in manager.routes
+
+    asyncio.run(scenario())
@@ -2,77 +2,418 @@ import asyncio
 import websockets
 import json
 import logging
-from globals import TRADING_PAIRS, TIMEFRAMES, bot_status, market_data
+import time
+from collections import deque
+from candle_store import CandleStore
+from events import kline_events, CANDLE_CLOSED, CANDLE_UPDATED
+from indicator_cache import indicator_cache
+from archive import candle_archive
+from recorder import KlineRecorder
+from metrics import registry, KLINE_PROCESS_SECONDS
+from globals import (TRADING_PAIRS, TIMEFRAMES, bot_status, market_data, BINANCE_WS_URL,
+                     WS_MAX_CONNECTIONS, WS_MAX_STREAMS_PER_CONNECTION, AGGREGATE_TIMEFRAMES,
+                     BASE_TIMEFRAME, TIMEFRAME_MS, RECORD_KLINES)
 
 logger = logging.getLogger(__name__)
-websocket_tasks = []
+stream_manager = None
+candle_aggregator = None
 
-async def binance_websocket(symbol, timeframe):
-    stream_name = f"{symbol.lower()}@kline_{timeframe}"
-    uri = f"wss://stream.binance.com:9443/ws/{stream_name}"
-    
-    while bot_status.get('running', False):
+# Binance принимает не более 5 управляющих сообщений в секунду на соединение
+CONTROL_MESSAGE_INTERVAL = 0.25
+# Сколько ждать открытия соединений перед загрузкой истории, секунды
+CONNECT_TIMEOUT = 10
+
+def stream_name(symbol, timeframe):
+    return f"{symbol.lower()}@kline_{timeframe}"
+
+class StreamConnection:
+    """Одно combined-stream соединение (/stream?streams=a/b/c)"""
+
+    def __init__(self, manager, conn_id):
+        self.manager = manager
+        self.conn_id = conn_id
+        self.streams = set()
+        self.live_streams = set()
+        self.websocket = None
+        self.task = None
+        self.wakeup = asyncio.Event()
+        self.connected = asyncio.Event()
+        self._request_id = 0
+        self._last_control = 0.0
+        self._control_lock = asyncio.Lock()
+
+    @property
+    def uri(self):
+        return f"{self.manager.base_url}/stream?streams={'/'.join(sorted(self.streams))}"
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while self.manager.running:
+            if not self.streams:
+                # Пустое соединение не держим открытым, ждем новых подписок
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            try:
+                async with websockets.connect(self.uri, ping_interval=20, ping_timeout=25) as websocket:
+                    self.websocket = websocket
+                    self.live_streams = set(self.streams)
+                    self.connected.set()
+                    bot_status['connections'] = bot_status.get('connections', 0) + 1
+                    logger.info("Connection #%s opened with %d streams", self.conn_id, len(self.live_streams))
+                    try:
+                        # Подписки, изменившиеся во время установки соединения
+                        await self.sync_subscriptions()
+                        async for message in websocket:
+                            if not self.manager.running:
+                                break
+                            await self.manager.dispatch(message)
+                            if not self.streams:
+                                break
+                    finally:
+                        self.websocket = None
+                        self.connected.clear()
+                        self.live_streams = set()
+                        bot_status['connections'] = max(0, bot_status.get('connections', 0) - 1)
+            except websockets.ConnectionClosed as e:
+                logger.warning("Connection #%s closed: %s", self.conn_id, str(e))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("WebSocket error on connection #%s: %s", self.conn_id, str(e))
+                await asyncio.sleep(5)
+
+    async def send_control(self, method, params):
+        if self.websocket is None or not params:
+            return
+        async with self._control_lock:
+            delay = self._last_control + CONTROL_MESSAGE_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._request_id += 1
+            await self.websocket.send(json.dumps({
+                'method': method,
+                'params': sorted(params),
+                'id': self._request_id
+            }))
+            self._last_control = time.monotonic()
+
+    async def sync_subscriptions(self):
+        to_add = self.streams - self.live_streams
+        to_remove = self.live_streams - self.streams
         try:
-            async with websockets.connect(uri, ping_interval=20, ping_timeout=25) as websocket:
-                logger.info("Connected to %s %s", symbol, timeframe)
-                bot_status['connections'] = bot_status.get('connections', 0) + 1
-                
-                async for message in websocket:
-                    if not bot_status.get('running', False):
-                        break
-                    data = json.loads(message)
-                    await process_kline_data(symbol, timeframe, data.get('k', {}))
-        except websockets.ConnectionClosed as e:
-            logger.warning("Connection closed for %s %s: %s", symbol, timeframe, str(e))
-        except Exception as e:
-            logger.error("WebSocket error for %s %s: %s", symbol, timeframe, str(e))
-            await asyncio.sleep(5)
-        finally:
-            bot_status['connections'] = max(0, bot_status.get('connections', 0) - 1)
+            if to_add:
+                await self.send_control('SUBSCRIBE', to_add)
+                self.live_streams |= to_add
+            if to_remove:
+                await self.send_control('UNSUBSCRIBE', to_remove)
+                self.live_streams -= to_remove
+        except websockets.ConnectionClosed:
+            # Переподключение само подхватит актуальный набор потоков
+            pass
+
+    async def add(self, streams):
+        self.streams |= set(streams)
+        self.wakeup.set()
+        if self.websocket is not None:
+            await self.sync_subscriptions()
+
+    async def remove(self, streams):
+        self.streams -= set(streams)
+        if self.websocket is not None:
+            await self.sync_subscriptions()
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.task = None
+
+class StreamManager:
+    """Упаковывает kline-потоки в небольшое число combined-stream соединений"""
+
+    def __init__(self, base_url=BINANCE_WS_URL, max_connections=WS_MAX_CONNECTIONS,
+                 max_streams_per_connection=WS_MAX_STREAMS_PER_CONNECTION, handler=None, recorder=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.max_streams_per_connection = max_streams_per_connection
+        self.handler = handler or handle_kline
+        self.recorder = recorder
+        self.connections = []
+        self.routes = {}  # stream -> (symbol, timeframe)
+        self.placement = {}  # stream -> StreamConnection
+        self.running = False
+
+    def _pick_connection(self):
+        candidates = [c for c in self.connections if len(c.streams) < self.max_streams_per_connection]
+        if candidates:
+            return min(candidates, key=lambda c: len(c.streams))
+        if len(self.connections) < self.max_connections:
+            connection = StreamConnection(self, len(self.connections) + 1)
+            self.connections.append(connection)
+            if self.running:
+                connection.start()
+            return connection
+        return None
+
+    async def subscribe(self, pairs):
+        """Подписка на список (symbol, timeframe) без переподключения"""
+        batches = {}
+        for symbol, timeframe in pairs:
+            name = stream_name(symbol, timeframe)
+            if name in self.placement:
+                continue
+            connection = self._pick_connection()
+            if connection is None:
+                logger.error("No capacity left for stream %s (%d connections x %d streams)",
+                             name, self.max_connections, self.max_streams_per_connection)
+                continue
+            self.routes[name] = (symbol, timeframe)
+            self.placement[name] = connection
+            # Резервируем место сразу, чтобы следующий поток учел загрузку
+            connection.streams.add(name)
+            batches.setdefault(connection, []).append(name)
+        for connection, names in batches.items():
+            await connection.add(names)
+
+    async def unsubscribe(self, pairs):
+        batches = {}
+        for symbol, timeframe in pairs:
+            name = stream_name(symbol, timeframe)
+            connection = self.placement.pop(name, None)
+            if connection is None:
+                continue
+            self.routes.pop(name, None)
+            batches.setdefault(connection, []).append(name)
+        for connection, names in batches.items():
+            await connection.remove(names)
+
+    async def dispatch(self, message):
+        data = json.loads(message)
+        name = data.get('stream')
+        if name is None:
+            # Ответы на SUBSCRIBE/UNSUBSCRIBE: {"result": null, "id": N}
+            if data.get('error'):
+                logger.error("Stream control error: %s", data['error'])
+            return
+        if self.recorder is not None:
+            self.recorder.record(message)
+        route = self.routes.get(name)
+        if route is None:
+            return
+        symbol, timeframe = route
+        await self.handler(symbol, timeframe, data.get('data', {}).get('k', {}))
+
+    async def wait_connected(self, timeout=CONNECT_TIMEOUT):
+        """Ждет открытия всех соединений с подписками; False, если не дождались за timeout"""
+        waiting = [connection.connected.wait() for connection in self.connections if connection.streams]
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiting), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Not all stream connections opened in %ss", timeout)
+            return False
+
+    async def start(self, pairs):
+        self.running = True
+        await self.subscribe(pairs)
+        for connection in self.connections:
+            connection.start()
+
+    async def stop(self):
+        self.running = False
+        for connection in self.connections:
+            await connection.stop()
+        self.connections = []
+        self.routes = {}
+        self.placement = {}
+        if self.recorder is not None:
+            self.recorder.close()
+
+class CandleAggregator:
+    """Строит старшие таймфреймы из закрытых и текущей свечей базового потока.
+
+    Границы баров выровнены по эпохе, как у Binance (1d начинается в 00:00 UTC).
+    Бар, начатый до запуска агрегатора, неполон и в market_data не попадает.
+    """
+
+    def __init__(self, base=BASE_TIMEFRAME, targets=TIMEFRAMES):
+        self.base = base
+        self.base_ms = TIMEFRAME_MS[base]
+        self.targets = [tf for tf in targets
+                        if TIMEFRAME_MS[tf] > self.base_ms and TIMEFRAME_MS[tf] % self.base_ms == 0]
+        self.state = {}  # (symbol, timeframe) -> накопленный по закрытым базовым свечам бар
+
+    def _bar(self, state, timeframe, is_closed, base=None):
+        open_, high, low, close, volume = state['open'], state['high'], state['low'], state['close'], state['volume']
+        if base is not None:
+            b_open, b_high, b_low, b_close, b_volume = base
+            if open_ is None:
+                open_, high, low = b_open, b_high, b_low
+            else:
+                high, low = max(high, b_high), min(low, b_low)
+            close = b_close
+            volume += b_volume
+        return {'t': state['bucket'], 'T': state['bucket'] + TIMEFRAME_MS[timeframe] - 1,
+                'i': timeframe, 'o': open_, 'h': high, 'l': low, 'c': close, 'v': volume, 'x': is_closed}
+
+    def update(self, symbol, kline):
+        """Возвращает список (timeframe, kline) для process_kline_data"""
+        start = int(kline['t'])
+        base = (float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c']), float(kline['v']))
+        base_closed = kline['x']
+        derived = []
+        for timeframe in self.targets:
+            frame_ms = TIMEFRAME_MS[timeframe]
+            bucket = start - start % frame_ms
+            key = (symbol, timeframe)
+            state = self.state.get(key)
+            if state is not None and bucket < state['bucket']:
+                continue
+            if state is None or bucket > state['bucket']:
+                if state is not None and state['complete'] and not state['emitted']:
+                    logger.warning("Missed closing %s candle for %s %s bar %s",
+                                   self.base, symbol, timeframe, state['bucket'])
+                state = {'bucket': bucket, 'complete': start == bucket, 'emitted': False, 'next': start,
+                         'open': None, 'high': None, 'low': None, 'close': None, 'volume': 0.0}
+                self.state[key] = state
+            if state['emitted'] or start < state['next']:
+                continue
+            if start > state['next']:
+                # Разрыв внутри бара: объем и экстремумы уже не восстановить
+                logger.warning("Gap in %s %s stream at %s, dropping %s bar", symbol, self.base, start, timeframe)
+                state['complete'] = False
+                state['next'] = start
+
+            is_closed = base_closed and start + self.base_ms == bucket + frame_ms
+            bar = self._bar(state, timeframe, is_closed, base)
+            if base_closed:
+                state.update(open=bar['o'], high=bar['h'], low=bar['l'], close=bar['c'], volume=bar['v'],
+                             next=start + self.base_ms)
+            if is_closed:
+                state['emitted'] = True
+            if state['complete']:
+                derived.append((timeframe, bar))
+        return derived
+
+class StreamGate:
+    """Задерживает сообщения потоков по парам, пока для них догружается история.
+
+    Поток подключается до загрузки истории через REST, его сообщения копятся
+    и после нее уходят в обработчик по порядку: свеча, закрывшаяся во время
+    загрузки, не теряется, а агрегатор не видит разрыва после затравки.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.held = {}  # symbol -> deque[(timeframe, kline)]
+
+    def hold(self, symbols):
+        for symbol in symbols:
+            self.held.setdefault(symbol, deque())
+
+    async def __call__(self, symbol, timeframe, kline):
+        buffer = self.held.get(symbol)
+        if buffer is not None:
+            buffer.append((timeframe, kline))
+            return
+        await self.handler(symbol, timeframe, kline)
+
+    async def release(self, symbols):
+        released = 0
+        for symbol in symbols:
+            buffer = self.held.get(symbol)
+            # Сообщения, пришедшие во время разбора, дописываются в тот же буфер
+            while buffer:
+                timeframe, kline = buffer.popleft()
+                await self.handler(symbol, timeframe, kline)
+                released += 1
+            self.held.pop(symbol, None)
+        return released
+
+    def clear(self):
+        self.held = {}
+
+async def handle_kline(symbol, timeframe, kline):
+    """Обработчик потока: базовые свечи дополнительно агрегируются в старшие таймфреймы"""
+    await process_kline_data(symbol, timeframe, kline)
+    if candle_aggregator is not None and kline and timeframe == candle_aggregator.base:
+        for derived_timeframe, derived in candle_aggregator.update(symbol, kline):
+            await process_kline_data(symbol, derived_timeframe, derived)
 
 async def process_kline_data(symbol, timeframe, kline):
     if not kline:
         return
-        
+
+    started = time.perf_counter()
     try:
-        candle = {
-            'open': float(kline['o']),
-            'high': float(kline['h']),
-            'low': float(kline['l']),
-            'close': float(kline['c']),
-            'volume': float(kline['v']),
-            'timestamp': kline['t'],
-            'is_closed': kline['x']
-        }
-        
+        is_closed = kline['x']
+
         if symbol not in market_data:
             market_data[symbol] = {}
         if timeframe not in market_data[symbol]:
-            market_data[symbol][timeframe] = []
-            
-        candles = market_data[symbol][timeframe]
-        
-        if candles and not candle['is_closed']:
-            candles[-1] = candle
-        elif candle['is_closed']:
-            candles.append(candle)
-            # Сохраняем только последние 500 свечей
-            if len(candles) > 500:
-                market_data[symbol][timeframe] = candles[-500:]
+            market_data[symbol][timeframe] = CandleStore()
+
+        updated = market_data[symbol][timeframe].update(
+            int(kline['t']),
+            float(kline['o']),
+            float(kline['h']),
+            float(kline['l']),
+            float(kline['c']),
+            float(kline['v']),
+            is_closed
+        )
+        if not updated:
+            return
+        indicator_cache.invalidate(symbol, timeframe)
+        if is_closed:
             bot_status['data_received'] = bot_status.get('data_received', 0) + 1
+            candle_archive.append(symbol, timeframe, int(kline['t']), float(kline['o']), float(kline['h']),
+                                  float(kline['l']), float(kline['c']), float(kline['v']))
+        kline_events.publish(symbol, timeframe, CANDLE_CLOSED if is_closed else CANDLE_UPDATED)
     except Exception as e:
         logger.error("Error processing kline: %s", str(e))
+    KLINE_PROCESS_SECONDS.observe(time.perf_counter() - started)
+
+stream_gate = StreamGate(handle_kline)
+
+registry.gauge('ws_connections', "Open WebSocket connections", lambda: bot_status.get('connections', 0))
+registry.gauge('ws_streams', "Subscribed kline streams", lambda: len(stream_manager.routes) if stream_manager else 0)
+registry.gauge('candles_in_memory', "Candles held in ring buffers",
+               lambda: sum(len(store) for stores in list(market_data.values()) for store in list(stores.values())))
+registry.gauge('kline_event_queue_depth', "Streams waiting for analysis", kline_events.qsize)
+
+def upstream_timeframes():
+    """Таймфреймы, на которые нужна подписка у Binance"""
+    if candle_aggregator is None:
+        return list(TIMEFRAMES)
+    return [candle_aggregator.base] + [tf for tf in TIMEFRAMES
+                                       if tf != candle_aggregator.base and tf not in candle_aggregator.targets]
+
+def init_candle_aggregator(enabled=AGGREGATE_TIMEFRAMES):
+    global candle_aggregator
+    candle_aggregator = CandleAggregator() if enabled else None
+    return candle_aggregator
 
 async def start_websocket_connections():
-    global websocket_tasks
-    for symbol in TRADING_PAIRS:
-        for timeframe in TIMEFRAMES:
-            task = asyncio.create_task(binance_websocket(symbol, timeframe))
-            websocket_tasks.append(task)
-            await asyncio.sleep(0.1)
+    global stream_manager
+    if candle_aggregator is None:
+        init_candle_aggregator()
+    stream_manager = StreamManager(handler=stream_gate, recorder=KlineRecorder() if RECORD_KLINES else None)
+    await stream_manager.start([(symbol, timeframe) for symbol in TRADING_PAIRS
+                                for timeframe in upstream_timeframes()])
+    return stream_manager
 
 async def stop_websocket_connections():
-    global websocket_tasks
-    for task in websocket_tasks:
-        task.cancel()
-    websocket_tasks = []
+    global stream_manager, candle_aggregator
+    if stream_manager:
+        await stream_manager.stop()
+        stream_manager = None
+    stream_gate.clear()
+    candle_aggregator = None